@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+近似最近邻索引模块（IVF，纯NumPy实现）
+"""
+
+import logging
+import numpy as np
+from typing import Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class IVFIndex:
+    """倒排文件(IVF)索引：球面k-means聚类 + 按聚类中心倒排的行号列表
+
+    输入向量需已L2归一化，内积即余弦相似度。
+    """
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, kmeans_iters: int = 20,
+                 train_points_per_list: int = 256, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.train_points_per_list = train_points_per_list
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def ntotal(self) -> int:
+        return sum(len(ids) for ids in self._lists)
+
+    def train(self, embeddings: np.ndarray):
+        """在（采样后的）向量上训练聚类中心"""
+        count = embeddings.shape[0]
+        if count == 0:
+            return
+
+        nlist = self.nlist or int(4 * np.sqrt(count))
+        nlist = int(min(max(nlist, 1), count))
+        rng = np.random.default_rng(self.seed)
+
+        # 采样训练集
+        sample_size = min(count, nlist * self.train_points_per_list)
+        sample_rows = np.sort(rng.choice(count, sample_size, replace=False))
+        sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assignments = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+
+            # 空聚类用随机样本重新初始化
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+
+        self.centroids = centroids.astype(np.float32)
+        self.nlist = nlist
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        logger.info(f"IVF索引训练完成: {nlist} 个聚类, 训练样本 {sample_size}")
+
+    @staticmethod
+    def _assign(embeddings: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        """分块计算每个向量最近的聚类中心"""
+        assignments = np.empty(embeddings.shape[0], dtype=np.int64)
+        for start in range(0, embeddings.shape[0], chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
+
+    def add(self, embeddings: np.ndarray, start_row: int = 0):
+        """将向量加入倒排列表，行号从 start_row 开始连续编号"""
+        if not self.is_trained or embeddings.shape[0] == 0:
+            return
+
+        assignments = self._assign(embeddings, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.nlist)
+        rows = order + start_row
+
+        # 复制列表后替换，浅复制出的索引（及其检索方）仍看到原列表
+        lists = list(self._lists)
+        offset = 0
+        for list_id, count in enumerate(counts):
+            if count:
+                lists[list_id] = np.concatenate([lists[list_id], rows[offset:offset + count]])
+            offset += count
+        self._lists = lists
+
+    def remapped(self, mapping: np.ndarray) -> "IVFIndex":
+        """按旧行号 -> 新行号映射重写倒排列表，映射为-1的行被移除；返回新索引（共享聚类中心），原索引可继续检索"""
+        data = self.to_dict()
+        lists = []
+        for ids in self._lists:
+            new_ids = mapping[ids]
+            lists.append(new_ids[new_ids >= 0])
+        data["lists"] = lists
+        return IVFIndex.from_dict(data)
+
+    def reset(self):
+        """清空倒排列表，保留聚类中心"""
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(self.nlist)]
+
+    def search_candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """返回与查询最近的 nprobe 个聚类中的所有行号"""
+        if not self.is_trained:
+            return np.zeros(0, dtype=np.int64)
+
+        nprobe = int(min(max(nprobe or self.nprobe, 1), self.nlist))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+
+        return np.sort(np.concatenate([self._lists[i] for i in probes]))
+
+    def to_dict(self) -> Dict:
+        """导出为可持久化的字典"""
+        return {
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "kmeans_iters": self.kmeans_iters,
+            "train_points_per_list": self.train_points_per_list,
+            "seed": self.seed,
+            "centroids": self.centroids,
+            "lists": self._lists
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IVFIndex":
+        """从持久化字典恢复索引"""
+        index = cls(
+            nlist=data["nlist"],
+            nprobe=data["nprobe"],
+            kmeans_iters=data.get("kmeans_iters", 20),
+            train_points_per_list=data.get("train_points_per_list", 256),
+            seed=data.get("seed", 0)
+        )
+        index.centroids = data["centroids"]
+        index._lists = list(data["lists"]) if data["lists"] is not None else []
+        return index
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检索性能基准测试
+"""
+
+import os
+import re
+import time
+import random
+import argparse
+import logging
+import numpy as np
+from typing import Dict, List, Set, Tuple
+from data_models import Document
+from data_processor import DataProcessor
+from vector_store import IntelligentVectorStore
+from sharded_store import ShardedVectorStore
+from encoders import BACKENDS, load_encoder, parity_cosine
+from projection import EmbeddingProjection
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def load_documents(data_dir: str) -> List[Document]:
+    """读取目录下的全部文本文档"""
+    processor = DataProcessor()
+    documents = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith('.txt'):
+            document = processor.process_document(os.path.join(data_dir, filename))
+            if document:
+                documents.append(document)
+    return documents
+
+def build_queries(documents: List[Document], count: int, seed: int = 0) -> List[str]:
+    """从段落中抽取首句作为查询"""
+    sentences = []
+    for document in documents:
+        for paragraph in document.paragraphs:
+            sentence = re.split(r'[。？！\?\!]', paragraph)[0].strip()
+            if len(sentence) >= 6:
+                sentences.append(sentence[:40])
+
+    random.Random(seed).shuffle(sentences)
+    return sentences[:count]
+
+def synthesize_documents(documents: List[Document], count: int, seed: int = 0,
+                         sentences_per_paragraph: int = 3) -> List[Document]:
+    """把现有段落的句子随机重组成 count 个合成段落，用于需要较大语料的测试（如降维曲线）"""
+    sentences = []
+    for document in documents:
+        for paragraph in document.paragraphs:
+            sentences.extend(part.strip() for part in re.split(r'(?<=[。？！\?\!])', paragraph) if part.strip())
+    if not sentences:
+        return []
+
+    rng = random.Random(seed)
+    # 去重：重复段落的相似度完全相同，会让 recall@k 受并列排序影响
+    paragraphs = {}
+    for _ in range(count * 10):
+        if len(paragraphs) >= count:
+            break
+        paragraphs.setdefault(''.join(rng.sample(sentences, min(sentences_per_paragraph, len(sentences)))), None)
+    paragraphs = list(paragraphs)
+    count = len(paragraphs)
+    per_document = 50
+    return [Document(id=f"synthetic_{start // per_document}", title=f"合成文档{start // per_document}",
+                     content='\n'.join(paragraphs[start:start + per_document]),
+                     paragraphs=paragraphs[start:start + per_document])
+            for start in range(0, count, per_document)]
+
+def recall_at_k(reference: List[Set], candidate: List[Set]) -> float:
+    """平均 recall@k：候选结果覆盖参考结果的比例"""
+    recalls = [len(ref & cand) / len(ref) for ref, cand in zip(reference, candidate) if ref]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+def exact_top_rows(store: IntelligentVectorStore, query_embeddings: np.ndarray, top_k: int) -> List[Set]:
+    """按原始相似度取每个查询的前 top_k 行（不含质量加权与多样化）"""
+    results = []
+    for query_embedding in query_embeddings:
+        scores = store._score_embeddings(query_embedding)
+        top = np.argpartition(-scores, min(top_k, len(scores)) - 1)[:top_k]
+        results.append(set(top.tolist()))
+    return results
+
+def search_results(store: IntelligentVectorStore, queries: List[str], top_k: int) -> Tuple[List[Set], float]:
+    """端到端检索结果（文档ID, 段落序号）与平均耗时（毫秒）"""
+    results = []
+    start_time = time.time()
+    for query in queries:
+        results.append({(r.doc_id, r.paragraph_index) for r in store.intelligent_search(query, top_k=top_k)})
+    return results, (time.time() - start_time) * 1000 / max(len(queries), 1)
+
+def benchmark_storage_dtype(store: IntelligentVectorStore, queries: List[str], top_k: int) -> List[Dict]:
+    """对比 float32 与 float16 存储的 recall@k、内存与检索耗时"""
+    original_storage = Config.EMBEDDING_STORAGE
+    query_embeddings = store._project_queries(store._encode_queries(queries))
+    rows = []
+    try:
+        reference_rows = reference_results = None
+        for storage in ("float32", "float16"):
+            Config.EMBEDDING_STORAGE = storage
+            store.convert_embedding_storage()
+
+            top_rows = exact_top_rows(store, query_embeddings, top_k)
+            results, latency_ms = search_results(store, queries, top_k)
+            if reference_rows is None:
+                reference_rows, reference_results = top_rows, results
+
+            rows.append({
+                "storage": storage,
+                "embedding_bytes": int(store.paragraph_embeddings.nbytes),
+                f"raw_recall@{top_k}": round(recall_at_k(reference_rows, top_rows), 4),
+                f"search_recall@{top_k}": round(recall_at_k(reference_results, results), 4),
+                "search_ms": round(latency_ms, 3)
+            })
+    finally:
+        Config.EMBEDDING_STORAGE = original_storage
+        store.convert_embedding_storage()
+    return rows
+
+def benchmark_candidate_stages(store: IntelligentVectorStore, queries: List[str], top_k: int,
+                               stages=("exact", "quantized", "lexical", "ann")) -> List[Dict]:
+    """对比各第一阶段候选生成方式的检索耗时与相对全量精确打分的 recall@k"""
+    original_stage = store.candidate_stage
+    rows = []
+    try:
+        reference = None
+        for stage in stages:
+            # 只切换该存储的候选生成方式，并按需建立所需的量化码与ANN索引
+            active = store.prepare_candidate_stage(stage) or "exact"
+
+            results, latency_ms = search_results(store, queries, top_k)
+            if reference is None:
+                reference = results
+            rows.append({
+                "stage": stage,
+                "active": active,
+                f"search_recall@{top_k}": round(recall_at_k(reference, results), 4),
+                "search_ms": round(latency_ms, 3)
+            })
+    finally:
+        store.prepare_candidate_stage(original_stage)
+    return rows
+
+def benchmark_projection(store: IntelligentVectorStore, queries: List[str], top_k: int,
+                         dims=(256, 192, 128, 96, 64, 48, 32, 16)) -> List[Dict]:
+    """降维后的 recall@k 随维度变化曲线（以原始维度的精确检索结果为参考）"""
+    rows = [row for row, _ in store.iter_paragraphs()]
+    texts = [store.paragraph_table.text(row) for row in rows]
+    # 从模型（或向量缓存）取原始维度向量，不受存储当前是否已投影影响
+    embeddings = store._normalize(store._encode_paragraphs(texts, Config.EMBEDDING_BATCH_SIZE))
+    query_embeddings = store._normalize(store.model.encode(
+        queries, batch_size=Config.EMBEDDING_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False))
+    full_dim = embeddings.shape[1]
+    k = min(top_k, len(rows))
+    # PCA 最多只能从 n 个样本中估出 n 个有效方向，dim >= 段落数的点没有意义
+    valid_dims = [dim for dim in dims if dim < min(full_dim, len(rows))]
+    min_rows = 10 * max([dim for dim in dims if dim < full_dim] or [top_k])
+    if len(rows) < min_rows:
+        logger.warning(f"段落数 {len(rows)} 过少，降维曲线不具参考价值（建议至少 {min_rows} 段，"
+                       f"可用 --synthetic 生成合成语料）")
+
+    def top_rows(matrix: np.ndarray, query_matrix: np.ndarray) -> Tuple[List[Set], float]:
+        start_time = time.perf_counter()
+        scores = query_matrix @ matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        latency_ms = (time.perf_counter() - start_time) * 1000 / max(len(queries), 1)
+        return [set(row.tolist()) for row in top], latency_ms
+
+    reference, reference_ms = top_rows(embeddings, query_embeddings)
+    results = [{
+        "mode": "none",
+        "dim": full_dim,
+        "embedding_bytes": int(embeddings.nbytes),
+        f"recall@{top_k}": 1.0,
+        "explained_variance": 1.0,
+        "score_ms": round(reference_ms, 4)
+    }]
+    for mode in ("pca", "truncate"):
+        for dim in valid_dims:
+            projection = EmbeddingProjection(dim, mode=mode)
+            projection.train(embeddings)
+            projected = store._normalize(projection.project(embeddings))
+            found, latency_ms = top_rows(projected, store._normalize(projection.project(query_embeddings)))
+            results.append({
+                "mode": mode,
+                "dim": dim,
+                "embedding_bytes": int(projected.nbytes),
+                f"recall@{top_k}": round(recall_at_k(reference, found), 4),
+                "explained_variance": round(projection.explained_variance_ratio, 4) if mode == "pca" else "-",
+                "score_ms": round(latency_ms, 4)
+            })
+    return results
+
+def benchmark_shards(store: IntelligentVectorStore, documents: List[Document], queries: List[str], top_k: int,
+                     shard_counts=(2, 4)) -> List[Dict]:
+    """对比单进程存储与多进程分片存储的单查询/批量检索耗时及结果一致性（以单进程结果为参考）"""
+    reference, latency_ms = search_results(store, queries, top_k)
+    start_time = time.time()
+    store.intelligent_search_batch(queries, top_k=top_k)
+    rows = [{
+        "shards": 1,
+        f"search_recall@{top_k}": 1.0,
+        "search_ms": round(latency_ms, 3),
+        "batch_ms_per_query": round((time.time() - start_time) * 1000 / max(len(queries), 1), 3)
+    }]
+    for num_shards in shard_counts:
+        sharded = ShardedVectorStore(num_shards, rebuild=True)
+        try:
+            sharded.add_documents(documents)
+            # 预热：首次请求包含分片进程内的延迟初始化
+            sharded.intelligent_search(queries[0], top_k=top_k)
+            results, latency_ms = search_results(sharded, queries, top_k)
+            start_time = time.time()
+            sharded.intelligent_search_batch(queries, top_k=top_k)
+            rows.append({
+                "shards": num_shards,
+                f"search_recall@{top_k}": round(recall_at_k(reference, results), 4),
+                "search_ms": round(latency_ms, 3),
+                "batch_ms_per_query": round((time.time() - start_time) * 1000 / max(len(queries), 1), 3)
+            })
+        finally:
+            sharded.close()
+    return rows
+
+def benchmark_encoders(queries: List[str], model_name: str = Config.VECTOR_MODEL,
+                       backends=BACKENDS) -> List[Dict]:
+    """对比各编码后端的单查询延迟、批量吞吐与相对torch全精度模型的一致性"""
+    reference, _ = load_encoder(model_name, "torch")
+    rows = []
+    for backend in backends:
+        encoder, used = load_encoder(model_name, backend, check_parity=False)
+        if used != backend:
+            rows.append({"backend": backend, "available": False})
+            continue
+
+        encoder.encode(queries[:1], convert_to_numpy=True, show_progress_bar=False)
+        latencies = []
+        for query in queries:
+            start_time = time.perf_counter()
+            encoder.encode(query, convert_to_numpy=True, show_progress_bar=False)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+
+        start_time = time.perf_counter()
+        encoder.encode(queries, batch_size=Config.EMBEDDING_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False)
+        batch_seconds = time.perf_counter() - start_time
+
+        rows.append({
+            "backend": backend,
+            "available": True,
+            "query_ms_mean": round(float(np.mean(latencies)), 3),
+            "query_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+            "batch_texts_per_second": round(len(queries) / batch_seconds, 1) if batch_seconds > 0 else 0.0,
+            "min_cosine_vs_torch": round(parity_cosine(reference, encoder, queries), 5)
+        })
+    return rows
+
+def print_table(title: str, rows: List[Dict]):
+    """打印结果表格"""
+    print(f"\n== {title} ==")
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join(str(row.get(column, "-")) for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="检索性能基准测试")
+    parser.add_argument("--data-dir", default="test_data", help="文档目录")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("--top-k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument("--synthetic", type=int, default=0, help="用现有句子重组出的合成段落数（0 表示不使用）")
+    parser.add_argument("--suite", choices=["all", "storage", "stages", "projection", "shards", "encoders"], default="all", help="测试项")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    documents = load_documents(args.data_dir)
+    if args.synthetic > 0:
+        documents = synthesize_documents(documents, args.synthetic)
+    queries = build_queries(documents, args.queries)
+
+    if args.suite in ("all", "encoders"):
+        print_table("编码后端延迟与一致性", benchmark_encoders(queries))
+
+    if args.suite in ("all", "storage", "stages", "projection", "shards"):
+        store = IntelligentVectorStore()
+        store.add_documents(documents)
+        print(f"文档数: {len(documents)}, 段落数: {store.paragraph_count}, 查询数: {len(queries)}")
+        if args.suite in ("all", "storage"):
+            print_table("向量存储精度 float32 vs float16", benchmark_storage_dtype(store, queries, args.top_k))
+        if args.suite in ("all", "stages"):
+            print_table("两阶段检索：候选生成方式", benchmark_candidate_stages(store, queries, args.top_k))
+        if args.suite in ("all", "projection"):
+            print_table("降维维度与 recall@k", benchmark_projection(store, queries, args.top_k))
+        if args.suite in ("all", "shards"):
+            print_table("多进程分片检索", benchmark_shards(store, documents, queries, args.top_k))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+缓存模块
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """线程安全的LRU缓存，可选过期时间，并统计命中率"""
+
+    def __init__(self, max_entries: int, ttl: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """查询，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if not expires_at or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        """写入并淘汰最久未使用的条目"""
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        """移除条目（不存在时忽略）"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+class EmbeddingCache:
+    """段落向量持久化缓存
+
+    键为 (模型名, 段落文本) 的SHA1摘要，值为模型原始输出向量，
+    超出容量时按最近最少使用淘汰。
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        return hashlib.sha1(f"{model_name}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询，未命中的位置为None"""
+        self._ensure_loaded()
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.make_key(model_name, text)
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                results.append(embedding)
+        return results
+
+    def put_many(self, model_name: str, texts: List[str], embeddings: np.ndarray):
+        """批量写入并淘汰超出容量的旧条目"""
+        if self.max_entries <= 0:
+            return
+        self._ensure_loaded()
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model_name, text)
+                self._entries[key] = np.asarray(embedding, dtype=np.float32)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def load(self):
+        """从磁盘加载缓存（按最近使用顺序保存）"""
+        with self._lock:
+            self._loaded = True
+            if not self.path or not os.path.exists(self.path):
+                return
+            try:
+                data = np.load(self.path)
+                keys, vectors = data["keys"], data["vectors"]
+                for key, vector in zip(keys[-self.max_entries:], vectors[-self.max_entries:]):
+                    self._entries[key.tobytes()] = vector
+                logger.info(f"加载向量缓存: {len(self._entries)} 条")
+            except Exception as e:
+                logger.error(f"加载向量缓存失败: {str(e)}")
+
+    def save(self):
+        """写入磁盘（先写临时文件再替换）"""
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            # 不同模型的向量维度可能不同，只保留与最新条目同维度的部分
+            dim = next(reversed(self._entries.values())).shape[0] if self._entries else 0
+            items = [(key, vector) for key, vector in self._entries.items() if vector.shape[0] == dim]
+            keys = np.frombuffer(b"".join(key for key, _ in items), dtype=np.uint8).reshape(-1, 20)
+            vectors = np.stack([vector for _, vector in items]) if items else np.zeros((0, 0), dtype=np.float32)
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez(tmp_path, keys=keys, vectors=vectors)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        logger.info(f"向量缓存已保存: {len(keys)} 条")
@@ -36,11 +36,127 @@ class Config:
 
     # 系统设置
     VECTOR_MODEL = "all-MiniLM-L6-v2"
+    # 向量模型推理后端: torch(全精度) / torch_int8(动态int8量化) / onnx / onnx_int8（需安装onnxruntime）
+    VECTOR_MODEL_BACKEND = "torch"
+    # ONNX模型导出目录
+    ONNX_MODEL_DIR = "onnx_models"
+    # 非torch后端加载后与全精度模型比对，最小余弦相似度低于阈值时回退torch
+    ENCODER_PARITY_CHECK = True
+    ENCODER_PARITY_MIN_COSINE = 0.99
+    # 向量存储快照目录（内存映射格式）
+    STORAGE_DIR = "knowledge_base"
+    # 保留的历史快照数量
+    STORAGE_KEEP_SNAPSHOTS = 2
+    # 旧版单文件pickle存储，存在时自动迁移
     STORAGE_PATH = "knowledge_base.pkl"
+    # 共享只读索引：多个Web工作进程（如gunicorn多worker）各自以只读内存映射挂载同一快照，向量、段落列、
+    # 文本块与BM25倒排表都不复制到进程私有内存，增加工作进程不增加索引内存；此模式下不接受单文档修改，
+    # 由构建进程（或 /build）发布新快照，各工作进程通过快照监视自动切换
+    SHARED_INDEX = False
+    # 分片数：大于1时段落按文档分配到多个工作进程，查询并行分发到各分片后合并；0或1为单进程存储
+    SEARCH_SHARDS = 0
+    # 分片存储目录，每个分片在其下有独立的快照目录与WAL
+    SHARD_STORAGE_DIR = "knowledge_base_shards"
+    # 等待分片进程启动并回连、停止分片进程的超时（秒）
+    SHARD_START_TIMEOUT = 60
+    # 分片存储被新版本替换（构建或重新加载）后延迟停止分片进程的宽限期（秒），已取得旧存储引用的查询在此期间照常完成
+    SHARD_CLOSE_GRACE = 30
+    # 检查CURRENT指向的快照是否变化的间隔（秒），变化时在后台加载新快照并原子替换；0表示只通过 /reload 手动加载
+    SNAPSHOT_WATCH_INTERVAL = 5
+    # 按需加载文档正文：只常驻索引与紧凑元数据，文档全文与段落文本访问时从快照文本块读取
+    LAZY_DOCUMENTS = False
+    # 按需加载模式下最近访问的文档数与热点段落文本数（LRU）
+    LAZY_DOCUMENT_CACHE_SIZE = 64
+    LAZY_PARAGRAPH_CACHE_SIZE = 4096
     CONVERSATION_HISTORY_LIMIT = 10
     MAX_CONTEXT_LENGTH = 4096
     SIMILARITY_THRESHOLD = 0.1
 
+    # 向量矩阵初始预分配行数（不足时按倍数扩容）
+    EMBEDDING_INITIAL_CAPACITY = 1024
+    # 构建知识库时段落向量化的批大小
+    EMBEDDING_BATCH_SIZE = 64
+    # 段落向量持久化缓存（键为模型名+段落文本哈希），路径为空则不持久化
+    EMBEDDING_CACHE_PATH = "embedding_cache.npz"
+    EMBEDDING_CACHE_MAX_ENTRIES = 200000
+    # BM25词法索引（基于jieba分词），与向量检索融合
+    LEXICAL_INDEX = True
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+    # 融合方式: none(仅向量) / rrf(倒数排名融合) / weighted(加权融合)
+    HYBRID_FUSION = "none"
+    # weighted模式下BM25（按最大值归一化）的权重
+    HYBRID_LEXICAL_WEIGHT = 0.3
+    # rrf模式的平滑常数与每路参与融合的名次深度
+    RRF_K = 60
+    FUSION_DEPTH = 200
+    # 结果多样化方式: doc_cap(按综合评分顺序选取) / mmr(最大边际相关性)
+    DIVERSITY_MODE = "doc_cap"
+    # 同一文档最多返回的结果数
+    MAX_RESULTS_PER_DOC = 2
+    # mmr模式参与选择的候选数 M 与相关性权重 λ（越小越强调多样性）
+    MMR_CANDIDATES = 50
+    MMR_LAMBDA = 0.7
+    # 交叉编码器重排序（CPU推理），对检索结果的前N个候选批量打分
+    RERANKER_ENABLED = False
+    RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    RERANKER_TOP_N = 20
+    # 检索加重排序的单次请求延迟预算（毫秒），预计超出时跳过重排序
+    RERANKER_BUDGET_MS = 300
+    # (查询, 段落) 分数缓存容量
+    RERANKER_CACHE_SIZE = 10000
+    # 单对打分耗时滑动平均的平滑系数
+    RERANKER_EMA_ALPHA = 0.2
+    # 是否在快照中保存段落分词结果（重载、重建词法索引和重新评分时无需再次分词）
+    PERSIST_TOKENS = True
+    # 过滤检索命中行数不超过该值时跳过近似阶段直接精确打分
+    FILTER_EXACT_MAX_ROWS = 50000
+    # 批量检索时单块分数矩阵的元素上限（查询数 × 段落数）
+    BATCH_SEARCH_MAX_SCORES = 1 << 25
+    # 查询向量LRU缓存容量与过期时间（秒，0表示不过期）
+    QUERY_CACHE_SIZE = 1024
+    QUERY_CACHE_TTL = 0
+    # 已删除段落占比超过该值时触发后台压缩
+    COMPACTION_DELETED_RATIO = 0.2
+
+    # 查询在系统预热（加载知识库与向量模型）完成前最多等待的秒数
+    READY_WAIT_SECONDS = 30
+
+    # 预写日志：文档修改追加写入 knowledge_base/wal/，超过阈值（字节）时后台生成快照
+    WAL_ENABLED = True
+    WAL_MAX_BYTES = 64 * 1024 * 1024
+    # 每条日志写入后是否fsync
+    WAL_FSYNC = True
+
+    # 检索后端: exact(精确全量) / ivf(倒排近似最近邻)
+    SEARCH_BACKEND = "exact"
+    # 段落数低于该值时始终精确检索
+    ANN_MIN_PARAGRAPHS = 10000
+    # IVF聚类数（0表示按 4*sqrt(N) 自动确定）与每次查询探测的聚类数
+    IVF_NLIST = 0
+    IVF_NPROBE = 8
+
+    # 向量存储方式: float32(全精度) / float16(半精度，内存与快照减半) / int8(量化码粗排，原始向量仅在精排时按需读取)
+    # 注意：原始向量在从快照加载（含构建知识库完成后重新挂载）时保持内存映射；加载后新增文档会将映射的
+    # 原始向量整体复制到内存，直到重新加载快照
+    EMBEDDING_STORAGE = "float32"
+    # 半精度存储时每次转回float32打分的行数
+    SCORE_BLOCK_ROWS = 65536
+    # 第一阶段候选生成后进入原始向量精确打分的候选数
+    RERANK_CANDIDATES = 200
+    # 第一阶段候选生成: auto(按 SEARCH_BACKEND 与 EMBEDDING_STORAGE 组合) / exact(全量精确打分) /
+    # ann(IVF倒排) / quantized(int8码粗排) / lexical(BM25命中)；候选行再精确计算余弦相似度与综合评分
+    CANDIDATE_STAGE = "auto"
+
+    # 向量降维: none(不降维) / pca(在已有段落向量上拟合主成分) / truncate(保留前N维，适用于Matryoshka式训练的模型)
+    PROJECTION = "none"
+    # 降维后的维度
+    PROJECTION_DIM = 128
+    # 段落数达到该值时才拟合投影（此前保持原始维度）
+    PROJECTION_MIN_PARAGRAPHS = 1000
+    # 拟合投影时最多采样的段落数
+    PROJECTION_TRAIN_ROWS = 50000
+
     # 提示词模板
     SYSTEM_PROMPT = """你是一个专业的知识库助手，基于提供的知识库内容回答用户问题。
 
@@ -5,9 +5,23 @@
 """
 
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+@dataclass
+class TokenizedText:
+    """分词结果：一次分词，供质量评分、词数统计和词法索引共用"""
+    text: str
+    tokens: List[str]
+
+    @property
+    def word_count(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def unique_count(self) -> int:
+        return len(set(self.tokens))
+
 @dataclass
 class Document:
     """文档数据结构"""
@@ -17,10 +31,12 @@ class Document:
     paragraphs: List[str]
     metadata: Dict[str, Any] = field(default_factory=dict)
     created_at: datetime = field(default_factory=datetime.now)
+    # 与 paragraphs 逐一对应的分词结果（构建文档时生成，不持久化）
+    paragraph_tokens: Optional[List[TokenizedText]] = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class SearchResult:
-    """搜索结果数据结构"""
+    """搜索结果数据结构（只为最终返回的前 top_k 个结果构造，使用 slots 减少对象开销）"""
     doc_id: str
     title: str
     paragraph: str
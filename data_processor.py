@@ -8,8 +8,8 @@ import os
 import re
 import jieba
 import logging
-from typing import List, Optional
-from data_models import Document
+from typing import Dict, List, Optional
+from data_models import Document, TokenizedText
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -18,9 +18,13 @@ class DataProcessor:
     """数据处理模块"""
 
     def __init__(self):
-        jieba.initialize()
+        # jieba词典在首次分词时加载，可调用 warmup() 提前在后台完成
         self.stop_words = self._load_stop_words()
 
+    def warmup(self):
+        """加载jieba词典"""
+        jieba.initialize()
+
     def _load_stop_words(self) -> set:
         """加载停用词"""
         stop_words = {
@@ -64,41 +68,53 @@ class DataProcessor:
         ]
         return filtered_words
 
+    def tokenize(self, text: str) -> TokenizedText:
+        """分词并封装为可复用的分词结果"""
+        return TokenizedText(text=text, tokens=self.segment_and_filter(text))
+
     def process_document(self, file_path: str) -> Optional[Document]:
         """处理单个文档"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
 
-            # 清洗文本
-            cleaned_content = self.clean_text(content)
-
-            # 分割段落
-            paragraphs = self.split_into_paragraphs(cleaned_content)
-
-            # 创建文档对象
             doc_id = os.path.basename(file_path).split('.')[0]
-            title = doc_id
-
-            # 提取元数据
-            metadata = {
+            document = self.build_document(doc_id, content, metadata={
                 "file_path": file_path,
-                "file_size": os.path.getsize(file_path),
-                "paragraph_count": len(paragraphs),
-                "word_count": len(self.segment_and_filter(cleaned_content))
-            }
-
-            document = Document(
-                id=doc_id,
-                title=title,
-                content=cleaned_content,
-                paragraphs=paragraphs,
-                metadata=metadata
-            )
-
-            logger.info(f"处理文档: {file_path}, 段落数: {len(paragraphs)}")
+                "file_size": os.path.getsize(file_path)
+            })
+
+            logger.info(f"处理文档: {file_path}, 段落数: {len(document.paragraphs)}")
             return document
 
         except Exception as e:
             logger.error(f"处理文档 {file_path} 时出错: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def build_document(self, doc_id: str, content: str, title: Optional[str] = None,
+                       metadata: Optional[Dict] = None) -> Document:
+        """由原始文本构建文档对象：清洗、分段并提取元数据"""
+        # 清洗文本
+        cleaned_content = self.clean_text(content)
+
+        # 分割段落
+        paragraphs = self.split_into_paragraphs(cleaned_content)
+
+        # 逐段分词一次，结果随文档传给向量存储复用
+        paragraph_tokens = [self.tokenize(paragraph) for paragraph in paragraphs]
+
+        # 提取元数据
+        metadata = dict(metadata or {})
+        metadata.update({
+            "paragraph_count": len(paragraphs),
+            "word_count": sum(tokenized.word_count for tokenized in paragraph_tokens)
+        })
+
+        return Document(
+            id=doc_id,
+            title=title or doc_id,
+            content=cleaned_content,
+            paragraphs=paragraphs,
+            metadata=metadata,
+            paragraph_tokens=paragraph_tokens
+        )
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按需加载的文档集合
+"""
+
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from data_models import Document
+from index_storage import StringTable
+from cache import LRUCache
+
+class LazyDocumentMap(MutableMapping):
+    """文档ID -> Document 的映射，快照中的文档只常驻标题与元数据，全文和段落在访问时从文本块读取
+
+    最近访问的文档保存在LRU中；加载之后新增的文档在下次保存快照前常驻内存。
+    """
+
+    def __init__(self, strings: StringTable, documents_info: List[Dict], cache_size: int):
+        self.strings = strings
+        # 文档ID -> 快照中的文档信息（标题、元数据、文本块位置）或新增的 Document
+        self._entries: Dict[str, object] = {}
+        for info in documents_info:
+            created_at = info.get("created_at")
+            self._entries[info["id"]] = dict(
+                info,
+                metadata=info.get("metadata", {}),
+                created_at=datetime.fromisoformat(created_at) if created_at else None
+            )
+        self.cache = LRUCache(cache_size)
+
+    def __getitem__(self, doc_id: str) -> Document:
+        entry = self._entries[doc_id]
+        if isinstance(entry, Document):
+            return entry
+
+        document = self.cache.get(doc_id)
+        if document is None:
+            text_index = entry["text_index"]
+            document = Document(
+                id=doc_id,
+                title=entry["title"],
+                content=self.strings[text_index],
+                paragraphs=[self.strings[text_index + 1 + i] for i in range(entry["paragraph_count"])],
+                metadata=entry["metadata"],
+                created_at=entry["created_at"]
+            )
+            self.cache.put(doc_id, document)
+        return document
+
+    def __setitem__(self, doc_id: str, document: Document):
+        self._entries[doc_id] = document
+        self.cache.discard(doc_id)
+
+    def __delitem__(self, doc_id: str):
+        del self._entries[doc_id]
+        self.cache.discard(doc_id)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def copy(self) -> "LazyDocumentMap":
+        """浅复制文档集合（共享文本块，不读取正文），用于在锁外写入快照；副本不经过LRU缓存"""
+        documents = LazyDocumentMap(self.strings, [], 0)
+        documents._entries = dict(self._entries)
+        return documents
+
+    def metadata(self, doc_id: str) -> Optional[Dict]:
+        """文档元数据（不读取正文）"""
+        entry = self._entries.get(doc_id)
+        if entry is None:
+            return None
+        return entry.metadata if isinstance(entry, Document) else entry["metadata"]
+
+    @property
+    def resident_documents(self) -> int:
+        """常驻内存（尚未写入快照）的文档数"""
+        return sum(1 for entry in self._entries.values() if isinstance(entry, Document))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+向量编码后端模块
+
+支持的后端（Config.VECTOR_MODEL_BACKEND）：
+    torch        SentenceTransformer 全精度推理
+    torch_int8   对 Linear 层做动态int8量化的 PyTorch 模型
+    onnx         导出为ONNX图后用 onnxruntime 推理
+    onnx_int8    在ONNX图上做动态int8权重量化
+
+各后端对外提供与 SentenceTransformer.encode 相同的调用方式。非torch后端
+加载后与参考模型做一致性检查，余弦相似度低于阈值或依赖缺失时回退到torch。
+"""
+
+import os
+import copy
+import time
+import logging
+import numpy as np
+from typing import List, Optional, Tuple, Union
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+# 一致性检查使用的样例文本
+PARITY_TEXTS = [
+    "机器学习是人工智能的一个重要分支",
+    "深度学习通过多层神经网络学习数据的表示",
+    "区块链是一种去中心化的分布式账本技术",
+    "数据库索引可以显著提升查询性能",
+    "Python是一种广泛使用的高级编程语言",
+    "What is the difference between supervised and unsupervised learning?"
+]
+
+def _load_sentence_transformer(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def _quantize_torch(model):
+    """对模型中的 Linear 层做动态int8量化（仅CPU推理）"""
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class OnnxEncoder:
+    """基于 onnxruntime 的编码器，复用原模型的分词器与池化方式"""
+
+    def __init__(self, onnx_path: str, tokenizer, max_seq_length: int, pooling: str = "mean"):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.pooling = pooling
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        embeddings = []
+        for start in range(0, len(texts), max(1, batch_size)):
+            tokens = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+            hidden = self.session.run(None, feeds)[0]
+            if self.pooling == "cls":
+                embeddings.append(hidden[:, 0])
+            else:
+                mask = tokens["attention_mask"][..., None].astype(np.float32)
+                embeddings.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        result = np.vstack(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        return result[0] if single else result
+
+def _onnx_path(model_name: str, quantized: bool) -> str:
+    name = model_name.replace("/", "_").replace("\\", "_")
+    return os.path.join(Config.ONNX_MODEL_DIR, f"{name}{'.int8' if quantized else ''}.onnx")
+
+def _export_onnx(reference, onnx_path: str):
+    """将 SentenceTransformer 的 Transformer 层导出为ONNX图（输出 last_hidden_state）"""
+    import torch
+    transformer = reference[0].auto_model
+    tokenizer = reference[0].tokenizer
+    inputs = dict(tokenizer(["warmup"], return_tensors="pt"))
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in inputs}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    transformer.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, (inputs,), onnx_path,
+            input_names=list(inputs.keys()),
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+    logger.info(f"ONNX模型已导出: {onnx_path}")
+
+def _load_onnx(model_name: str, reference, quantized: bool) -> OnnxEncoder:
+    """加载ONNX编码器，模型文件不存在时先导出（与量化）"""
+    onnx_path = _onnx_path(model_name, quantized)
+    if not os.path.exists(onnx_path):
+        float_path = _onnx_path(model_name, False)
+        if not os.path.exists(float_path):
+            _export_onnx(reference, float_path)
+        if quantized:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(float_path, onnx_path, weight_type=QuantType.QInt8)
+            logger.info(f"ONNX模型已量化: {onnx_path}")
+
+    pooling = "mean"
+    if len(reference) > 1 and getattr(reference[1], "pooling_mode_cls_token", False):
+        pooling = "cls"
+    return OnnxEncoder(onnx_path, reference[0].tokenizer, reference.max_seq_length, pooling)
+
+def parity_cosine(reference, candidate, texts: Optional[List[str]] = None) -> float:
+    """候选编码器与参考模型在样例文本上的最小余弦相似度"""
+    texts = texts or PARITY_TEXTS
+    expected = np.asarray(reference.encode(texts, convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
+    actual = np.asarray(candidate.encode(texts, convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    actual /= np.linalg.norm(actual, axis=1, keepdims=True)
+    return float(np.min(np.sum(expected * actual, axis=1)))
+
+def load_encoder(model_name: str, backend: str = "torch", check_parity: bool = True) -> Tuple[object, str]:
+    """加载指定后端的编码器，返回 (编码器, 实际使用的后端)
+
+    依赖缺失、导出失败或一致性检查不通过时回退到torch全精度模型。
+    """
+    if backend not in BACKENDS:
+        logger.warning(f"未知的编码后端 {backend}，使用torch")
+        backend = "torch"
+
+    start_time = time.time()
+    reference = _load_sentence_transformer(model_name)
+    if backend == "torch":
+        return reference, backend
+
+    try:
+        if backend == "torch_int8":
+            # 量化会替换模块，先复制一份，保留参考模型用于一致性检查
+            encoder = _quantize_torch(copy.deepcopy(reference).to("cpu"))
+        else:
+            encoder = _load_onnx(model_name, reference, quantized=backend == "onnx_int8")
+    except ImportError as e:
+        logger.warning(f"编码后端 {backend} 依赖未安装，使用torch: {e}")
+        return reference, "torch"
+    except Exception as e:
+        logger.error(f"编码后端 {backend} 加载失败，使用torch: {e}")
+        return reference, "torch"
+
+    if check_parity:
+        cosine = parity_cosine(reference, encoder)
+        if cosine < Config.ENCODER_PARITY_MIN_COSINE:
+            logger.warning(f"编码后端 {backend} 一致性检查未通过（最小余弦 {cosine:.4f} < "
+                           f"{Config.ENCODER_PARITY_MIN_COSINE}），使用torch")
+            return reference, "torch"
+        logger.info(f"编码后端 {backend} 一致性检查通过，最小余弦 {cosine:.4f}")
+
+    logger.info(f"编码后端 {backend} 加载完成，耗时 {time.time() - start_time:.2f} 秒")
+    return encoder, backend
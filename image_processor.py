@@ -8,6 +8,7 @@
 import os
 import io
 import logging
+import threading
 from PIL import Image
 import numpy as np
 from typing import List, Dict, Any, Optional
@@ -17,14 +18,26 @@ from data_models import Document
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 延迟导入以避免依赖问题
-try:
-    import pytesseract
-    import cv2
-    OCR_AVAILABLE = True
-except ImportError as e:
-    logger.warning(f"OCR依赖未安装: {e}")
-    OCR_AVAILABLE = False
+# 延迟导入：pytesseract与cv2在首次使用OCR时才导入，避免拖慢进程启动
+pytesseract = None
+cv2 = None
+OCR_AVAILABLE: Optional[bool] = None
+_ocr_import_lock = threading.Lock()
+
+def _import_ocr_modules() -> bool:
+    """导入OCR依赖，返回是否可用（只尝试一次）"""
+    global pytesseract, cv2, OCR_AVAILABLE
+    with _ocr_import_lock:
+        if OCR_AVAILABLE is None:
+            try:
+                import pytesseract as _pytesseract
+                import cv2 as _cv2
+                pytesseract, cv2 = _pytesseract, _cv2
+                OCR_AVAILABLE = True
+            except ImportError as e:
+                logger.warning(f"OCR依赖未安装: {e}")
+                OCR_AVAILABLE = False
+        return OCR_AVAILABLE
 
 class ImageProcessor:
     """图片文字识别处理器"""
@@ -36,10 +49,28 @@ class ImageProcessor:
             tesseract_path: Tesseract可执行文件的路径，如果不提供则尝试自动检测
         """
         self.supported_formats = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp'}
-        self.ocr_available = OCR_AVAILABLE
-        if self.ocr_available:
-            self._setup_tesseract(tesseract_path)
-            self._check_tesseract()
+        self.tesseract_path = tesseract_path
+        # OCR可用性在首次访问 ocr_available 时探测（导入依赖并检查Tesseract）
+        self._ocr_available: Optional[bool] = None
+        self._init_lock = threading.Lock()
+
+    @property
+    def ocr_available(self) -> bool:
+        if self._ocr_available is None:
+            with self._init_lock:
+                if self._ocr_available is None:
+                    available = _import_ocr_modules()
+                    if available:
+                        self._setup_tesseract(self.tesseract_path)
+                        available = self._check_tesseract()
+                    self._ocr_available = available
+        return self._ocr_available
+
+    def configure(self, tesseract_path: Optional[str] = None):
+        """更换Tesseract路径，下次使用时重新探测"""
+        with self._init_lock:
+            self.tesseract_path = tesseract_path
+            self._ocr_available = None
 
     def _setup_tesseract(self, tesseract_path: Optional[str] = None):
         """设置Tesseract路径"""
@@ -78,7 +109,6 @@ class ImageProcessor:
             return True
         except Exception as e:
             logger.error(f"Tesseract OCR 不可用: {e}")
-            self.ocr_available = False
             return False
 
     def preprocess_image(self, image: Image.Image) -> Image.Image:
@@ -327,8 +357,7 @@ def setup_tesseract(tesseract_path: str):
     Example:
         setup_tesseract(r'C:\Program Files\Tesseract-OCR\tesseract.exe')
     """
-    global image_processor
-    image_processor = ImageProcessor(tesseract_path)
+    image_processor.configure(tesseract_path)
     return image_processor.ocr_available
 
 def process_single_image(image_data: bytes, filename: str = "") -> Dict[str, Any]:
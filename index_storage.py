@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+向量存储磁盘格式模块
+
+目录结构：
+    <root>/CURRENT                 当前快照目录名（原子替换）
+    <root>/snapshot-<时间戳>/      不可变快照
+        manifest.json              版本与统计信息
+        *.npy                      列式数组（加载时内存映射）
+        texts.bin / texts_offsets.npy   文本块与偏移
+        documents.json             文档元数据
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import numpy as np
+from array import array
+from typing import Dict, Iterable, List, Optional
+from cache import LRUCache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_PREFIX = "snapshot-"
+
+def _fsync_file(path: str):
+    """将文件内容刷到磁盘"""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+def _fsync_dir(path: str):
+    """刷新目录项（Windows不支持，忽略）"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def current_snapshot_name(root: str) -> Optional[str]:
+    """返回CURRENT指向的快照目录名（即快照版本），不存在时返回None"""
+    current_path = os.path.join(root, CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, 'r', encoding='utf-8') as f:
+        name = f.read().strip()
+    return name if name and os.path.isdir(os.path.join(root, name)) else None
+
+def current_snapshot_dir(root: str) -> Optional[str]:
+    """返回当前快照目录路径，不存在时返回None"""
+    name = current_snapshot_name(root)
+    return os.path.join(root, name) if name else None
+
+def list_snapshots(root: str) -> List[str]:
+    """按时间顺序列出已发布的快照目录名"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if name.startswith(SNAPSHOT_PREFIX) and not name.endswith(".tmp")
+        and os.path.isdir(os.path.join(root, name))
+    )
+
+class SnapshotWriter:
+    """快照写入器：先写入临时目录，完成后重命名并原子切换CURRENT"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.name = f"{SNAPSHOT_PREFIX}{time.time_ns()}"
+        self.tmp_dir = os.path.join(root, f"{self.name}.tmp")
+        self._files: List[str] = []
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.tmp_dir, filename)
+
+    def write_array(self, filename: str, array: np.ndarray, link_from: Optional[str] = None):
+        """写入.npy数组；调用方确认内容与已有快照文件相同时可传入link_from直接建立硬链接"""
+        target = self.path(filename)
+        if link_from and os.path.exists(link_from):
+            try:
+                os.link(link_from, target)
+                self._files.append(target)
+                return
+            except OSError:
+                pass
+        np.save(target, np.ascontiguousarray(array))
+        self._files.append(target)
+
+    def write_json(self, filename: str, data):
+        target = self.path(filename)
+        with open(target, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        self._files.append(target)
+
+    def write_strings(self, name: str, strings: Iterable[str]):
+        """将字符串序列逐条写为一个UTF-8文本块和偏移数组（可传入生成器，不要求全部文本同时在内存中）"""
+        offsets = array('q', [0])
+        target = self.path(f"{name}.bin")
+        with open(target, 'wb') as f:
+            for text in strings:
+                data = text.encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        self._files.append(target)
+        self.write_array(f"{name}_offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+
+    def commit(self, manifest: Dict, keep: int = 2) -> str:
+        """写入manifest、刷盘、发布快照并清理旧快照，返回快照目录"""
+        manifest = dict(manifest, format_version=FORMAT_VERSION, created_at=time.time())
+        self.write_json("manifest.json", manifest)
+        for path in self._files:
+            _fsync_file(path)
+        _fsync_dir(self.tmp_dir)
+
+        snapshot_dir = os.path.join(self.root, self.name)
+        os.rename(self.tmp_dir, snapshot_dir)
+
+        # 原子切换CURRENT指针
+        current_tmp = os.path.join(self.root, f"{CURRENT_FILE}.tmp")
+        with open(current_tmp, 'w', encoding='utf-8') as f:
+            f.write(self.name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_tmp, os.path.join(self.root, CURRENT_FILE))
+        _fsync_dir(self.root)
+
+        self._cleanup(keep)
+        return snapshot_dir
+
+    def abort(self):
+        """放弃未完成的快照"""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _cleanup(self, keep: int):
+        """删除较旧的快照（已被其他进程映射的文件在Windows上可能删除失败）"""
+        for name in list_snapshots(self.root)[:-max(keep, 1)]:
+            try:
+                shutil.rmtree(os.path.join(self.root, name))
+            except OSError as e:
+                logger.warning(f"清理旧快照失败 {name}: {e}")
+
+class StringTable:
+    """只读字符串表：文本块以内存映射打开，按需解码"""
+
+    def __init__(self, snapshot_dir: str, name: str):
+        self.offsets = np.load(os.path.join(snapshot_dir, f"{name}_offsets.npy"))
+        blob_path = os.path.join(snapshot_dir, f"{name}.bin")
+        if self.offsets[-1] > 0:
+            self.blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        else:
+            self.blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+class CachedStringTable(StringTable):
+    """带LRU缓存的只读字符串表：get() 经缓存读取，用于频繁访问的段落文本；下标访问不经缓存"""
+
+    def __init__(self, snapshot_dir: str, name: str, cache_size: int):
+        super().__init__(snapshot_dir, name)
+        self.cache = LRUCache(cache_size)
+
+    def get(self, index: int) -> str:
+        text = self.cache.get(index)
+        if text is None:
+            text = self[index]
+            self.cache.put(index, text)
+        return text
+
+def load_array(snapshot_dir: str, filename: str, mmap: bool = True) -> Optional[np.ndarray]:
+    """加载.npy数组，默认以只读内存映射方式打开；文件不存在时返回None"""
+    path = os.path.join(snapshot_dir, filename)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def load_json(snapshot_dir: str, filename: str):
+    with open(os.path.join(snapshot_dir, filename), 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BM25词法索引与分词结果存储模块
+"""
+
+import logging
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class BM25Index:
+    """基于jieba分词结果的BM25倒排索引
+
+    行号与向量矩阵的行号一致；倒排表按词项保存为紧凑的int32数组
+    （行号与词频），追加为摊销O(1)。检索可与追加并发进行：打分时复制所需的倒排表，
+    并只统计调用方指定的前 num_rows 行。已删除（墓碑）的行仍留在倒排表中，打分时由调用方传入
+    存活掩码，文档频率、行数与平均长度只统计存活行，压缩前后分数一致。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self._rows: List[array] = []
+        self._tfs: List[array] = []
+        # 各行词数（预分配，按需扩容），前 _num_rows 行有效
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self._num_rows = 0
+        self._total_length = 0
+        # 只读模式下直接引用快照中的扁平倒排数组 (rows, tfs, offsets)，见 from_arrays(mapped=True)
+        self._postings: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    @property
+    def num_rows(self) -> int:
+        return self._num_rows
+
+    def add(self, row: int, tokens: List[str]):
+        """添加一行的分词结果，行号必须连续递增"""
+        if row != self._num_rows:
+            raise ValueError(f"BM25索引行号不连续: 期望 {self._num_rows}, 实际 {row}")
+
+        for term, tf in Counter(tokens).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                term_id = len(self._rows)
+                self._rows.append(array('i'))
+                self._tfs.append(array('i'))
+                # 倒排表先于词表登记，并发检索查到的词项总有对应的倒排表
+                self.vocab[term] = term_id
+            self._rows[term_id].append(row)
+            self._tfs[term_id].append(tf)
+
+        # 扩容时写入新数组，并发检索仍持有的旧数组不受影响
+        if self._num_rows >= len(self._lengths):
+            lengths = np.zeros(max(2 * len(self._lengths), 1024), dtype=np.int32)
+            lengths[:self._num_rows] = self._lengths[:self._num_rows]
+            self._lengths = lengths
+        self._lengths[self._num_rows] = len(tokens)
+        self._total_length += len(tokens)
+        self._num_rows += 1
+
+    def row_lengths(self, rows) -> np.ndarray:
+        """指定行的词数"""
+        return self._lengths[rows]
+
+    def score(self, query_tokens: List[str], num_rows: Optional[int] = None, alive: Optional[np.ndarray] = None,
+              live_length: Optional[int] = None) -> Optional[np.ndarray]:
+        """计算前 num_rows 行（默认全部行）的BM25分数（稠密数组）；查询词均不在词表中时返回None
+
+        alive: 各行的存活掩码（默认全部存活），已删除行的分数为0；
+        live_length: 存活行的总词数（调用方维护，省略时按掩码计算）
+        """
+        term_ids = [self.vocab[t] for t in set(query_tokens) if t in self.vocab]
+        num_rows = self._num_rows if num_rows is None else min(num_rows, self._num_rows)
+        if not term_ids or num_rows == 0:
+            return None
+
+        lengths = self._lengths[:num_rows]
+        if alive is None:
+            live_rows = num_rows
+            live_length = self._total_length if num_rows == self._num_rows else int(lengths.sum(dtype=np.int64))
+        else:
+            alive = alive[:num_rows]
+            live_rows = int(np.count_nonzero(alive))
+            if live_length is None:
+                live_length = int(lengths[alive].sum(dtype=np.int64))
+        if live_rows == 0:
+            return None
+        avg_length = live_length / live_rows if live_length else 1.0
+        length_norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+
+        all_rows = []
+        all_scores = []
+        for term_id in term_ids:
+            rows, tfs = self._term_postings(term_id)
+            # 倒排表按行号递增，截去之后追加的行
+            end = np.searchsorted(rows, num_rows)
+            rows, tfs = rows[:end], tfs[:end].astype(np.float32)
+            if alive is not None:
+                # 已删除的行不计入文档频率，分数为0
+                live = alive[rows]
+                rows, tfs = rows[live], tfs[live]
+            df = len(rows)
+            idf = np.log(1 + (live_rows - df + 0.5) / (df + 0.5))
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + length_norm[rows]))
+
+        return np.bincount(
+            np.concatenate(all_rows), weights=np.concatenate(all_scores), minlength=num_rows
+        ).astype(np.float32)
+
+    def _term_postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """词项的倒排行号与词频
+
+        追加中的倒排表先复制再转换：不长期导出其缓冲区，避免并发追加时 array 无法扩容。
+        """
+        if self._postings is not None:
+            rows, tfs, offsets = self._postings
+            start, end = offsets[term_id], offsets[term_id + 1]
+            return rows[start:end], tfs[start:end]
+        rows = np.frombuffer(self._rows[term_id].tobytes(), dtype=np.int32)
+        tfs = np.frombuffer(self._tfs[term_id].tobytes(), dtype=np.int32)
+        return rows, tfs[:len(rows)]
+
+    def remapped(self, mapping: np.ndarray) -> "BM25Index":
+        """按旧行号 -> 新行号映射重写倒排表，映射为-1的行被移除；返回新索引，原索引可继续检索"""
+        index = BM25Index(k1=self.k1, b=self.b)
+        index.vocab = dict(self.vocab)
+        for term_id in range(len(index.vocab)):
+            rows, tfs = self._term_postings(term_id)
+            new_rows = mapping[rows]
+            keep = new_rows >= 0
+            index._rows.append(array('i', new_rows[keep].astype(np.int32).tobytes()))
+            index._tfs.append(array('i', tfs[keep].tobytes()))
+
+        lengths = self._lengths[:self._num_rows]
+        index._lengths = np.ascontiguousarray(lengths[np.flatnonzero(mapping[:len(lengths)] >= 0)])
+        index._num_rows = len(index._lengths)
+        index._total_length = int(index._lengths.sum())
+        return index
+
+    def to_arrays(self, num_rows: Optional[int] = None) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """导出前 num_rows 行（默认全部行）为 (词表, 扁平数组) 以便写入快照；可与追加并发进行"""
+        num_rows = self._num_rows if num_rows is None else num_rows
+        vocab = dict(self.vocab)
+        terms = [None] * len(vocab)
+        for term, term_id in vocab.items():
+            terms[term_id] = term
+
+        all_rows = []
+        all_tfs = []
+        for term_id in range(len(terms)):
+            rows, tfs = self._term_postings(term_id)
+            end = np.searchsorted(rows, num_rows)
+            all_rows.append(rows[:end])
+            all_tfs.append(tfs[:end])
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in all_rows])
+        arrays = {
+            "rows": np.concatenate(all_rows) if all_rows else np.zeros(0, dtype=np.int32),
+            "tfs": np.concatenate(all_tfs) if all_tfs else np.zeros(0, dtype=np.int32),
+            "offsets": offsets,
+            "lengths": self._lengths[:num_rows]
+        }
+        return terms, arrays
+
+    @classmethod
+    def from_arrays(cls, terms: List[str], arrays: Dict[str, np.ndarray],
+                    k1: float = 1.5, b: float = 0.75, mapped: bool = False) -> "BM25Index":
+        """从快照数组恢复索引
+
+        mapped 为True时直接引用（只读内存映射的）扁平数组，不拆分为按词项的数组，恢复后只能检索、不能追加。
+        """
+        index = cls(k1=k1, b=b)
+        if mapped:
+            index.vocab = {term: term_id for term_id, term in enumerate(terms)}
+            index._postings = (arrays["rows"], arrays["tfs"], arrays["offsets"])
+            index._lengths = arrays["lengths"]
+            index._num_rows = len(index._lengths)
+            index._total_length = int(arrays["lengths"].sum())
+            return index
+
+        offsets = arrays["offsets"]
+        rows = np.ascontiguousarray(arrays["rows"], dtype=np.int32)
+        tfs = np.ascontiguousarray(arrays["tfs"], dtype=np.int32)
+        for term_id, term in enumerate(terms):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            index.vocab[term] = term_id
+            index._rows.append(array('i', rows[start:end].tobytes()))
+            index._tfs.append(array('i', tfs[start:end].tobytes()))
+
+        index._lengths = np.array(arrays["lengths"], dtype=np.int32)
+        index._num_rows = len(index._lengths)
+        index._total_length = int(index._lengths.sum())
+        return index
+
+
+class TokenStore:
+    """按行保存分词结果（词项ID序列），重载或重新评分时无需再次分词
+
+    行号与向量矩阵的行号一致；词项ID与偏移量保存为紧凑数组，追加为摊销O(1)。
+    """
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self._ids = array('i')
+        self._offsets = array('q', [0])
+
+    @property
+    def num_rows(self) -> int:
+        return len(self._offsets) - 1
+
+    def add(self, row: int, tokens: List[str]):
+        """添加一行的分词结果，行号必须连续递增"""
+        if row != self.num_rows:
+            raise ValueError(f"分词存储行号不连续: 期望 {self.num_rows}, 实际 {row}")
+
+        for term in tokens:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                term_id = len(self.terms)
+                self.vocab[term] = term_id
+                self.terms.append(term)
+            self._ids.append(term_id)
+        self._offsets.append(len(self._ids))
+
+    def get(self, row: int) -> List[str]:
+        """返回一行的分词结果"""
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return [self.terms[term_id] for term_id in self._ids[start:end]]
+
+    def remapped(self, mapping: np.ndarray) -> "TokenStore":
+        """按旧行号 -> 新行号映射重排，映射为-1的行被移除（新行号须保持原有顺序）；返回新的分词存储"""
+        ids = np.frombuffer(self._ids, dtype=np.int32)
+        lengths = np.diff(np.frombuffer(self._offsets, dtype=np.int64))
+        keep = mapping[:self.num_rows] >= 0
+
+        new_offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(lengths[keep])
+        store = TokenStore()
+        store.terms = list(self.terms)
+        store.vocab = dict(self.vocab)
+        store._ids = array('i', ids[np.repeat(keep, lengths)].tobytes())
+        store._offsets = array('q', new_offsets.tobytes())
+        return store
+
+    def to_arrays(self, num_rows: Optional[int] = None) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """导出前 num_rows 行（默认全部行）为 (词表, 扁平数组) 以便写入快照
+
+        先复制再转换，不导出仍在追加的缓冲区，可与追加并发进行。
+        """
+        num_rows = self.num_rows if num_rows is None else num_rows
+        offsets = np.frombuffer(self._offsets.tobytes(), dtype=np.int64)[:num_rows + 1]
+        ids = np.frombuffer(self._ids.tobytes(), dtype=np.int32)[:offsets[-1]]
+        return list(self.terms), {"ids": ids, "offsets": offsets}
+
+    @classmethod
+    def from_arrays(cls, terms: List[str], arrays: Dict[str, np.ndarray]) -> "TokenStore":
+        """从快照数组恢复"""
+        store = cls()
+        store.terms = list(terms)
+        store.vocab = {term: term_id for term_id, term in enumerate(store.terms)}
+        store._ids = array('i', np.ascontiguousarray(arrays["ids"], dtype=np.int32).tobytes())
+        store._offsets = array('q', np.ascontiguousarray(arrays["offsets"], dtype=np.int64).tobytes())
+        return store
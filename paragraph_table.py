@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+段落列式元数据表
+"""
+
+import numpy as np
+from typing import Dict, List, Optional
+
+from data_models import Document
+
+# 行文本来源（_text_ref 取值，非负数为外部字符串表下标）
+OWN_TEXT = -1       # 内部文本块
+DOCUMENT_TEXT = -2  # 所属文档的第 paragraph_index 段
+
+class ParagraphTable:
+    """按列保存段落元数据，行号与向量矩阵一致
+
+    每行只保存 int32 文档序号、段落序号、词数和文本下标；文档ID与标题按文档保存一次。
+    段落文本不另存副本：优先引用已登记的 Document 对象的段落，或外部只读字符串表
+    （按需加载模式下为快照文本块）中的文本；两者都没有时（旧版存储、已被覆盖的文档的
+    快照段落）才追加到内部UTF-8文本块中，读取时按偏移解码。
+    """
+
+    def __init__(self, capacity: int = 0):
+        # 文档序号 -> 文档ID / 标题（同ID文档被替换且标题变化时追加新条目）
+        self.doc_ids: List[str] = []
+        self.titles: List[str] = []
+        # 文档序号 -> 段落文本所属的文档对象（没有时为None）
+        self.documents: List[Optional[Document]] = []
+        self._doc_positions: Dict[str, int] = {}
+
+        self._size = 0
+        self._doc_index = np.zeros(capacity, dtype=np.int32)
+        self._paragraph_index = np.zeros(capacity, dtype=np.int32)
+        self._word_count = np.zeros(capacity, dtype=np.int32)
+        self._text_offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._text = bytearray()
+        # 外部字符串表及各行在其中的下标（或 OWN_TEXT / DOCUMENT_TEXT）
+        self.text_source = None
+        self._text_ref = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def doc_index(self) -> np.ndarray:
+        """各行的文档序号"""
+        return self._doc_index[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        """进程私有内存占用（引用快照内存映射的列与文档对象中的段落文本不计入）"""
+        columns = (self._doc_index, self._paragraph_index, self._word_count, self._text_offsets, self._text_ref)
+        return len(self._text) + sum(column.nbytes for column in columns if not isinstance(column, np.memmap))
+
+    @classmethod
+    def from_columns(cls, doc_ids: List[str], titles: List[str], doc_index: np.ndarray, paragraph_index: np.ndarray,
+                     word_count: np.ndarray, text_ref: np.ndarray, text_source) -> "ParagraphTable":
+        """直接引用快照中的列（只读内存映射，不复制），段落文本全部来自 text_source；用于共享只读索引
+
+        doc_index 为-1的行（已删除文档的墓碑行）落到末尾追加的空条目上。
+        """
+        table = cls()
+        table.doc_ids = list(doc_ids) + [""]
+        table.titles = list(titles) + [""]
+        table.documents = [None] * len(table.doc_ids)
+        table._doc_positions = {doc_id: position for position, doc_id in enumerate(doc_ids)}
+        table._size = len(doc_index)
+        table._doc_index = doc_index
+        table._paragraph_index = paragraph_index
+        table._word_count = word_count
+        table._text_ref = text_ref
+        table.text_source = text_source
+        return table
+
+    def add_document(self, doc_id: str, title: str, document: Optional[Document] = None) -> int:
+        """登记文档，返回文档序号（同ID同标题且同一文档对象时复用已有条目）
+
+        document: 段落文本所属的文档对象，之后用 append_paragraph 追加的行直接引用其段落
+        """
+        position = self._doc_positions.get(doc_id)
+        if position is not None and self.titles[position] == title and self.documents[position] is document:
+            return position
+
+        position = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.titles.append(title)
+        self.documents.append(document)
+        self._doc_positions[doc_id] = position
+        return position
+
+    def _ensure_capacity(self, extra: int):
+        required = self._size + extra
+        capacity = self._doc_index.shape[0]
+        if capacity >= required:
+            return
+
+        new_capacity = max(required, capacity * 2, 1024)
+        for name in ("_doc_index", "_paragraph_index", "_word_count", "_text_ref"):
+            column = np.zeros(new_capacity, dtype=np.int32)
+            column[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, column)
+        offsets = np.zeros(new_capacity + 1, dtype=np.int64)
+        offsets[:self._size + 1] = self._text_offsets[:self._size + 1]
+        self._text_offsets = offsets
+
+    def append(self, doc_index: int, paragraph_index: int, text: str, word_count: int) -> int:
+        """追加一行，文本复制到内部文本块，返回行号"""
+        self._text += text.encode('utf-8')
+        return self._append_row(doc_index, paragraph_index, word_count, OWN_TEXT)
+
+    def append_paragraph(self, doc_index: int, paragraph_index: int, word_count: int) -> int:
+        """追加一行，文本引用登记文档时传入的文档对象的第 paragraph_index 段，返回行号"""
+        return self._append_row(doc_index, paragraph_index, word_count, DOCUMENT_TEXT)
+
+    def append_ref(self, doc_index: int, paragraph_index: int, text_ref: int, word_count: int) -> int:
+        """追加一行，文本引用外部字符串表 text_source 的第 text_ref 项"""
+        return self._append_row(doc_index, paragraph_index, word_count, text_ref)
+
+    def _append_row(self, doc_index: int, paragraph_index: int, word_count: int, text_ref: int) -> int:
+        self._ensure_capacity(1)
+        row = self._size
+        self._doc_index[row] = doc_index
+        self._paragraph_index[row] = paragraph_index
+        self._word_count[row] = word_count
+        self._text_ref[row] = text_ref
+        self._text_offsets[row + 1] = len(self._text)
+        self._size += 1
+        return row
+
+    def doc_id(self, row: int) -> str:
+        return self.doc_ids[self._doc_index[row]]
+
+    def title(self, row: int) -> str:
+        return self.titles[self._doc_index[row]]
+
+    def paragraph_index(self, row: int) -> int:
+        return int(self._paragraph_index[row])
+
+    def word_count(self, row: int) -> int:
+        return int(self._word_count[row])
+
+    def text(self, row: int) -> str:
+        text_ref = self._text_ref[row]
+        if text_ref >= 0:
+            return self.text_source.get(text_ref)
+        if text_ref == DOCUMENT_TEXT:
+            return self.documents[self._doc_index[row]].paragraphs[self._paragraph_index[row]]
+        start, end = self._text_offsets[row], self._text_offsets[row + 1]
+        return self._text[start:end].decode('utf-8')
+
+    def row(self, row: int) -> Dict:
+        """以字典形式返回一行（用于展示，不在检索路径上使用）"""
+        return {
+            "doc_id": self.doc_id(row),
+            "title": self.title(row),
+            "paragraph_index": self.paragraph_index(row),
+            "paragraph": self.text(row),
+            "word_count": self.word_count(row)
+        }
+
+    def take(self, rows: np.ndarray) -> "ParagraphTable":
+        """按行号（升序）取出子表，只保留仍被引用的文档条目"""
+        table = ParagraphTable(len(rows))
+        table.text_source = self.text_source
+        doc_mapping: Dict[int, int] = {}
+        for row in rows:
+            old_position = int(self._doc_index[row])
+            position = doc_mapping.get(old_position)
+            if position is None:
+                position = len(table.doc_ids)
+                table.doc_ids.append(self.doc_ids[old_position])
+                table.titles.append(self.titles[old_position])
+                table.documents.append(self.documents[old_position])
+                doc_mapping[old_position] = position
+            start, end = self._text_offsets[row], self._text_offsets[row + 1]
+            table._text += self._text[start:end]
+            table._doc_index[table._size] = position
+            table._paragraph_index[table._size] = self._paragraph_index[row]
+            table._word_count[table._size] = self._word_count[row]
+            table._text_ref[table._size] = self._text_ref[row]
+            table._size += 1
+            table._text_offsets[table._size] = len(table._text)
+
+        # 文档ID指向其最新的条目
+        for old_position in sorted(doc_mapping):
+            table._doc_positions[self.doc_ids[old_position]] = doc_mapping[old_position]
+        return table
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+向量降维模块（PCA投影 / Matryoshka式截断）
+"""
+
+import numpy as np
+from typing import Dict, Optional
+
+class EmbeddingProjection:
+    """将向量投影到低维空间：y = (x - mean) @ components
+
+    mode 为 pca 时在训练向量上拟合主成分；为 truncate 时直接保留前 dim 维
+    （适用于按 Matryoshka 方式训练的模型）。投影结果需由调用方重新L2归一化。
+    """
+
+    def __init__(self, dim: int, mode: str = "pca"):
+        self.dim = dim
+        self.mode = mode
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        # 保留的方差比例（仅pca）
+        self.explained_variance_ratio = 1.0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.components is not None
+
+    def train(self, embeddings: np.ndarray):
+        """拟合投影矩阵（协方差矩阵特征分解，取方差最大的 dim 个方向）"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        input_dim = embeddings.shape[1]
+        dim = min(self.dim, input_dim)
+
+        if self.mode == "truncate":
+            self.mean = np.zeros(input_dim, dtype=np.float32)
+            self.components = np.eye(input_dim, dim, dtype=np.float32)
+        else:
+            self.mean = embeddings.mean(axis=0).astype(np.float32)
+            centered = (embeddings - self.mean).astype(np.float64)
+            covariance = centered.T @ centered / max(len(embeddings) - 1, 1)
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+            order = np.argsort(eigenvalues)[::-1][:dim]
+            self.components = np.ascontiguousarray(eigenvectors[:, order], dtype=np.float32)
+            total = float(eigenvalues.clip(min=0).sum())
+            self.explained_variance_ratio = float(eigenvalues[order].clip(min=0).sum() / total) if total > 0 else 1.0
+
+        self.dim = dim
+        self.trained_rows = embeddings.shape[0]
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        """投影单个向量或矩阵"""
+        return (np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components
+
+    def to_dict(self) -> Dict:
+        """导出为可持久化的字典"""
+        return {
+            "dim": self.dim,
+            "mode": self.mode,
+            "mean": self.mean,
+            "components": self.components,
+            "trained_rows": self.trained_rows,
+            "explained_variance_ratio": self.explained_variance_ratio
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "EmbeddingProjection":
+        """从持久化字典恢复"""
+        projection = cls(dim=data["dim"], mode=data.get("mode", "pca"))
+        projection.mean = data["mean"]
+        projection.components = data["components"]
+        projection.trained_rows = data.get("trained_rows", 0)
+        projection.explained_variance_ratio = data.get("explained_variance_ratio", 1.0)
+        return projection
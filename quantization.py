@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+向量量化模块（逐维标量int8量化）
+"""
+
+import numpy as np
+from typing import Dict, Optional
+
+class ScalarQuantizer:
+    """逐维标量量化：每一维按训练得到的[min, max]线性映射到uint8
+
+    近似内积: q · x ≈ (codes @ (q * scale)) + q · offset
+    """
+
+    def __init__(self):
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        # 训练时使用的向量数，用于判断是否需要随数据增长重新训练
+        self.trained_rows = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.offset is not None
+
+    def train(self, embeddings: np.ndarray):
+        """统计每一维的取值范围"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        low = embeddings.min(axis=0)
+        high = embeddings.max(axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        self.offset = low.astype(np.float32)
+        self.scale = scale.astype(np.float32)
+        self.trained_rows = embeddings.shape[0]
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """float32 向量 -> uint8 码（超出训练范围的值被截断）"""
+        codes = np.rint((np.asarray(embeddings, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """uint8 码 -> 近似 float32 向量"""
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def score(self, codes: np.ndarray, query: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        """在压缩码上分块计算与查询的近似内积"""
+        query = np.asarray(query, dtype=np.float32)
+        scaled_query = query * self.scale
+        bias = float(query @ self.offset)
+
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], chunk_size):
+            chunk = codes[start:start + chunk_size].astype(np.float32)
+            scores[start:start + chunk_size] = chunk @ scaled_query
+        return scores + bias
+
+    def to_dict(self) -> Dict:
+        """导出为可持久化的字典"""
+        return {"offset": self.offset, "scale": self.scale, "trained_rows": self.trained_rows}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ScalarQuantizer":
+        """从持久化字典恢复"""
+        quantizer = cls()
+        quantizer.offset = data["offset"]
+        quantizer.scale = data["scale"]
+        quantizer.trained_rows = data.get("trained_rows", 0)
+        return quantizer
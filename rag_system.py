@@ -8,15 +8,18 @@ import os
 import time
 import uuid
 import logging
+import threading
 from typing import Dict, List, Optional
 from datetime import datetime
 from data_processor import DataProcessor
 from vector_store import IntelligentVectorStore
+from sharded_store import ShardedVectorStore
+from reranker import CrossEncoderReranker
 from llm_client import LLMClient
 from conversation_manager import ConversationManager
-from data_models import ConversationTurn, SearchResult
+from data_models import ConversationTurn, Document, SearchResult
 from config import Config
-from image_processor import ImageProcessor
+from image_processor import image_processor
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -26,13 +29,25 @@ class AdvancedRAGSystem:
 
     def __init__(self):
         self.processor = DataProcessor()
-        self.vector_store = IntelligentVectorStore()
+        # 当前使用的向量存储；构建或重新加载快照时整体替换为新实例（引用赋值是原子的），
+        # 查询开始时取一次引用，进行中的查询在旧版本上完成
+        self.vector_store = self._new_store()
+        # 串行化知识库修改与存储替换，避免修改写入即将被替换的旧存储
+        self._write_lock = threading.Lock()
+        self._watch_thread: Optional[threading.Thread] = None
+        # 交叉编码器重排序（Config.RERANKER_ENABLED 关闭时为None）
+        self.reranker = CrossEncoderReranker() if Config.RERANKER_ENABLED else None
         self.llm_client = LLMClient()
         self.conversation_manager = ConversationManager()
-        self.image_processor = ImageProcessor()
+        # 复用进程内的图片处理器单例
+        self.image_processor = image_processor
 
-        # 加载存储
-        self.vector_store.load_from_file()
+        # 加载存储、向量模型等耗时初始化在预热线程中完成，见 start_warmup()；
+        # 预热结束（无论成功与否）时置位，是否就绪与失败原因见 readiness
+        self._warmup_done = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._warmup_lock = threading.Lock()
+        self.readiness = {"ready": False, "stage": "pending", "error": None, "seconds": None}
 
         # 性能统计
         self.stats = {
@@ -41,14 +56,133 @@ class AdvancedRAGSystem:
             "avg_confidence": 0
         }
 
+    def start_warmup(self):
+        """启动后台预热线程（重复调用无副作用）"""
+        with self._warmup_lock:
+            if self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=self._warmup, name="rag-warmup", daemon=True)
+                self._warmup_thread.start()
+
+    def _warmup(self):
+        """加载知识库、jieba词典与向量模型，并探测OCR可用性"""
+        start_time = time.time()
+        try:
+            self.readiness["stage"] = "loading_knowledge_base"
+            self.vector_store.load_from_file()
+            self.readiness["stage"] = "loading_tokenizer"
+            self.processor.warmup()
+            self.readiness["stage"] = "loading_model"
+            self.vector_store.warmup()
+            if self.reranker is not None:
+                self.readiness["stage"] = "loading_reranker"
+                self.reranker.warmup()
+            self.readiness["stage"] = "checking_ocr"
+            _ = self.image_processor.ocr_available
+            self.readiness["stage"] = "ready"
+            self.readiness["ready"] = True
+            logger.info(f"系统预热完成，耗时 {time.time() - start_time:.2f} 秒")
+            self._start_snapshot_watcher()
+        except Exception as e:
+            # 保留失败时所处的阶段，就绪检查返回503，查询与修改直接报告失败原因
+            self.readiness["error"] = str(e)
+            logger.error(f"系统预热失败: {str(e)}")
+        finally:
+            self.readiness["seconds"] = round(time.time() - start_time, 3)
+            self._warmup_done.set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待预热完成（未启动时先启动），返回是否已就绪；预热失败时抛出 RuntimeError"""
+        self.start_warmup()
+        if not self._warmup_done.wait(timeout):
+            return False
+        if self.readiness["error"]:
+            raise RuntimeError(f"系统预热失败: {self.readiness['error']}")
+        return True
+
+    def _not_ready_message(self) -> Optional[str]:
+        """查询前等待预热（最多 Config.READY_WAIT_SECONDS 秒），未就绪时返回提示信息"""
+        try:
+            if self.wait_until_ready(Config.READY_WAIT_SECONDS):
+                return None
+        except RuntimeError as e:
+            return str(e)
+        return "系统正在初始化，请稍后重试"
+
+    @property
+    def is_ready(self) -> bool:
+        return self.readiness["ready"]
+
+    def _start_snapshot_watcher(self):
+        """启动快照监视线程（Config.SNAPSHOT_WATCH_INTERVAL 为0时不启动）"""
+        if Config.SNAPSHOT_WATCH_INTERVAL <= 0 or self._watch_thread is not None:
+            return
+        self._watch_thread = threading.Thread(target=self._watch_snapshots, name="snapshot-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def _watch_snapshots(self):
+        """定期检查CURRENT指向的快照，其他进程发布新快照后自动重新加载"""
+        while True:
+            time.sleep(Config.SNAPSHOT_WATCH_INTERVAL)
+            try:
+                store = self.vector_store
+                if store.published_snapshot_name() != store.snapshot_name:
+                    self.reload_knowledge_base()
+            except Exception as e:
+                logger.error(f"检查快照更新失败: {str(e)}")
+
+    def reload_knowledge_base(self, force: bool = False) -> Dict:
+        """在后台加载CURRENT指向的快照并原子替换当前存储，加载期间查询继续使用旧版本"""
+        self.wait_until_ready()
+        with self._write_lock:
+            current = self.vector_store
+            # 本进程的后台快照可能正在发布新版本并清理日志段，等待其完成后再读取CURRENT
+            current.wait_for_snapshot()
+            snapshot_name = current.published_snapshot_name()
+            if snapshot_name is None:
+                return {"success": False, "message": "未找到已发布的快照"}
+            if snapshot_name == current.snapshot_name and not force:
+                return {"success": True, "reloaded": False, "snapshot": snapshot_name, "message": "已是最新快照"}
+
+            start_time = time.time()
+            store = self._new_store()
+            store.load_from_file()
+            # 加载失败时 load_from_file 会回退为空存储，不能替换
+            if store.snapshot_name != snapshot_name:
+                store.close()
+                return {"success": False, "message": f"加载快照失败: {snapshot_name}"}
+            # 查询向量只与模型有关，沿用旧存储的缓存
+            store.query_cache = current.query_cache
+            self._swap_store(store)
+
+        seconds = round(time.time() - start_time, 3)
+        logger.info(f"已切换到快照 {snapshot_name}，耗时 {seconds} 秒")
+        return {"success": True, "reloaded": True, "snapshot": snapshot_name,
+                "previous_snapshot": current.snapshot_name, "seconds": seconds, "message": "知识库已重新加载"}
+
+    @staticmethod
+    def _new_store(rebuild: bool = False):
+        """按配置创建向量存储：Config.SEARCH_SHARDS 大于1时为多进程分片存储"""
+        if Config.SEARCH_SHARDS > 1:
+            return ShardedVectorStore(Config.SEARCH_SHARDS, rebuild=rebuild)
+        return IntelligentVectorStore()
+
+    def _swap_store(self, store):
+        """以新存储替换当前存储（调用方持有写锁），替换后旧存储停止写入"""
+        previous = self.vector_store
+        self.vector_store = store
+        if isinstance(previous, ShardedVectorStore):
+            # 分片进程停止后旧存储不能再检索，宽限期后再停止，检索中的查询照常完成
+            previous.close(grace=Config.SHARD_CLOSE_GRACE)
+        else:
+            previous.close()
+        self.invalidate_rerank_scores()
+
     def build_knowledge_base(self, data_dir: str, include_images: bool = True) -> Dict:
         """构建知识库"""
+        self.wait_until_ready()
         if not os.path.exists(data_dir):
             return {"success": False, "message": f"数据目录不存在: {data_dir}"}
 
-        # 重置向量存储
-        self.vector_store = IntelligentVectorStore()
-
         # 支持的文件类型
         txt_files = [f for f in os.listdir(data_dir) if f.endswith('.txt')]
         image_files = []
@@ -64,12 +198,15 @@ class AdvancedRAGSystem:
         image_processed_count = 0
         image_failed_count = 0
 
+        # 先收集所有文档，最后统一批量编码
+        documents = []
+
         # 处理文本文件
         for filename in txt_files:
             file_path = os.path.join(data_dir, filename)
             document = self.processor.process_document(file_path)
             if document:
-                self.vector_store.add_document(document)
+                documents.append(document)
                 processed_count += 1
             else:
                 failed_count += 1
@@ -93,7 +230,7 @@ class AdvancedRAGSystem:
                     document = self.image_processor.create_document_from_ocr(ocr_result, file_path)
 
                     if document:
-                        self.vector_store.add_document(document)
+                        documents.append(document)
                         image_processed_count += 1
                         logger.info(f"成功处理图片: {filename}")
                     else:
@@ -104,8 +241,19 @@ class AdvancedRAGSystem:
                     image_failed_count += 1
                     logger.error(f"处理图片失败 {filename}: {e}")
 
-        # 保存向量存储
-        self.vector_store.save_to_file()
+        # 在新的向量存储中批量向量化并发布快照，完成后替换当前存储，构建期间查询继续使用旧版本
+        with self._write_lock:
+            self.vector_store.wait_for_snapshot()
+            store = self._new_store(rebuild=True)
+            embedding_stats = store.add_documents(documents)
+            store.save_to_file()
+            if Config.SHARED_INDEX or Config.EMBEDDING_STORAGE == "int8":
+                # 构建用的存储数据在进程私有内存中，改为挂载刚发布的快照：共享只读索引以只读方式挂载
+                # （其他工作进程由快照监视切换）；int8存储时原始向量改为内存映射，只常驻量化码
+                store.close()
+                store = self._new_store()
+                store.load_from_file()
+            self._swap_store(store)
 
         # 统计结果
         total_processed = processed_count + image_processed_count
@@ -130,12 +278,94 @@ class AdvancedRAGSystem:
                 "total_failed": total_failed,
                 "total_files": total_files,
                 "ocr_available": self.image_processor.ocr_available
-            }
+            },
+            "embedding": embedding_stats
         }
 
         logger.info(f"知识库构建完成 - 文本文件: {processed_count}/{len(txt_files)}, 图片文件: {image_processed_count}/{len(image_files)}")
         return result
 
+    def upsert_document(self, file_path: Optional[str] = None, doc_id: Optional[str] = None,
+                        title: Optional[str] = None, content: Optional[str] = None,
+                        metadata: Optional[Dict] = None) -> Dict:
+        """新增或替换单个文档（来自文件路径或直接提供的文本），无需重建知识库"""
+        self.wait_until_ready()
+        if Config.SHARED_INDEX:
+            return self._read_only_result()
+
+        if file_path:
+            if not os.path.exists(file_path):
+                return {"success": False, "message": f"文件不存在: {file_path}"}
+            document = self.processor.process_document(file_path)
+        else:
+            document = self.processor.build_document(doc_id, content, title=title, metadata=metadata)
+
+        if document is None:
+            return {"success": False, "message": "文档处理失败"}
+
+        with self._write_lock:
+            store = self.vector_store
+            existed = document.id in store.documents
+            embedding_stats = store.upsert_document(document)
+            store.flush()
+        self.invalidate_rerank_scores()
+
+        return {
+            "success": True,
+            "message": "文档已更新" if existed else "文档已添加",
+            "doc_id": document.id,
+            "embedding": embedding_stats
+        }
+
+    def add_documents(self, documents: List[Document]) -> Dict:
+        """向当前知识库追加文档（修改逐条写入WAL，超过阈值时后台生成快照）"""
+        self.wait_until_ready()
+        if Config.SHARED_INDEX:
+            return self._read_only_result()
+
+        with self._write_lock:
+            store = self.vector_store
+            embedding_stats = store.add_documents(documents)
+            store.flush()
+        self.invalidate_rerank_scores()
+        return embedding_stats
+
+    def delete_document(self, doc_id: str) -> Dict:
+        """从知识库删除文档"""
+        self.wait_until_ready()
+        if Config.SHARED_INDEX:
+            return self._read_only_result()
+
+        with self._write_lock:
+            store = self.vector_store
+            if not store.delete_document(doc_id):
+                return {"success": False, "message": f"文档不存在: {doc_id}"}
+            store.flush()
+        self.invalidate_rerank_scores()
+        return {"success": True, "message": "文档已删除", "doc_id": doc_id}
+
+    @staticmethod
+    def _read_only_result() -> Dict:
+        return {"success": False, "message": "共享只读索引模式下不能修改单个文档，请通过 /build 重建并发布新快照"}
+
+    def invalidate_rerank_scores(self):
+        """文档变化后清空重排序分数缓存（缓存键中的段落ID在文档替换后会指向新内容）"""
+        if self.reranker is not None:
+            self.reranker.invalidate()
+
+    def _retrieve(self, query: str, filters: Optional[Dict] = None, top_k: int = 5) -> List[SearchResult]:
+        """向量检索；启用重排序时多取候选，在延迟预算内用交叉编码器重排后取前 top_k 个"""
+        # 只取一次存储引用，检索期间发生替换也在同一版本上完成
+        store = self.vector_store
+        if self.reranker is None:
+            return store.intelligent_search(query, top_k=top_k, filters=filters)
+
+        deadline = time.perf_counter() + Config.RERANKER_BUDGET_MS / 1000
+        search_results = store.intelligent_search(
+            query, top_k=max(top_k, self.reranker.top_n), filters=filters
+        )
+        return self.reranker.rerank(query, search_results, deadline)[:top_k]
+
     def _build_context(self, search_results: List[SearchResult], max_length: int = Config.MAX_CONTEXT_LENGTH) -> str:
         """构建上下文"""
         context_parts = []
@@ -168,7 +398,8 @@ class AdvancedRAGSystem:
         avg_score = total_score / len(search_results)
         return min(avg_score, 1.0)
 
-    def intelligent_query(self, query: str, session_id: Optional[str] = None, use_history: bool = True) -> Dict:
+    def intelligent_query(self, query: str, session_id: Optional[str] = None, use_history: bool = True,
+                          filters: Optional[Dict] = None) -> Dict:
         """智能查询"""
         start_time = time.time()
 
@@ -176,9 +407,17 @@ class AdvancedRAGSystem:
         if not session_id:
             session_id = self.conversation_manager.create_session()
 
+        not_ready = self._not_ready_message()
+        if not_ready:
+            return {
+                "success": False,
+                "message": not_ready,
+                "session_id": session_id
+            }
+
         try:
             # 1. 向量检索
-            search_results = self.vector_store.intelligent_search(query, top_k=5)
+            search_results = self._retrieve(query, filters=filters)
 
             if not search_results:
                 return {
@@ -276,7 +515,8 @@ class AdvancedRAGSystem:
                 "session_id": session_id
             }
 
-    def intelligent_query_stream(self, query: str, session_id: Optional[str] = None, use_history: bool = True):
+    def intelligent_query_stream(self, query: str, session_id: Optional[str] = None, use_history: bool = True,
+                                 filters: Optional[Dict] = None):
         """智能查询（流式响应）"""
         start_time = time.time()
 
@@ -284,9 +524,21 @@ class AdvancedRAGSystem:
         if not session_id:
             session_id = self.conversation_manager.create_session()
 
+        not_ready = self._not_ready_message()
+        if not_ready:
+            yield {
+                "type": "error",
+                "data": {
+                    "success": False,
+                    "message": not_ready,
+                    "session_id": session_id
+                }
+            }
+            return
+
         try:
             # 1. 向量检索
-            search_results = self.vector_store.intelligent_search(query, top_k=5)
+            search_results = self._retrieve(query, filters=filters)
 
             if not search_results:
                 yield {
@@ -421,11 +673,17 @@ class AdvancedRAGSystem:
 
     def get_system_stats(self) -> Dict:
         """获取系统统计信息"""
+        store = self.vector_store
         return {
             "knowledge_base": {
-                "documents": len(self.vector_store.documents),
-                "paragraphs": len(self.vector_store.paragraph_embeddings)
+                "documents": len(store.documents),
+                "paragraphs": store.paragraph_count,
+                "snapshot": store.snapshot_name
             },
+            "readiness": dict(self.readiness),
+            "index": store.get_index_stats(),
+            "query_cache": store.query_cache.stats(),
+            "reranker": self.reranker.get_stats() if self.reranker is not None else None,
             "performance": self.stats,
             "ai_service": {
                 "current": self.llm_client.service,
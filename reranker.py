@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+交叉编码器重排序模块
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+from data_models import SearchResult
+from cache import LRUCache
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """对检索结果的前 top_n 个候选用交叉编码器批量打分并重新排序
+
+    (查询哈希, 段落ID) 的分数缓存在LRU中；按单对打分耗时的滑动平均预估本次耗时，
+    超出请求剩余的延迟预算时跳过重排序，保持原有排序返回。
+    """
+
+    def __init__(self, model_name: str = Config.RERANKER_MODEL, top_n: int = Config.RERANKER_TOP_N):
+        self.model_name = model_name
+        self.top_n = top_n
+        # 模型延迟加载（首次重排序或 warmup() 时）
+        self._model = None
+        self._lock = threading.Lock()
+        # 段落ID为"文档ID:段落序号"，文档修改后需调用 invalidate()
+        self.score_cache = LRUCache(Config.RERANKER_CACHE_SIZE)
+        # 单对(查询, 段落)打分耗时的指数滑动平均（毫秒）
+        self._pair_ms: Optional[float] = None
+        self.stats = {
+            "reranked": 0,
+            "skipped_budget": 0,
+            "scored_pairs": 0
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    start_time = time.time()
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+                    logger.info(f"重排序模型加载完成: {self.model_name}, 耗时 {time.time() - start_time:.2f} 秒")
+        return self._model
+
+    def warmup(self):
+        """预先加载模型并完成一次打分，首次打分的耗时同时作为延迟预估的初值"""
+        self._score([("warmup", "warmup")])
+
+    def invalidate(self):
+        """文档新增、替换或删除后清空分数缓存"""
+        self.score_cache.clear()
+
+    @staticmethod
+    def _query_hash(query: str) -> str:
+        return hashlib.sha1(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+    def _score(self, pairs: List[tuple]) -> List[float]:
+        """一次批量打分并更新单对耗时的滑动平均"""
+        start_time = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        pair_ms = (time.perf_counter() - start_time) * 1000 / len(pairs)
+
+        alpha = Config.RERANKER_EMA_ALPHA
+        with self._lock:
+            self._pair_ms = pair_ms if self._pair_ms is None else alpha * pair_ms + (1 - alpha) * self._pair_ms
+            self.stats["scored_pairs"] += len(pairs)
+        return [float(score) for score in scores]
+
+    def rerank(self, query: str, results: List[SearchResult], deadline: Optional[float] = None) -> List[SearchResult]:
+        """重排序前 top_n 个结果，其余结果保持原顺序接在后面
+
+        deadline 为 time.perf_counter() 下的截止时间，预计无法在截止前完成打分时直接返回原结果。
+        """
+        if len(results) < 2:
+            return results
+
+        candidates = results[:self.top_n]
+        query_hash = self._query_hash(query)
+        keys = [(query_hash, f"{result.doc_id}:{result.paragraph_index}") for result in candidates]
+        scores = [self.score_cache.get(key) for key in keys]
+        missing = [pos for pos, score in enumerate(scores) if score is None]
+
+        if missing:
+            if deadline is not None and self._pair_ms is not None:
+                remaining_ms = (deadline - time.perf_counter()) * 1000
+                if self._pair_ms * len(missing) > remaining_ms:
+                    with self._lock:
+                        self.stats["skipped_budget"] += 1
+                        # 跳过时衰减预估值，负载下降后能重新尝试重排序
+                        self._pair_ms *= 1 - Config.RERANKER_EMA_ALPHA
+                    return results
+
+            new_scores = self._score([(query, candidates[pos].paragraph) for pos in missing])
+            for pos, score in zip(missing, new_scores):
+                scores[pos] = score
+                self.score_cache.put(keys[pos], score)
+
+        order = sorted(range(len(candidates)), key=lambda pos: -scores[pos])
+        for pos in order:
+            candidates[pos].metadata["rerank_score"] = scores[pos]
+        with self._lock:
+            self.stats["reranked"] += 1
+        return [candidates[pos] for pos in order] + results[self.top_n:]
+
+    def get_stats(self) -> Dict:
+        """重排序统计"""
+        return dict(
+            self.stats,
+            model=self.model_name,
+            top_n=self.top_n,
+            pair_ms=round(self._pair_ms, 3) if self._pair_ms is not None else None,
+            score_cache=self.score_cache.stats()
+        )
@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片向量存储模块
+
+段落按文档ID哈希分配到 N 个分片，每个分片由一个独立的工作进程持有
+（进程内为只含本分片文档的 IntelligentVectorStore，快照与WAL保存在各自目录）。
+主进程负责编码查询与段落，通过本地连接（multiprocessing.connection，Unix域套接字或Windows命名管道）
+把查询并行分发到全部分片，再按与单进程存储相同的多样化规则合并各分片的前 top_k 个结果。
+
+目录结构：
+    <Config.SHARD_STORAGE_DIR>/shards.json      分片数（改变分片数需要重建知识库）
+    <Config.SHARD_STORAGE_DIR>/shard-<序号>/    各分片的快照目录与 wal/
+
+工作进程以 `python sharded_store.py --shard <序号> --address <地址>` 启动后回连主进程，
+不依赖 multiprocessing 的进程启动方式（不会重新导入主进程的 __main__ 模块），
+地址为 `主机:端口` 时使用TCP连接，之后也可以在其他节点上启动并连接。
+"""
+
+import os
+import sys
+import json
+import zlib
+import time
+import logging
+import argparse
+import threading
+import subprocess
+import numpy as np
+from collections.abc import Mapping
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Iterator, List, Optional
+from data_models import Document, SearchResult
+from vector_store import IntelligentVectorStore
+from cache import EmbeddingCache
+from index_storage import current_snapshot_name
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+LAYOUT_FILE = "shards.json"
+AUTHKEY_ENV = "RAG_SHARD_AUTHKEY"
+
+def shard_for(doc_id: str, num_shards: int) -> int:
+    """文档所属分片（CRC32取模，跨进程、跨重启稳定）"""
+    return zlib.crc32(doc_id.encode('utf-8')) % num_shards
+
+def parse_address(text: str):
+    """`主机:端口` 解析为TCP地址，其余（Unix域套接字路径、命名管道名）原样返回"""
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit() and os.path.sep not in text:
+        return host, int(port)
+    return text
+
+def _config_values() -> Dict:
+    """工作进程需要与主进程一致的配置（包括运行时修改过的项），LLM密钥不下发"""
+    return {name: value for name, value in vars(Config).items() if name.isupper() and name != "AI_CONFIGS"}
+
+class ShardWorker:
+    """分片工作进程中的请求处理：每个命令对应一个 _handle_<命令> 方法"""
+
+    def __init__(self, shard_id: int):
+        self.shard_id = shard_id
+        self.store: Optional[IntelligentVectorStore] = None
+
+    def _handle_init(self, config_values: Dict, storage_dir: str, encoder_backend: str):
+        for name, value in config_values.items():
+            setattr(Config, name, value)
+        store = IntelligentVectorStore(Config.VECTOR_MODEL)
+        store.storage_dir = storage_dir
+        store.storage_path = os.path.join(storage_dir, os.path.basename(Config.STORAGE_PATH))
+        # 段落向量由主进程编码后随请求传入，分片内的向量缓存只作中转，不落盘
+        store.embedding_cache = EmbeddingCache(None, Config.EMBEDDING_CACHE_MAX_ENTRIES)
+        # 向量缓存与WAL按主进程实际使用的编码后端区分
+        store.set_encoder_backend(encoder_backend)
+        self.store = store
+
+    def _handle_load(self) -> Optional[str]:
+        self.store.load_from_file()
+        return self.store.snapshot_name
+
+    def _handle_save(self) -> Optional[str]:
+        self.store.save_to_file()
+        return self.store.snapshot_name
+
+    def _handle_flush(self) -> Optional[str]:
+        self.store.flush()
+        return self.store.snapshot_name
+
+    def _handle_wait_for_snapshot(self) -> Optional[str]:
+        self.store.wait_for_snapshot()
+        return self.store.snapshot_name
+
+    def _handle_add(self, documents: List[Document], texts: List[str], embeddings: np.ndarray) -> Dict:
+        # 先写入向量缓存，add_documents 取缓存命中，不需要在分片进程中加载模型
+        if len(texts):
+            store = self.store
+            store.embedding_cache = EmbeddingCache(None, max(len(texts), Config.EMBEDDING_CACHE_MAX_ENTRIES))
+            store.embedding_cache.put_many(store.model_key, texts, embeddings)
+        return self.store.add_documents(documents)
+
+    def _handle_delete(self, doc_id: str) -> bool:
+        return self.store.delete_document(doc_id)
+
+    def _handle_search(self, query_embeddings: np.ndarray, query_tokens: List[Optional[List[str]]], top_k: int,
+                       fusion: Optional[str], filters: Optional[Dict], with_vectors: bool) -> List:
+        """返回各查询的 (结果, 结果向量)；合并时需要计算跨分片的结果间相似度才返回向量"""
+        results = self.store.search_encoded(query_embeddings, query_tokens, top_k, fusion, filters)
+        return [(query_results, self.store.result_vectors(query_results) if with_vectors else None)
+                for query_results in results]
+
+    def _handle_has_document(self, doc_id: str) -> bool:
+        return doc_id in self.store.documents
+
+    def _handle_document(self, doc_id: str) -> Optional[Document]:
+        return self.store.documents.get(doc_id)
+
+    def _handle_document_ids(self) -> List[str]:
+        return list(self.store.documents)
+
+    def _handle_paragraphs(self, doc_id: Optional[str]) -> List:
+        return list(self.store.iter_paragraphs(doc_id))
+
+    def _handle_stats(self) -> Dict:
+        stats = self.store.get_index_stats()
+        stats["documents"] = len(self.store.documents)
+        stats["live_paragraphs"] = self.store.paragraph_count
+        stats["projected"] = self.store.projection is not None
+        return stats
+
+    def serve(self, conn):
+        """循环处理请求，直到收到 stop 或主进程断开连接"""
+        while True:
+            try:
+                command, args = conn.recv()
+            except (EOFError, OSError):
+                break
+            if command == "stop":
+                conn.send(("ok", None))
+                break
+            try:
+                conn.send(("ok", getattr(self, f"_handle_{command}")(*args)))
+            except Exception as e:
+                logger.error(f"分片 {self.shard_id} 执行 {command} 失败: {str(e)}")
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+        if self.store is not None:
+            self.store.close()
+        conn.close()
+
+class ShardClient:
+    """主进程中一个分片的连接：请求与响应严格配对，由锁保证同一时刻只有一个请求在途"""
+
+    def __init__(self, shard_id: int, conn, process: Optional[subprocess.Popen]):
+        self.shard_id = shard_id
+        self.conn = conn
+        self.process = process
+        self.lock = threading.Lock()
+
+    def send(self, command: str, *args):
+        self.conn.send((command, args))
+
+    def recv(self):
+        status, value = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(f"分片 {self.shard_id} 执行失败: {value}")
+        return value
+
+    def call(self, command: str, *args):
+        with self.lock:
+            self.send(command, *args)
+            return self.recv()
+
+class ShardDocuments(Mapping):
+    """文档ID -> Document 的只读视图，按需从文档所在分片读取"""
+
+    def __init__(self, store: "ShardedVectorStore"):
+        self._store = store
+
+    def __getitem__(self, doc_id: str) -> Document:
+        document = self._store.shard(doc_id).call("document", doc_id)
+        if document is None:
+            raise KeyError(doc_id)
+        return document
+
+    def __contains__(self, doc_id) -> bool:
+        return self._store.shard(doc_id).call("has_document", doc_id)
+
+    def __iter__(self) -> Iterator[str]:
+        results = self._store.fan_out({i: ("document_ids",) for i in range(self._store.num_shards)})
+        return iter([doc_id for i in sorted(results) for doc_id in results[i]])
+
+    def __len__(self) -> int:
+        return sum(stats["documents"] for stats in self._store.shard_stats())
+
+class ShardedVectorStore:
+    """多进程分片向量存储，接口与 IntelligentVectorStore 的检索、增删、持久化部分一致
+
+    - 分片按文档划分，同一文档的段落都在一个分片内，因此每文档结果数上限在分片内即可保证；
+      doc_cap 模式下按综合评分归并各分片的前 top_k 个结果，与单进程结果一致。
+    - MMR 模式下各分片先按同样规则选出候选，合并时在候选并集上重新做一次MMR
+      （各分片分别拟合降维投影时，不同分片结果之间的冗余无法比较，按0计）。
+    - BM25 的文档频率按分片统计，启用融合检索时分数与单进程存储略有差异。
+    """
+
+    def __init__(self, num_shards: Optional[int] = None, storage_dir: Optional[str] = None, rebuild: bool = False):
+        """rebuild: 重建知识库时按 num_shards 重新分片，忽略已有分片存储的分片数"""
+        self.storage_dir = storage_dir or Config.SHARD_STORAGE_DIR
+        layout = None if rebuild else self._read_layout()
+        requested = num_shards or Config.SEARCH_SHARDS
+        if layout is not None and layout["num_shards"] != requested:
+            logger.warning(f"已有分片存储使用 {layout['num_shards']} 个分片，与配置的 {requested} 不一致，"
+                           f"沿用已有分片数（重建知识库后生效）")
+            requested = layout["num_shards"]
+        self.num_shards = max(1, requested)
+
+        # 主进程只用于编码的空存储（不加载、不保存），复用其向量模型、查询向量缓存与段落向量缓存
+        self.encoder = IntelligentVectorStore(Config.VECTOR_MODEL)
+        self.documents = ShardDocuments(self)
+
+        # 工作进程在首次使用时启动，构造本身保持轻量
+        self.shards: List[ShardClient] = []
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._shard_snapshots: List[Optional[str]] = [None] * self.num_shards
+
+    def shard_dir(self, shard_id: int) -> str:
+        return os.path.join(self.storage_dir, f"shard-{shard_id:02d}")
+
+    def _read_layout(self) -> Optional[Dict]:
+        path = os.path.join(self.storage_dir, LAYOUT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_layout(self):
+        os.makedirs(self.storage_dir, exist_ok=True)
+        path = os.path.join(self.storage_dir, LAYOUT_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"num_shards": self.num_shards}, f)
+        os.replace(tmp_path, path)
+
+    def _ensure_started(self):
+        """启动全部分片工作进程并等待其回连（重复调用无副作用）"""
+        if self.shards:
+            return
+        with self._start_lock:
+            if self.shards:
+                return
+            if self._closed:
+                raise RuntimeError("分片存储已关闭")
+
+            start_time = time.time()
+            authkey = os.urandom(16)
+            # 默认使用本机的Unix域套接字或命名管道（本地TCP连接的小消息会受Nagle算法与延迟确认影响）
+            listener = Listener(authkey=authkey)
+            env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+            processes = [
+                subprocess.Popen([sys.executable, os.path.abspath(__file__), "--shard", str(shard_id),
+                                  "--address", listener.address], env=env)
+                for shard_id in range(self.num_shards)
+            ]
+
+            # 分片进程回连顺序不定，连接后先上报自己的序号
+            connections: Dict[int, object] = {}
+
+            def accept_all():
+                while len(connections) < self.num_shards:
+                    conn = listener.accept()
+                    connections[conn.recv()] = conn
+
+            accept_thread = threading.Thread(target=accept_all, name="shard-accept", daemon=True)
+            accept_thread.start()
+            accept_thread.join(Config.SHARD_START_TIMEOUT)
+            listener.close()
+            if len(connections) < self.num_shards:
+                for process in processes:
+                    process.kill()
+                raise RuntimeError(f"分片进程启动超时: {len(connections)}/{self.num_shards} 个已连接")
+
+            shards = [ShardClient(shard_id, connections[shard_id], processes[shard_id])
+                      for shard_id in range(self.num_shards)]
+            config_values = _config_values()
+            # 主进程加载模型后才能确定实际使用的编码后端（加载失败时回退为torch）
+            self.encoder.model
+            for shard in shards:
+                shard.call("init", config_values, self.shard_dir(shard.shard_id), self.encoder.encoder_backend)
+            self.shards = shards
+            logger.info(f"已启动 {self.num_shards} 个分片进程，耗时 {time.time() - start_time:.2f} 秒")
+
+    def shard(self, doc_id: str) -> ShardClient:
+        """文档所在分片的连接"""
+        self._ensure_started()
+        return self.shards[shard_for(doc_id, self.num_shards)]
+
+    def fan_out(self, requests: Dict[int, tuple]) -> Dict[int, object]:
+        """向多个分片同时发送请求后再依次接收，各分片并行执行；按序号加锁避免并发调用之间死锁"""
+        self._ensure_started()
+        shards = [self.shards[shard_id] for shard_id in sorted(requests)]
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            for shard in shards:
+                shard.send(*requests[shard.shard_id])
+            # 即使有分片出错也要收完全部响应，保证后续请求与响应配对
+            results, errors = {}, []
+            for shard in shards:
+                try:
+                    results[shard.shard_id] = shard.recv()
+                except RuntimeError as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+            return results
+        finally:
+            for shard in shards:
+                shard.lock.release()
+
+    def _broadcast(self, command: str, *args) -> List:
+        results = self.fan_out({shard_id: (command, *args) for shard_id in range(self.num_shards)})
+        return [results[shard_id] for shard_id in range(self.num_shards)]
+
+    @property
+    def model(self):
+        return self.encoder.model
+
+    @property
+    def query_cache(self):
+        return self.encoder.query_cache
+
+    @query_cache.setter
+    def query_cache(self, cache):
+        self.encoder.query_cache = cache
+
+    @property
+    def model_loaded(self) -> bool:
+        return self.encoder.model_loaded
+
+    def warmup(self):
+        """启动分片进程并预先加载（主进程中的）向量模型"""
+        self._ensure_started()
+        self.encoder.warmup()
+
+    @property
+    def paragraph_count(self) -> int:
+        """未删除的段落数"""
+        return sum(stats["live_paragraphs"] for stats in self.shard_stats())
+
+    def iter_paragraphs(self, doc_id: Optional[str] = None):
+        """遍历未删除的段落，产出 (分片内行号, 元数据)"""
+        if doc_id is not None:
+            return iter(self.shard(doc_id).call("paragraphs", doc_id))
+        return iter([item for paragraphs in self._broadcast("paragraphs", None) for item in paragraphs])
+
+    def add_documents(self, documents: List[Document], batch_size: int = Config.EMBEDDING_BATCH_SIZE) -> Dict:
+        """批量添加文档：在主进程统一编码段落，按文档所属分片并行写入"""
+        start_time = time.time()
+        unique_documents = {}
+        for document in documents:
+            if document is not None:
+                unique_documents[document.id] = document
+
+        self._ensure_started()
+        by_shard: Dict[int, List[Document]] = {}
+        for document in unique_documents.values():
+            by_shard.setdefault(shard_for(document.id, self.num_shards), []).append(document)
+
+        texts = [paragraph for document in unique_documents.values()
+                 for paragraph in document.paragraphs if paragraph.strip()]
+        encode_start = time.time()
+        cache_hits = self.encoder.embedding_cache.hits
+        embeddings = self.encoder._encode_paragraphs(texts, batch_size) if texts else np.zeros((0, 0), dtype=np.float32)
+        cache_hits = self.encoder.embedding_cache.hits - cache_hits
+        encode_seconds = time.time() - encode_start
+
+        positions = {}
+        position = 0
+        for document in unique_documents.values():
+            count = sum(1 for paragraph in document.paragraphs if paragraph.strip())
+            positions[document.id] = (position, position + count)
+            position += count
+
+        requests = {}
+        for shard_id, shard_documents in by_shard.items():
+            shard_texts = [paragraph for document in shard_documents
+                           for paragraph in document.paragraphs if paragraph.strip()]
+            rows = [row for document in shard_documents for row in range(*positions[document.id])]
+            requests[shard_id] = ("add", shard_documents, shard_texts, embeddings[rows])
+        shard_results = self.fan_out(requests) if requests else {}
+
+        total_seconds = time.time() - start_time
+        paragraphs = len(texts)
+        return {
+            "documents": len(unique_documents),
+            "paragraphs": paragraphs,
+            "replaced_paragraphs": sum(stats["replaced_paragraphs"] for stats in shard_results.values()),
+            "cache_hits": cache_hits,
+            "batch_size": batch_size,
+            "shards": len(shard_results),
+            "encode_seconds": round(encode_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "paragraphs_per_second": round(paragraphs / total_seconds, 2) if total_seconds > 0 else 0.0
+        }
+
+    def add_document(self, document: Document):
+        self.add_documents([document])
+
+    def upsert_document(self, document: Document) -> Dict:
+        return self.add_documents([document])
+
+    def delete_document(self, doc_id: str) -> bool:
+        return self.shard(doc_id).call("delete", doc_id)
+
+    def intelligent_search(self, query: str, top_k: int = 5, diversity_factor: float = 0.3,
+                           fusion: Optional[str] = None, filters: Optional[Dict] = None) -> List[SearchResult]:
+        """智能搜索：编码一次，并行分发到全部分片后合并"""
+        return self.intelligent_search_batch([query], top_k=top_k, fusion=fusion, filters=filters)[0]
+
+    def intelligent_search_batch(self, queries: List[str], top_k: int = 5, fusion: Optional[str] = None,
+                                 filters: Optional[Dict] = None) -> List[List[SearchResult]]:
+        """批量智能搜索：一次模型调用编码全部查询，每个分片一次请求处理全部查询"""
+        if not queries:
+            return []
+
+        fusion = fusion or Config.HYBRID_FUSION
+        query_embeddings = self.encoder._encode_queries(queries)
+        query_tokens = [self.encoder._query_tokens(query, fusion) for query in queries]
+
+        mmr = Config.DIVERSITY_MODE == "mmr"
+        # MMR 合并需要在候选并集上重新选择，各分片多返回一些候选
+        shard_top_k = max(top_k, Config.MMR_CANDIDATES) if mmr else top_k
+        shard_results = self._broadcast("search", query_embeddings, query_tokens, shard_top_k, fusion, filters, mmr)
+        projected = mmr and any(stats["projected"] for stats in self.shard_stats())
+
+        merged = []
+        for i in range(len(queries)):
+            per_shard = [results[i] for results in shard_results]
+            if mmr:
+                merged.append(self._merge_mmr(per_shard, top_k, projected))
+            else:
+                merged.append(self._merge_ranked(per_shard, top_k))
+        return merged
+
+    @staticmethod
+    def _merge_ranked(per_shard: List, top_k: int) -> List[SearchResult]:
+        """按综合评分归并各分片结果（分片按文档划分，每文档上限已在分片内满足）"""
+        candidates = [result for results, _ in per_shard for result in results]
+        candidates.sort(key=lambda result: -result.metadata["combined_score"])
+        return candidates[:top_k]
+
+    @staticmethod
+    def _merge_mmr(per_shard: List, top_k: int, projected: bool) -> List[SearchResult]:
+        """在各分片候选的并集中取综合评分前 MMR_CANDIDATES 个，按MMR重新选择"""
+        candidates = []
+        for shard_id, (results, vectors) in enumerate(per_shard):
+            candidates.extend((result, vectors[i], shard_id) for i, result in enumerate(results))
+        if not candidates:
+            return []
+        candidates.sort(key=lambda item: -item[0].metadata["combined_score"])
+        candidates = candidates[:max(Config.MMR_CANDIDATES, top_k)]
+
+        relevance = np.array([result.metadata["combined_score"] for result, _, _ in candidates], dtype=np.float32)
+        shard_ids = np.array([shard_id for _, _, shard_id in candidates])
+        if projected:
+            # 各分片的投影空间不同：只比较同一分片内结果的相似度
+            pairwise = np.zeros((len(candidates), len(candidates)), dtype=np.float32)
+            for shard_id in np.unique(shard_ids):
+                members = np.flatnonzero(shard_ids == shard_id)
+                vectors = np.stack([candidates[i][1] for i in members])
+                pairwise[np.ix_(members, members)] = vectors @ vectors.T
+        else:
+            vectors = np.stack([vector for _, vector, _ in candidates])
+            pairwise = vectors @ vectors.T
+        _, doc_codes = np.unique([result.doc_id for result, _, _ in candidates], return_inverse=True)
+
+        order = IntelligentVectorStore.mmr_order(relevance, pairwise, doc_codes, top_k)
+        return [candidates[pos][0] for pos in order]
+
+    def shard_stats(self) -> List[Dict]:
+        return self._broadcast("stats")
+
+    def get_index_stats(self) -> Dict:
+        """索引统计：各分片统计及汇总"""
+        shard_stats = self.shard_stats()
+        return {
+            "paragraphs": sum(stats["paragraphs"] for stats in shard_stats),
+            "snapshot": self.snapshot_name,
+            "num_shards": self.num_shards,
+            "search_backend": Config.SEARCH_BACKEND,
+            "candidate_stage": shard_stats[0]["candidate_stage"] if shard_stats else "exact",
+            "encoder_backend": self.encoder.encoder_backend,
+            "shards": shard_stats
+        }
+
+    @property
+    def snapshot_name(self) -> Optional[str]:
+        """各分片快照版本的组合；任一分片尚未保存过时为None"""
+        return self._combine_snapshots(self._shard_snapshots)
+
+    def published_snapshot_name(self) -> Optional[str]:
+        """各分片目录中CURRENT指向的快照版本组合"""
+        return self._combine_snapshots([current_snapshot_name(self.shard_dir(shard_id))
+                                        for shard_id in range(self.num_shards)])
+
+    @staticmethod
+    def _combine_snapshots(names: List[Optional[str]]) -> Optional[str]:
+        if any(name is None for name in names):
+            return None
+        return ",".join(names)
+
+    def load_from_file(self):
+        """各分片并行加载自己的快照并重放日志"""
+        self._shard_snapshots = self._broadcast("load")
+        logger.info(f"从 {self.num_shards} 个分片加载向量存储，段落数: {self.paragraph_count}")
+
+    def save_to_file(self):
+        """各分片并行保存快照，并保存主进程的段落向量缓存"""
+        self._write_layout()
+        self._shard_snapshots = self._broadcast("save")
+        self.encoder.embedding_cache.save()
+
+    def flush(self):
+        self._write_layout()
+        self._shard_snapshots = self._broadcast("flush")
+
+    def wait_for_snapshot(self):
+        if self.shards:
+            self._shard_snapshots = self._broadcast("wait_for_snapshot")
+
+    def close(self, grace: float = 0.0):
+        """停止全部分片进程（每个分片等待进行中的请求完成）
+
+        grace 大于0时在后台等待宽限期后再停止：存储被新版本替换后，已取得旧存储引用的查询在宽限期内照常执行。
+        """
+        if grace > 0:
+            timer = threading.Timer(grace, self.close)
+            timer.name = "shard-close"
+            timer.daemon = True
+            timer.start()
+            return
+        with self._start_lock:
+            self._closed = True
+            shards, self.shards = self.shards, []
+        for shard in shards:
+            try:
+                shard.call("stop")
+            except (EOFError, OSError, RuntimeError):
+                pass
+            shard.conn.close()
+            if shard.process is not None:
+                try:
+                    shard.process.wait(Config.SHARD_START_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    shard.process.kill()
+
+def main():
+    """分片工作进程入口"""
+    parser = argparse.ArgumentParser(description="向量存储分片工作进程")
+    parser.add_argument("--shard", type=int, required=True, help="分片序号")
+    parser.add_argument("--address", required=True, help="主进程监听地址（主机:端口、Unix域套接字路径或命名管道名）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=f"[shard {args.shard}] %(levelname)s:%(name)s:%(message)s")
+    conn = Client(parse_address(args.address), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    conn.send(args.shard)
+    ShardWorker(args.shard).serve(conn)
+
+if __name__ == "__main__":
+    main()
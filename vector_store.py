@@ -5,66 +5,608 @@
 """
 
 import os
+import copy
+import time
+import bisect
+import threading
 import pickle
 import numpy as np
 import logging
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-from data_models import Document, SearchResult
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime
+from data_models import Document, SearchResult, TokenizedText
 from data_processor import DataProcessor
+from ann_index import IVFIndex
+from quantization import ScalarQuantizer
+from projection import EmbeddingProjection
+from lexical_index import BM25Index, TokenStore
+from paragraph_table import ParagraphTable
+from cache import EmbeddingCache, LRUCache
+from wal import WriteAheadLog
+from encoders import load_encoder
+from document_store import LazyDocumentMap
+from index_storage import (SnapshotWriter, StringTable, CachedStringTable, current_snapshot_dir, current_snapshot_name,
+                           load_array, load_json)
 from config import Config
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 进程内共享的向量模型（按模型名与编码后端缓存），首次使用时才导入 sentence_transformers/torch
+_models: Dict[Tuple[str, str], Tuple[object, str]] = {}
+_models_lock = threading.Lock()
+
+def load_embedding_model(model_name: str, backend: str = "torch") -> Tuple[object, str]:
+    """加载（或取已加载的）向量模型，返回 (编码器, 实际使用的后端)"""
+    with _models_lock:
+        entry = _models.get((model_name, backend))
+        if entry is None:
+            start_time = time.time()
+            entry = load_encoder(model_name, backend, check_parity=Config.ENCODER_PARITY_CHECK)
+            _models[(model_name, backend)] = entry
+            logger.info(f"向量模型加载完成: {model_name} ({entry[1]}), 耗时 {time.time() - start_time:.2f} 秒")
+        return entry
+
 class IntelligentVectorStore:
     """智能向量存储模块"""
 
     def __init__(self, model_name: str = Config.VECTOR_MODEL):
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        # 编码后端（torch / torch_int8 / onnx / onnx_int8），加载失败时回退为torch
+        self.encoder_backend = Config.VECTOR_MODEL_BACKEND
+        # 实际使用的编码后端是否已确定（加载模型后，或由 set_encoder_backend 指定）
+        self._backend_resolved = False
+        # 向量模型延迟加载，见 model 属性与 warmup()
+        self._model = None
         self.processor = DataProcessor()
+        # 文档ID -> 文档；Config.LAZY_DOCUMENTS 开启时加载快照后为 LazyDocumentMap，正文按需从快照读取
         self.documents: Dict[str, Document] = {}
-        self.paragraph_embeddings: List[np.ndarray] = []
-        self.paragraph_metadata: List[Dict] = []
+        # 段落列式元数据（文档序号、段落序号、词数、文本块偏移），行号与向量矩阵一致
+        self.paragraph_table = ParagraphTable()
+        self.storage_dir = Config.STORAGE_DIR
+        # 旧版单文件pickle格式，仅用于迁移加载
         self.storage_path = Config.STORAGE_PATH
 
-        # 文档质量评分
-        self.quality_scores: List[float] = []
+        # 归一化后的段落向量矩阵（预分配，按需扩容），前 _size 行有效；
+        # Config.EMBEDDING_STORAGE == "float16" 时以半精度保存，打分时分块转回float32
+        self._embeddings = np.zeros((0, 0), dtype=self._embedding_dtype())
+        # 文档质量评分，与向量矩阵逐行对应
+        self._quality = np.zeros(0, dtype=np.float32)
+        self._size = 0
+
+        # 墓碑标记：删除/替换文档时只将对应行置为False，由后台压缩物理清理
+        self._alive = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        # 存活行的总词数（BM25平均长度只统计存活行），删除时扣减
+        self._live_lexical_length = 0
+        # 文档ID -> 有效段落行号
+        self._doc_rows: Dict[str, List[int]] = {}
+        # 来源类型 -> 预计算行掩码，用于过滤检索
+        self._source_type_masks: Dict[str, np.ndarray] = {}
+        # 按来源路径排序的 (路径, 文档ID) 列表，路径前缀过滤时二分查找
+        self._path_index: List[Tuple[str, str]] = []
+        # _lock 只在替换状态引用或获取检索视图时短暂持有，打分在锁外进行（见 _read_view）；
+        # _write_lock 串行化写入与压缩，压缩在锁外构建新数组期间不阻塞检索
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+
+        # 预写日志：加载或保存快照后打开，文档修改逐条追加，超过阈值时后台生成快照
+        self.wal: Optional[WriteAheadLog] = None
+        # 当前快照已包含的日志段（序号小于该值的段）
+        self._wal_segment = 0
+        self._snapshot_thread: Optional[threading.Thread] = None
+        # 串行化快照写入；修改计数用于判断快照写入期间是否有新的修改
+        self._save_lock = threading.Lock()
+        self._version = 0
+        # 当前内容对应的快照目录名（快照版本），加载或保存快照后更新；尚未保存过时为None
+        self.snapshot_name: Optional[str] = None
+        # 共享只读索引（Config.SHARED_INDEX 开启时加载快照后为True）：全部数据引用快照文件的只读内存映射，
+        # 多个进程共享同一份物理内存，不接受修改
+        self.read_only = False
+        # 第一阶段候选生成方式，None 时取 Config.CANDIDATE_STAGE，见 prepare_candidate_stage()
+        self.candidate_stage: Optional[str] = None
+
+        # 近似最近邻索引（Config.SEARCH_BACKEND == "ivf" 或候选生成方式为 ann 时启用）
+        self.ann_index: Optional[IVFIndex] = None
+
+        # int8量化码（Config.EMBEDDING_STORAGE == "int8" 或候选生成方式为 quantized 时启用），与向量矩阵逐行对应
+        self.quantizer: Optional[ScalarQuantizer] = None
+        self._codes: Optional[np.ndarray] = None
+
+        # 降维投影（Config.PROJECTION 启用且段落数达到阈值时拟合），拟合后向量矩阵只保存投影后的向量，
+        # 查询向量在检索前做同样的投影
+        self.projection: Optional[EmbeddingProjection] = None
+
+        # BM25词法索引，行号与向量矩阵一致（Config.LEXICAL_INDEX 关闭时为None）
+        self.lexical_index: Optional[BM25Index] = self._new_lexical_index()
+        # 段落分词结果（Config.PERSIST_TOKENS 开启时保存），重载与重新评分时无需再次分词
+        self.token_store: Optional[TokenStore] = self._new_token_store()
+
+        # 段落向量持久化缓存，重建时只对新增或修改的段落调用模型
+        self.embedding_cache = EmbeddingCache(Config.EMBEDDING_CACHE_PATH, Config.EMBEDDING_CACHE_MAX_ENTRIES)
+        # 查询向量缓存：规范化查询文本 -> 归一化查询向量（模型原始维度，取出后再投影，投影变化不影响缓存）
+        self.query_cache = LRUCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL)
+
+    @property
+    def model(self):
+        """向量模型，首次访问时加载"""
+        if self._model is None:
+            self._model, self.encoder_backend = load_embedding_model(self.model_name, Config.VECTOR_MODEL_BACKEND)
+            self._backend_resolved = True
+        return self._model
+
+    def set_encoder_backend(self, backend: str):
+        """段落向量由其他进程编码时（分片工作进程），指定编码方实际使用的后端，本进程不加载模型"""
+        self.encoder_backend = backend
+        self._backend_resolved = True
+
+    @property
+    def model_key(self) -> str:
+        """向量缓存与WAL使用的模型标识：非torch后端的向量与全精度模型略有差异，单独缓存
+
+        按实际使用的后端区分（加载失败或一致性检查未通过时回退为torch），需先加载模型才能确定。
+        """
+        if not self._backend_resolved:
+            self.model
+        backend = self.encoder_backend
+        return self.model_name if backend == "torch" else f"{self.model_name}:{backend}"
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
+    def warmup(self):
+        """预先加载向量模型并完成一次编码，避免首个查询承担加载延迟"""
+        self.model.encode(["warmup"], convert_to_numpy=True, show_progress_bar=False)
+
+    @property
+    def vectors_path(self) -> str:
+        """旧版pickle格式量化模式下原始向量的旁路文件"""
+        return f"{self.storage_path}.vectors.npy"
+
+    @property
+    def paragraph_embeddings(self) -> np.ndarray:
+        """有效段落向量（已L2归一化）"""
+        return self._embeddings[:self._size]
+
+    @property
+    def quality_scores(self) -> np.ndarray:
+        """有效段落质量评分"""
+        return self._quality[:self._size]
+
+    @property
+    def paragraph_count(self) -> int:
+        """未删除的段落数"""
+        return self._size - self._deleted_count
+
+    def iter_paragraphs(self, doc_id: Optional[str] = None):
+        """遍历未删除的段落，产出 (行号, 元数据)"""
+        view = self._read_view()
+        if doc_id is not None:
+            rows = [int(row) for row in view._doc_rows.get(doc_id, [])]
+        else:
+            rows = np.flatnonzero(view._alive[:view._size]).tolist()
+        return iter([(row, view._paragraph_info(row)) for row in rows])
+
+    def _read_view(self) -> "IntelligentVectorStore":
+        """在锁内浅复制存储对象，得到当前索引状态（行数与各数组、索引对象的引用）的一致视图，之后在锁外检索
+
+        写入方只在视图行数之外追加行，或复制后整体替换（存活掩码、行号映射、压缩后的数组与索引等），
+        不原地修改视图可见的数据，因此视图在检索期间保持不变。视图只用于读取。
+        """
+        with self._lock:
+            return copy.copy(self)
+
+    def _paragraph_info(self, row: int) -> Dict:
+        """以字典形式返回一行段落元数据（含质量评分）"""
+        info = self.paragraph_table.row(row)
+        info["quality_score"] = round(float(self._quality[row]), 6)
+        return info
+
+    @staticmethod
+    def _embedding_dtype():
+        """向量矩阵的存储精度"""
+        return np.float16 if Config.EMBEDDING_STORAGE == "float16" else np.float32
+
+    def convert_embedding_storage(self):
+        """按当前 Config.EMBEDDING_STORAGE 转换向量矩阵精度（加载的快照精度与配置不一致时使用）"""
+        dtype = self._embedding_dtype()
+        with self._write_lock, self._lock:
+            if self._embeddings.dtype == dtype:
+                return
+            logger.info(f"转换向量存储精度: {self._embeddings.dtype} -> {np.dtype(dtype)}")
+            self._embeddings = np.asarray(self._embeddings, dtype=dtype)
+
+    def _score_embeddings(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """计算查询与段落向量的余弦相似度；半精度存储时分块转为float32后计算"""
+        embeddings = self.paragraph_embeddings if rows is None else self._embeddings[rows]
+        if embeddings.dtype == np.float32:
+            return embeddings @ query_embedding
+
+        scores = np.empty(embeddings.shape[0], dtype=np.float32)
+        block_rows = Config.SCORE_BLOCK_ROWS
+        for start in range(0, embeddings.shape[0], block_rows):
+            block = embeddings[start:start + block_rows].astype(np.float32)
+            scores[start:start + block_rows] = block @ query_embedding
+        return scores
+
+    def _score_embeddings_batch(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """批量查询的全量相似度矩阵 (查询数 × 段落数)，半精度存储时分块转换"""
+        embeddings = self.paragraph_embeddings
+        if embeddings.dtype == np.float32:
+            return query_embeddings @ embeddings.T
+
+        scores = np.empty((query_embeddings.shape[0], embeddings.shape[0]), dtype=np.float32)
+        block_rows = Config.SCORE_BLOCK_ROWS
+        for start in range(0, embeddings.shape[0], block_rows):
+            block = embeddings[start:start + block_rows].astype(np.float32)
+            scores[:, start:start + block_rows] = query_embeddings @ block.T
+        return scores
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """L2归一化（支持单个向量或矩阵）"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def _ensure_capacity(self, extra: int, dim: int):
+        """确保矩阵容量足够，不足时按倍数扩容"""
+        required = self._size + extra
+        capacity = self._embeddings.shape[0]
+        if capacity >= required and self._embeddings.shape[1] == dim:
+            return
+
+        new_capacity = max(required, capacity * 2, Config.EMBEDDING_INITIAL_CAPACITY)
+        embeddings = np.zeros((new_capacity, dim), dtype=self._embedding_dtype())
+        quality = np.zeros(new_capacity, dtype=np.float32)
+        alive = np.zeros(new_capacity, dtype=bool)
+        if self._size:
+            embeddings[:self._size] = self._embeddings[:self._size]
+            quality[:self._size] = self._quality[:self._size]
+            alive[:self._size] = self._alive[:self._size]
+        self._embeddings = embeddings
+        self._quality = quality
+        self._alive = alive
+
+    def _append_rows(self, embeddings: np.ndarray, quality_scores: List[float]):
+        """追加段落向量与质量评分（已拟合投影时先投影到低维空间）"""
+        embeddings = np.atleast_2d(embeddings)
+        count = embeddings.shape[0]
+        if count == 0:
+            return
+        if self.projection is not None:
+            embeddings = self.projection.project(embeddings)
+        embeddings = self._normalize(embeddings)
+
+        # 检索视图只读取前 _size 行，新行写入视图范围之外（或扩容后的新数组）
+        self._ensure_capacity(count, embeddings.shape[1])
+        self._embeddings[self._size:self._size + count] = embeddings
+        self._quality[self._size:self._size + count] = quality_scores
+        self._alive[self._size:self._size + count] = True
+        self._size += count
 
     def add_document(self, document: Document):
         """添加文档到向量存储"""
         if document is None:
             return
 
-        # 存储文档
-        self.documents[document.id] = document
+        self.add_documents([document])
+
+    def add_documents(self, documents: List[Document], batch_size: int = Config.EMBEDDING_BATCH_SIZE) -> Dict:
+        """批量添加文档：跨文档收集段落，按批次编码后写入向量存储
+
+        已存在的同ID文档会被替换（旧段落标记为删除），编码在锁外完成，
+        只有最后写入阶段阻塞检索。
+        """
+        self._check_writable()
+        start_time = time.time()
+
+        # 同一批次内同ID文档以最后一个为准
+        unique_documents = {}
+        for document in documents:
+            if document is not None:
+                unique_documents[document.id] = document
+        documents = list(unique_documents.values())
+
+        # 收集所有待编码段落
+        pending = []
+        for document in documents:
+            for idx, paragraph in enumerate(document.paragraphs):
+                if paragraph.strip():
+                    pending.append((document, idx, paragraph))
+
+        # 批量生成段落向量
+        encode_start = time.time()
+        cache_hits = self.embedding_cache.hits
+        embeddings = self._encode_paragraphs([paragraph for _, _, paragraph in pending], batch_size)
+        cache_hits = self.embedding_cache.hits - cache_hits
+        encode_seconds = time.time() - encode_start
+
+        # 每个段落只分词一次，质量评分、词数与词法索引共用
+        quality_scores = []
+        new_tokens = []
+        for document, idx, paragraph in pending:
+            tokenized = self._paragraph_tokens(document, idx, paragraph)
+            new_tokens.append(tokenized.tokens)
+            quality_scores.append(self._calculate_paragraph_quality(tokenized))
+
+        with self._write_lock:
+            # 先在暂存视图上完成耗时、需要分配内存或可能出错的步骤（追加向量、投影拟合、量化器与ANN训练），
+            # 期间只持有 _write_lock，检索照常进行；这些步骤只追加视图行数之外的行或复制后替换，
+            # 全部成功后再在锁内替换并登记段落，出错时存储保持不变
+            staged = self._read_view()
+            # 替换已存在的文档
+            replaced_ids = [document.id for document in documents if document.id in self.documents]
+            replaced_paragraphs = staged._tombstone_documents(replaced_ids)
+            staged._remove_document_paths(replaced_ids)
+            staged._add_document_paths(documents)
+            start_row = staged._size
+            staged._append_rows(embeddings, quality_scores)
+            staged._update_source_type_masks(start_row,
+                                             [self._source_type(document.metadata) for document, _, _ in pending])
+            if staged.lexical_index is not None:
+                staged._live_lexical_length += sum(len(tokens) for tokens in new_tokens)
+            # 首次拟合投影时全部向量变为低维，量化码与ANN索引需从头构建
+            index_start = 0 if staged._update_projection() else start_row
+            staged._update_quantized_codes(index_start)
+            staged._update_ann_index(index_start)
+
+            with self._lock:
+                for name in ("_embeddings", "_quality", "_alive", "_size", "_deleted_count", "_live_lexical_length",
+                             "_doc_rows", "_path_index", "_source_type_masks", "projection", "quantizer", "_codes",
+                             "ann_index"):
+                    setattr(self, name, getattr(staged, name))
+                for document in documents:
+                    self.documents[document.id] = document
+                    logger.info(f"添加文档: {document.id}, 段落数: {len(document.paragraphs)}")
+                doc_positions = {}
+                for (document, idx, paragraph), tokens in zip(pending, new_tokens):
+                    doc_position = doc_positions.get(document.id)
+                    if doc_position is None:
+                        doc_position = doc_positions[document.id] = self.paragraph_table.add_document(
+                            document.id, document.title, document)
+                    # 段落文本直接引用文档对象，不在段落表中另存一份
+                    row = self.paragraph_table.append_paragraph(doc_position, idx, len(tokens))
+                    self._doc_rows.setdefault(document.id, []).append(row)
+                for row, tokens in enumerate(new_tokens, start=start_row):
+                    if self.lexical_index is not None:
+                        self.lexical_index.add(row, tokens)
+                    if self.token_store is not None:
+                        self.token_store.add(row, tokens)
+                # 分词结果已写入词法索引与分词存储，不再随文档常驻
+                for document in documents:
+                    document.paragraph_tokens = None
+                self._version += 1
 
-        # 为每个段落生成向量和质量评分
-        for idx, paragraph in enumerate(document.paragraphs):
-            if paragraph.strip():
-                # 生成段落向量
-                embedding = self.model.encode(paragraph)
-                self.paragraph_embeddings.append(embedding)
+                # 在锁内写日志，保证日志顺序与修改顺序一致
+                if self.wal is not None:
+                    position = 0
+                    for document in documents:
+                        texts = [paragraph for paragraph in document.paragraphs if paragraph.strip()]
+                        self.wal.append_upsert(document, self.model_key, texts,
+                                               embeddings[position:position + len(texts)])
+                        position += len(texts)
 
-                # 计算段落质量评分
-                quality_score = self._calculate_paragraph_quality(paragraph)
-                self.quality_scores.append(quality_score)
+        self._maybe_schedule_compaction()
+        self._maybe_schedule_snapshot()
+
+        total_seconds = time.time() - start_time
+        stats = {
+            "documents": len(documents),
+            "paragraphs": len(pending),
+            "replaced_paragraphs": replaced_paragraphs,
+            "cache_hits": cache_hits,
+            "batch_size": batch_size,
+            "encode_seconds": round(encode_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "paragraphs_per_second": round(len(pending) / total_seconds, 2) if total_seconds > 0 else 0.0
+        }
+        if pending:
+            logger.info(f"批量编码完成: {stats['paragraphs']} 个段落, {stats['paragraphs_per_second']} 段落/秒")
+        return stats
+
+    def upsert_document(self, document: Document) -> Dict:
+        """新增或替换单个文档，只对该文档的段落编码"""
+        return self.add_documents([document])
+
+    def delete_document(self, doc_id: str) -> bool:
+        """删除文档，段落行标记为墓碑，达到阈值后后台压缩"""
+        self._check_writable()
+        with self._write_lock, self._lock:
+            if doc_id not in self.documents:
+                return False
+            deleted = self._tombstone_documents([doc_id])
+            self._remove_document_paths([doc_id])
+            del self.documents[doc_id]
+            self._version += 1
+            if self.wal is not None:
+                self.wal.append_delete(doc_id)
+
+        logger.info(f"删除文档: {doc_id}, 段落数: {deleted}")
+        self._maybe_schedule_compaction()
+        self._maybe_schedule_snapshot()
+        return True
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("共享只读索引不能修改，请在构建进程中修改知识库并发布新快照")
+
+    def _tombstone_documents(self, doc_ids: List[str]) -> int:
+        """将文档的全部段落行标记为已删除，返回行数（调用方持有锁）
+
+        检索视图可能仍在使用当前的存活掩码与行号映射，复制后修改再整体替换。
+        """
+        doc_rows = dict(self._doc_rows)
+        alive = None
+        deleted = 0
+        for doc_id in doc_ids:
+            rows = doc_rows.pop(doc_id, [])
+            if len(rows):
+                if alive is None:
+                    alive = self._alive.copy()
+                alive[rows] = False
+                deleted += len(rows)
+                if self.lexical_index is not None:
+                    self._live_lexical_length -= int(self.lexical_index.row_lengths(rows).sum())
+        if alive is not None:
+            self._alive = alive
+        self._deleted_count += deleted
+        self._doc_rows = doc_rows
+        return deleted
+
+    def _add_document_paths(self, documents: List[Document]):
+        """将文档的来源路径加入有序路径索引（调用方持有锁，复制后替换）"""
+        entries = [(self._document_path(document.metadata), document.id) for document in documents]
+        entries = [entry for entry in entries if entry[0]]
+        if entries:
+            self._path_index = sorted(self._path_index + entries)
+
+    def _remove_document_paths(self, doc_ids: List[str]):
+        """从有序路径索引中移除文档（在文档元数据被替换或删除前调用，调用方持有锁，复制后替换）"""
+        entries = [(self._document_path(self._document_metadata(doc_id)), doc_id) for doc_id in doc_ids]
+        entries = [entry for entry in entries if entry[0]]
+        if not entries:
+            return
+        index = list(self._path_index)
+        for entry in entries:
+            position = bisect.bisect_left(index, entry)
+            if position < len(index) and index[position] == entry:
+                del index[position]
+        self._path_index = index
+
+    def _rebuild_path_index(self):
+        """根据文档元数据重建有序路径索引"""
+        entries = [(self._document_path(self._document_metadata(doc_id)), doc_id) for doc_id in self.documents]
+        self._path_index = sorted(entry for entry in entries if entry[0])
+
+    def _maybe_schedule_compaction(self):
+        """墓碑比例超过阈值时启动后台压缩线程"""
+        if self._deleted_count == 0 or self._deleted_count < self._size * Config.COMPACTION_DELETED_RATIO:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
 
-                # 存储段落元数据
-                metadata = {
-                    "doc_id": document.id,
-                    "title": document.title,
-                    "paragraph_index": idx,
-                    "paragraph": paragraph,
-                    "quality_score": quality_score,
-                    "word_count": len(self.processor.segment_and_filter(paragraph))
-                }
-                self.paragraph_metadata.append(metadata)
+        self._compaction_thread = threading.Thread(target=self.compact, name="vector-store-compaction", daemon=True)
+        self._compaction_thread.start()
 
-        logger.info(f"添加文档: {document.id}, 段落数: {len(document.paragraphs)}")
+    def compact(self) -> int:
+        """物理删除墓碑行并重排行号，返回清理的行数
 
-    def _calculate_paragraph_quality(self, paragraph: str) -> float:
+        新的数组与索引在锁外由检索视图构建（期间写入等待 _write_lock，检索照常进行），
+        完成后在锁内一次性替换。
+        """
+        self._check_writable()
+        with self._write_lock:
+            staged = self._read_view()
+            if staged._deleted_count == 0:
+                return 0
+
+            removed = staged._deleted_count
+            keep = np.flatnonzero(staged._alive[:staged._size])
+            mapping = np.full(staged._size, -1, dtype=np.int64)
+            mapping[keep] = np.arange(len(keep))
+
+            capacity = max(len(keep), Config.EMBEDDING_INITIAL_CAPACITY)
+            embeddings = np.zeros((capacity, staged._embeddings.shape[1]), dtype=staged._embeddings.dtype)
+            embeddings[:len(keep)] = staged._embeddings[keep]
+            quality = np.zeros(capacity, dtype=np.float32)
+            quality[:len(keep)] = staged._quality[keep]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(keep)] = True
+
+            if staged._codes is not None:
+                codes = np.zeros((capacity, staged._codes.shape[1]), dtype=np.uint8)
+                codes[:len(keep)] = staged._codes[keep]
+                staged._codes = codes
+            if staged.ann_index is not None:
+                staged.ann_index = staged.ann_index.remapped(mapping)
+            if staged.lexical_index is not None:
+                staged.lexical_index = staged.lexical_index.remapped(mapping)
+            if staged.token_store is not None:
+                staged.token_store = staged.token_store.remapped(mapping)
+
+            staged._embeddings = embeddings
+            staged._quality = quality
+            staged._alive = alive
+            staged.paragraph_table = staged.paragraph_table.take(keep)
+            staged._size = len(keep)
+            staged._deleted_count = 0
+            staged._rebuild_doc_rows()
+            staged._rebuild_source_type_masks()
+
+            with self._lock:
+                for name in ("_embeddings", "_quality", "_alive", "_codes", "ann_index", "lexical_index",
+                             "token_store", "paragraph_table", "_size", "_deleted_count", "_doc_rows",
+                             "_source_type_masks"):
+                    setattr(self, name, getattr(staged, name))
+                self._version += 1
+
+        logger.info(f"向量存储压缩完成: 清理 {removed} 行, 剩余 {len(keep)} 行")
+        return removed
+
+    def _rebuild_doc_rows(self):
+        """根据段落元数据重建文档到行号的映射（跳过已删除行）"""
+        self._doc_rows = {}
+        doc_ids = self.paragraph_table.doc_ids
+        doc_index = self.paragraph_table.doc_index
+        alive_rows = np.flatnonzero(self._alive[:len(self.paragraph_table)])
+        if self.read_only:
+            # 只读存储不再追加行：各文档的行号为同一个有序数组的切片，不为每行创建Python整数
+            alive_rows = alive_rows.astype(np.int32)
+            order = np.argsort(doc_index[alive_rows], kind="stable")
+            sorted_rows = alive_rows[order]
+            positions, starts = np.unique(doc_index[sorted_rows], return_index=True)
+            ends = np.append(starts[1:], len(sorted_rows))
+            for position, start, end in zip(positions.tolist(), starts.tolist(), ends.tolist()):
+                self._doc_rows[doc_ids[position]] = sorted_rows[start:end]
+            return
+        for row in alive_rows.tolist():
+            self._doc_rows.setdefault(doc_ids[doc_index[row]], []).append(row)
+
+    def _encode_paragraphs(self, paragraphs: List[str], batch_size: int) -> np.ndarray:
+        """先查向量缓存，未命中的段落按长度排序后分批编码，结果按原顺序返回"""
+        if not paragraphs:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        cached = self.embedding_cache.get_many(self.model_key, paragraphs)
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+
+        batch_size = max(1, batch_size)
+        order = sorted(missing, key=lambda i: len(paragraphs[i]))
+        encoded = {}
+
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            batch_texts = [paragraphs[i] for i in batch_indices]
+            batch_embeddings = self.model.encode(
+                batch_texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            self.embedding_cache.put_many(self.model_key, batch_texts, batch_embeddings)
+            encoded.update(zip(batch_indices, batch_embeddings))
+
+        dim = len(next(iter(encoded.values()))) if encoded else len(cached[0])
+        embeddings = np.zeros((len(paragraphs), dim), dtype=np.float32)
+        for i, embedding in enumerate(cached):
+            embeddings[i] = embedding if embedding is not None else encoded[i]
+
+        return embeddings
+
+    def _paragraph_tokens(self, document: Document, idx: int, paragraph: str) -> TokenizedText:
+        """取文档构建时已生成的分词结果，没有时再分词"""
+        tokens = document.paragraph_tokens
+        if tokens is not None and idx < len(tokens) and tokens[idx].text == paragraph:
+            return tokens[idx]
+        return self.processor.tokenize(paragraph)
+
+    def _calculate_paragraph_quality(self, tokenized: TokenizedText) -> float:
         """计算段落质量评分"""
+        paragraph = tokenized.text
         score = 0.0
 
         # 长度评分
@@ -75,8 +617,8 @@ class IntelligentVectorStore:
             score += 0.2
 
         # 信息密度评分
-        words = self.processor.segment_and_filter(paragraph)
-        unique_words = len(set(words))
+        words = tokenized.tokens
+        unique_words = tokenized.unique_count
         if unique_words > 10:
             score += 0.3
 
@@ -96,89 +638,1204 @@ class IntelligentVectorStore:
 
         return min(score, 1.0)
 
-    def intelligent_search(self, query: str, top_k: int = 5, diversity_factor: float = 0.3) -> List[SearchResult]:
-        """智能搜索，结合相似度、质量和多样性"""
-        if not self.paragraph_embeddings:
+    def recalculate_quality_scores(self) -> int:
+        """按当前评分规则重新计算全部段落的质量评分（使用已保存的分词结果），返回更新的行数"""
+        self._check_writable()
+        with self._write_lock:
+            view = self._read_view()
+            if view._size == 0:
+                return 0
+            # 加载的质量评分可能是只读内存映射，且检索视图仍在读取，写入新数组后整体替换
+            quality = np.zeros(len(view._quality), dtype=np.float32)
+            for row in range(view._size):
+                tokenized = TokenizedText(text=view.paragraph_table.text(row), tokens=view._row_tokens(row))
+                quality[row] = self._calculate_paragraph_quality(tokenized)
+            with self._lock:
+                self._quality = quality
+                self._version += 1
+            return view._size
+
+    def _row_tokens(self, row: int) -> List[str]:
+        """取某一行的分词结果，未保存时重新分词"""
+        if self.token_store is not None and row < self.token_store.num_rows:
+            return self.token_store.get(row)
+        return self.processor.segment_and_filter(self.paragraph_table.text(row))
+
+    def intelligent_search(self, query: str, top_k: int = 5, diversity_factor: float = 0.3,
+                           fusion: Optional[str] = None, filters: Optional[Dict] = None) -> List[SearchResult]:
+        """智能搜索，结合相似度、质量和多样性
+
+        fusion: none(仅向量) / rrf(倒数排名融合) / weighted(加权融合)，默认取 Config.HYBRID_FUSION
+        filters: 限定检索范围，支持 doc_ids / source_type / path_prefix，多个条件取交集
+        """
+        if self.paragraph_count == 0:
             return []
 
-        # 对查询进行向量化
-        query_embedding = self.model.encode(query)
+        fusion = fusion or Config.HYBRID_FUSION
 
-        # 计算相似度
-        similarities = []
-        for i, para_embedding in enumerate(self.paragraph_embeddings):
-            similarity = np.dot(query_embedding, para_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(para_embedding)
-            )
-            similarities.append(similarity)
+        # 对查询进行向量化与分词
+        query_embedding = self._encode_query(query)
+        query_tokens = self._query_tokens(query, fusion)
+
+        # 在检索视图上打分，不持有锁，并发查询互不阻塞
+        view = self._read_view()
+        filter_rows = view._filter_rows(filters)
+        if filter_rows is not None and len(filter_rows) == 0:
+            return []
+        return view._search_embedding(view._project_queries(query_embedding), query_tokens, top_k, fusion,
+                                      filter_rows=filter_rows)
+
+    def intelligent_search_batch(self, queries: List[str], top_k: int = 5, fusion: Optional[str] = None,
+                                 filters: Optional[Dict] = None) -> List[List[SearchResult]]:
+        """批量智能搜索：一次模型调用编码全部查询，全量检索时用矩阵-矩阵乘积打分
+
+        每个查询的质量加权与多样化规则与 intelligent_search 相同。
+        """
+        if not queries:
+            return []
+        if self.paragraph_count == 0:
+            return [[] for _ in queries]
+
+        fusion = fusion or Config.HYBRID_FUSION
+        query_embeddings = self._encode_queries(queries)
+        query_tokens = [self._query_tokens(query, fusion) for query in queries]
+        return self._search_encoded(query_embeddings, query_tokens, top_k, fusion, filters)
+
+    def search_encoded(self, query_embeddings: np.ndarray, query_tokens: List[Optional[List[str]]], top_k: int = 5,
+                       fusion: Optional[str] = None, filters: Optional[Dict] = None) -> List[List[SearchResult]]:
+        """对调用方已编码的查询批量检索（分片进程使用主进程统一编码的查询向量）
+
+        query_embeddings 为模型原始维度的归一化查询向量，拟合了降维投影时在此投影；
+        query_tokens 为各查询的分词结果（不需要词法检索时为None）。
+        """
+        if len(query_embeddings) == 0:
+            return []
+        if self.paragraph_count == 0:
+            return [[] for _ in query_embeddings]
+
+        fusion = fusion or Config.HYBRID_FUSION
+        if self.lexical_index is None:
+            query_tokens = [None] * len(query_embeddings)
+        return self._search_encoded(np.asarray(query_embeddings, dtype=np.float32), query_tokens, top_k, fusion,
+                                    filters)
+
+    def _search_encoded(self, query_embeddings: np.ndarray, query_tokens: List[Optional[List[str]]], top_k: int,
+                        fusion: str, filters: Optional[Dict]) -> List[List[SearchResult]]:
+        """批量检索已编码的查询（模型原始维度，在检索视图上投影后打分）"""
+        view = self._read_view()
+        query_embeddings = view._project_queries(query_embeddings)
+        results = []
+        filter_rows = view._filter_rows(filters)
+        if filter_rows is not None and len(filter_rows) == 0:
+            return [[] for _ in query_embeddings]
+
+        if filter_rows is not None or view._candidate_stage() is not None:
+            # 候选集因查询而异或只需对过滤后的行打分，逐个检索（编码已批量完成）
+            for query_embedding, tokens in zip(query_embeddings, query_tokens):
+                results.append(view._search_embedding(
+                    query_embedding, tokens, top_k, fusion, filter_rows=filter_rows
+                ))
+            return results
+
+        # 按分数矩阵内存上限分块：每块一次 (b×d)·(d×N) 乘积
+        chunk_size = max(1, Config.BATCH_SEARCH_MAX_SCORES // max(view._size, 1))
+        for start in range(0, len(query_embeddings), chunk_size):
+            block = query_embeddings[start:start + chunk_size]
+            block_similarities = view._score_embeddings_batch(block)
+            for offset, similarities in enumerate(block_similarities):
+                results.append(view._search_embedding(
+                    block[offset], query_tokens[start + offset], top_k, fusion, similarities
+                ))
+        return results
+
+    def _filter_rows(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """将过滤条件解析为有序的有效行号（在检索视图上调用）；无过滤条件时返回None"""
+        if not filters:
+            return None
+
+        # 文档与路径条件直接由各文档的有效行号拼接得到，只有来源类型条件使用全量掩码
+        rows = None
+        doc_ids = filters.get("doc_ids")
+        if doc_ids:
+            rows = self._document_rows([doc_ids] if isinstance(doc_ids, str) else doc_ids)
+
+        path_prefix = filters.get("path_prefix")
+        if path_prefix:
+            path_rows = self._document_rows(self._documents_under(path_prefix))
+            rows = path_rows if rows is None else np.intersect1d(rows, path_rows, assume_unique=True)
+
+        source_type = filters.get("source_type")
+        if source_type:
+            values = [source_type] if isinstance(source_type, str) else source_type
+            masks = [self._source_type_masks[value] for value in values if value in self._source_type_masks]
+            if rows is None:
+                type_mask = np.zeros(self._size, dtype=bool)
+                for mask in masks:
+                    type_mask |= mask[:self._size]
+                return np.flatnonzero(type_mask & self._alive[:self._size])
+            keep = np.zeros(len(rows), dtype=bool)
+            for mask in masks:
+                keep |= mask[rows]
+            rows = rows[keep]
+
+        if rows is None:
+            return np.flatnonzero(self._alive[:self._size])
+        return rows
+
+    def _document_rows(self, doc_ids: List[str]) -> np.ndarray:
+        """文档的有效段落行号（有序、去重）"""
+        parts = [np.asarray(self._doc_rows[doc_id], dtype=np.int64) for doc_id in doc_ids if doc_id in self._doc_rows]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
+
+    def _documents_under(self, path_prefix: str) -> List[str]:
+        """来源路径以 path_prefix 开头的文档ID（在有序路径索引上二分定位，只遍历命中的区间）"""
+        prefix = path_prefix.replace("\\", "/")
+        index = self._path_index
+        doc_ids = []
+        for position in range(bisect.bisect_left(index, (prefix,)), len(index)):
+            path, doc_id = index[position]
+            if not path.startswith(prefix):
+                break
+            doc_ids.append(doc_id)
+        return doc_ids
+
+    def _document_metadata(self, doc_id: str) -> Optional[Dict]:
+        """文档元数据（按需加载模式下不读取正文）"""
+        if isinstance(self.documents, LazyDocumentMap):
+            return self.documents.metadata(doc_id)
+        document = self.documents.get(doc_id)
+        return document.metadata if document is not None else None
+
+    @staticmethod
+    def _document_path(metadata: Optional[Dict]) -> str:
+        """文档来源路径（文本文件为file_path，OCR图片为source_path）"""
+        if metadata is None:
+            return ""
+        path = metadata.get("file_path") or metadata.get("source_path") or ""
+        return path.replace("\\", "/")
+
+    @staticmethod
+    def _source_type(metadata: Optional[Dict]) -> str:
+        """文档来源类型，未标注的视为普通文本"""
+        if metadata is None:
+            return ""
+        return metadata.get("source_type", "text")
+
+    def _update_source_type_masks(self, start_row: int, source_types: List[str]):
+        """维护每种来源类型的预计算行掩码（容量与向量矩阵一致）；新行只写入检索视图行数之外，映射复制后替换"""
+        capacity = self._alive.shape[0]
+        masks = dict(self._source_type_masks)
+        for value in set(source_types):
+            masks.setdefault(value, np.zeros(capacity, dtype=bool))
+        for value, mask in masks.items():
+            if mask.shape[0] < capacity:
+                grown = np.zeros(capacity, dtype=bool)
+                grown[:mask.shape[0]] = mask
+                masks[value] = grown
+        for row, value in enumerate(source_types, start=start_row):
+            masks[value][row] = True
+        self._source_type_masks = masks
+
+    def _rebuild_source_type_masks(self):
+        """根据文档元数据重建来源类型掩码"""
+        self._source_type_masks = {}
+        source_types = [""] * self._size
+        for doc_id, rows in self._doc_rows.items():
+            source_type = self._source_type(self._document_metadata(doc_id))
+            for row in rows:
+                source_types[row] = source_type
+        self._update_source_type_masks(0, source_types)
+
+    def _query_tokens(self, query: str, fusion: str) -> Optional[List[str]]:
+        """融合检索或词法候选阶段需要时对查询分词"""
+        if self.lexical_index is None or (fusion == "none" and self._stage_setting() != "lexical"):
+            return None
+        return self.processor.segment_and_filter(query)
+
+    def _search_embedding(self, query_embedding: np.ndarray, query_tokens: Optional[List[str]], top_k: int,
+                          fusion: str, similarities: Optional[np.ndarray] = None,
+                          filter_rows: Optional[np.ndarray] = None) -> List[SearchResult]:
+        """对已编码的查询执行检索（在检索视图上调用）
+
+        similarities 为预先算好的全量相似度；filter_rows 为过滤条件命中的行号，只对这些行打分。
+        """
+        # BM25打分（融合检索与词法候选阶段共用）
+        bm25_scores = (self.lexical_index.score(query_tokens, self._size, self._alive, self._live_lexical_length)
+                       if query_tokens else None)
+        if bm25_scores is not None and filter_rows is not None:
+            filtered_bm25 = np.zeros_like(bm25_scores)
+            filtered_bm25[filter_rows] = bm25_scores[filter_rows]
+            bm25_scores = filtered_bm25
+
+        # 第一阶段：生成候选行，之后只对候选行精确打分
+        rows = None if similarities is not None else self._candidate_rows(query_embedding, bm25_scores, filter_rows)
+
+        # 融合检索；候选集由近似阶段产生时补充词法命中的行
+        if fusion == "none":
+            bm25_scores = None
+        if bm25_scores is not None and rows is not None:
+            rows = np.union1d(rows, self._top_rows(bm25_scores, Config.RERANK_CANDIDATES))
+
+        # 计算相似度（向量已归一化，矩阵-向量乘积即为余弦相似度）
+        if rows is None:
+            if similarities is None:
+                similarities = self._score_embeddings(query_embedding)
+            quality_scores = self.quality_scores
+            alive = self._alive[:self._size]
+        else:
+            similarities = self._score_embeddings(query_embedding, rows)
+            quality_scores = self._quality[rows]
+            alive = self._alive[rows]
+
+        relevance = similarities
+        passed = similarities > Config.SIMILARITY_THRESHOLD
+        extra = {}
+        if bm25_scores is not None:
+            bm25 = bm25_scores if rows is None else bm25_scores[rows]
+            relevance = self._fuse_scores(similarities, bm25, fusion, alive)
+            passed |= bm25 > 0
+            if fusion == "rrf":
+                passed &= relevance > 0
+            extra = {"bm25_score": bm25, "fused_score": relevance}
+
+        # 智能重排序：综合评分 = 相关度 × 权重 + 质量评分 × 权重
+        combined_scores = relevance * 0.7 + quality_scores * 0.3
+        keep = np.flatnonzero(passed & alive)
+        rows = keep if rows is None else rows[keep]
+        extra = {name: values[keep] for name, values in extra.items()}
+
+        return self._select_diverse(rows, similarities[keep], combined_scores[keep], top_k, extra)
+
+    def _candidate_stage(self) -> Optional[str]:
+        """当前生效的候选生成方式，None 表示全量精确打分
+
+        指定的阶段所需索引尚未建立（如段落数低于 ANN_MIN_PARAGRAPHS）或段落数不超过候选数时退回精确打分。
+        """
+        stage = self._stage_setting()
+        if stage == "auto":
+            return stage if self._ann_active() or self._quantization_active() else None
+        if stage == "exact" or self.paragraph_count <= Config.RERANK_CANDIDATES:
+            return None
+        if stage == "ann":
+            return stage if self._ann_active() else None
+        if stage == "quantized":
+            return stage if self._quantization_active() else None
+        if stage == "lexical":
+            return stage if self.lexical_index is not None else None
+        return None
 
-        # 智能重排序
-        scored_results = []
-        for i, similarity in enumerate(similarities):
-            if similarity > Config.SIMILARITY_THRESHOLD:
-                # 综合评分 = 相似度 × 权重 + 质量评分 × 权重
-                combined_score = similarity * 0.7 + self.quality_scores[i] * 0.3
-                scored_results.append((i, similarity, combined_score))
+    def _candidate_rows(self, query_embedding: np.ndarray, bm25_scores: Optional[np.ndarray],
+                        filter_rows: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """第一阶段候选生成，返回需要精确打分的行号；None 表示全部行（在检索视图上调用）"""
+        if filter_rows is not None and len(filter_rows) <= Config.FILTER_EXACT_MAX_ROWS:
+            # 过滤后行数较少，直接精确打分
+            return filter_rows
 
-        # 排序并选择多样化结果
-        scored_results.sort(key=lambda x: x[2], reverse=True)
+        stage = self._candidate_stage()
+        if stage == "auto":
+            # ANN候选与int8码粗排按配置依次应用
+            rows = self._ann_candidates(query_embedding)
+            if filter_rows is not None:
+                rows = filter_rows if rows is None else np.intersect1d(rows, filter_rows, assume_unique=True)
+            return self._quantized_candidates(query_embedding, rows)
+        if stage == "ann":
+            rows = self._ann_candidates(query_embedding)
+            return rows if filter_rows is None else np.intersect1d(rows, filter_rows, assume_unique=True)
+        if stage == "quantized":
+            return self._quantized_candidates(query_embedding, filter_rows)
+        if stage == "lexical" and bm25_scores is not None:
+            # 词法命中的前 RERANK_CANDIDATES 行；查询没有任何词法命中时退回精确打分
+            rows = self._top_rows(bm25_scores, Config.RERANK_CANDIDATES)
+            if len(rows):
+                return np.sort(rows)
+        return filter_rows
 
-        # 多样化选择
+    @staticmethod
+    def _top_rows(scores: np.ndarray, limit: int) -> np.ndarray:
+        """返回分数为正的前 limit 个位置"""
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > limit:
+            positive = positive[np.argpartition(-scores[positive], limit - 1)[:limit]]
+        return positive
+
+    def _fuse_scores(self, similarities: np.ndarray, bm25: np.ndarray, fusion: str,
+                     alive: Optional[np.ndarray] = None) -> np.ndarray:
+        """融合向量相似度与BM25分数，结果归一化到[0, 1]附近；alive 为各位置的存活掩码，已删除的行不占排名"""
+        if fusion == "weighted":
+            max_bm25 = bm25.max() if len(bm25) else 0.0
+            normalized = bm25 / max_bm25 if max_bm25 > 0 else bm25
+            weight = Config.HYBRID_LEXICAL_WEIGHT
+            return (1 - weight) * similarities + weight * normalized
+
+        # RRF：两路各取前 FUSION_DEPTH 名累加 1/(k + 排名)
+        k = Config.RRF_K
+        fused = np.zeros(len(similarities), dtype=np.float32)
+        vector_positions = np.arange(len(similarities)) if alive is None else np.flatnonzero(alive)
+        for scores, positions in ((similarities, vector_positions), (bm25, np.flatnonzero(bm25 > 0))):
+            if len(positions) > Config.FUSION_DEPTH:
+                positions = positions[np.argpartition(-scores[positions], Config.FUSION_DEPTH - 1)[:Config.FUSION_DEPTH]]
+            ranked = positions[np.argsort(-scores[positions], kind="stable")]
+            fused[ranked] += 1.0 / (k + np.arange(1, len(ranked) + 1))
+        return fused * (k + 1) / 2
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """规范化查询文本：去除首尾空白并合并连续空白（不改变大小写，避免影响区分大小写的模型）"""
+        return " ".join(query.split())
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        """查询向量化（模型原始维度，检索时在视图上投影），优先使用LRU缓存"""
+        key = self._normalize_query(query)
+        query_embedding = self.query_cache.get(key)
+        if query_embedding is None:
+            query_embedding = self._normalize(self.model.encode(key))
+            query_embedding.flags.writeable = False
+            self.query_cache.put(key, query_embedding)
+        return query_embedding
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """批量查询向量化：缓存未命中的查询去重后一次性编码"""
+        keys = [self._normalize_query(query) for query in queries]
+        cached = [self.query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, cached) if embedding is None))
+
+        encoded = {}
+        if missing:
+            embeddings = self._normalize(self.model.encode(
+                missing,
+                batch_size=Config.EMBEDDING_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            ))
+            for key, embedding in zip(missing, embeddings):
+                embedding = embedding.copy()
+                embedding.flags.writeable = False
+                self.query_cache.put(key, embedding)
+                encoded[key] = embedding
+
+        return np.stack([
+            embedding if embedding is not None else encoded[key]
+            for key, embedding in zip(keys, cached)
+        ])
+
+    def _project_queries(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """将查询向量投影到与段落向量相同的空间（未拟合投影时原样返回）"""
+        projection = self.projection
+        if projection is None:
+            return query_embeddings
+        return self._normalize(projection.project(query_embeddings))
+
+    def _update_projection(self) -> bool:
+        """段落数首次达到阈值时拟合降维投影并转换已有向量（写入新矩阵），返回是否发生转换
+
+        在写入暂存视图上调用（调用方持有 _write_lock），检索期间照常使用原矩阵。
+        """
+        if (Config.PROJECTION == "none" or self.projection is not None
+                or self._size < Config.PROJECTION_MIN_PARAGRAPHS):
+            return False
+        if Config.PROJECTION_DIM >= self._embeddings.shape[1]:
+            return False
+
+        alive_rows = np.flatnonzero(self._alive[:self._size])
+        if len(alive_rows) > Config.PROJECTION_TRAIN_ROWS:
+            alive_rows = np.sort(np.random.default_rng(0).choice(alive_rows, Config.PROJECTION_TRAIN_ROWS, replace=False))
+        projection = EmbeddingProjection(Config.PROJECTION_DIM, mode=Config.PROJECTION)
+        projection.train(self._embeddings[alive_rows])
+
+        # 分块投影，避免整体转换为float32的临时内存
+        embeddings = np.zeros((self._embeddings.shape[0], projection.dim), dtype=self._embedding_dtype())
+        block_rows = Config.SCORE_BLOCK_ROWS
+        for start in range(0, self._size, block_rows):
+            end = min(start + block_rows, self._size)
+            embeddings[start:end] = self._normalize(projection.project(self._embeddings[start:end]))
+
+        logger.info(f"向量降维: {self._embeddings.shape[1]} -> {projection.dim} 维 ({projection.mode}), "
+                    f"保留方差 {projection.explained_variance_ratio:.2%}")
+        self._embeddings = embeddings
+        self.projection = projection
+        self.quantizer = None
+        self._codes = None
+        self.ann_index = None
+        return True
+
+    def _stage_setting(self) -> str:
+        """配置的第一阶段候选生成方式（本存储单独指定时优先）"""
+        return self.candidate_stage or Config.CANDIDATE_STAGE
+
+    def _ann_enabled(self) -> bool:
+        """是否维护ANN索引"""
+        return Config.SEARCH_BACKEND == "ivf" or self._stage_setting() == "ann"
+
+    def _quantization_enabled(self) -> bool:
+        """是否维护int8量化码"""
+        return Config.EMBEDDING_STORAGE == "int8" or self._stage_setting() == "quantized"
+
+    def prepare_candidate_stage(self, stage: Optional[str]) -> Optional[str]:
+        """指定本存储的第一阶段候选生成方式（None 恢复为 Config.CANDIDATE_STAGE，不修改全局配置），
+        按需建立该方式所需的量化码与ANN索引，返回实际生效的方式（None 表示全量精确打分）
+
+        索引在写入视图上构建（只持有 _write_lock，检索照常进行），完成后在锁内替换；
+        共享只读索引不在本进程构建，快照中没有所需索引时退回精确打分。
+        """
+        with self._write_lock:
+            staged = self._read_view()
+            staged.candidate_stage = stage
+            if not self.read_only:
+                if staged._quantization_enabled() and staged._codes is None:
+                    staged._update_quantized_codes(0)
+                if staged._ann_enabled() and staged.ann_index is None:
+                    staged.build_ann_index()
+            with self._lock:
+                for name in ("candidate_stage", "quantizer", "_codes", "ann_index"):
+                    setattr(self, name, getattr(staged, name))
+        return self._candidate_stage()
+
+    def _ann_active(self) -> bool:
+        return (self._ann_enabled() and self.ann_index is not None
+                and self.ann_index.is_trained and self._size >= Config.ANN_MIN_PARAGRAPHS)
+
+    def _quantization_active(self) -> bool:
+        return self._quantization_enabled() and self._codes is not None
+
+    def _ann_candidates(self, query_embedding: np.ndarray):
+        """使用ANN索引生成候选行号；返回None表示走精确全量检索"""
+        if not self._ann_active():
+            return None
+        rows = self.ann_index.search_candidates(query_embedding, Config.IVF_NPROBE)
+        # 倒排列表可能已追加检索视图之后的行
+        return rows[:np.searchsorted(rows, self._size)]
+
+    def build_ann_index(self):
+        """在当前全部段落向量上（重新）训练并填充ANN索引"""
+        if not self._ann_enabled() or self._size < Config.ANN_MIN_PARAGRAPHS:
+            self.ann_index = None
+            return
+
+        self.ann_index = IVFIndex(nlist=Config.IVF_NLIST, nprobe=Config.IVF_NPROBE)
+        self.ann_index.train(self.paragraph_embeddings)
+        self.ann_index.add(self.paragraph_embeddings, 0)
+
+    def _update_ann_index(self, start_row: int):
+        """新增段落后维护ANN索引：首次达到阈值时训练，之后增量分配到已有聚类"""
+        if not self._ann_enabled():
+            return
+        if self.ann_index is None or not self.ann_index.is_trained:
+            self.build_ann_index()
+        else:
+            # 复制后追加（共享聚类中心），原索引不变
+            ann_index = copy.copy(self.ann_index)
+            ann_index.add(self._embeddings[start_row:self._size], start_row)
+            self.ann_index = ann_index
+
+    def _update_quantized_codes(self, start_row: int):
+        """维护int8量化码：首次使用或数据量翻倍时在全部向量上（重新）训练量化器"""
+        if not self._quantization_enabled() or self._size == 0:
+            return
+        if self.quantizer is None or self._size >= 2 * self.quantizer.trained_rows:
+            self.quantizer = ScalarQuantizer()
+            self.quantizer.train(self.paragraph_embeddings)
+            start_row = 0
+        elif start_row >= self._size:
+            return
+
+        capacity = self._embeddings.shape[0]
+        # 重新训练后全部量化码都会变化，写入新数组，检索视图仍使用旧的量化器与量化码；
+        # 快照加载的量化码是只读内存映射，追加时同样复制到新数组
+        if (self._codes is None or self._codes.shape[0] < self._size or start_row == 0
+                or not self._codes.flags.writeable):
+            codes = np.zeros((capacity, self._embeddings.shape[1]), dtype=np.uint8)
+            if self._codes is not None and start_row:
+                codes[:start_row] = self._codes[:start_row]
+            self._codes = codes
+        self._codes[start_row:self._size] = self.quantizer.encode(self._embeddings[start_row:self._size])
+
+    def _quantized_candidates(self, query_embedding: np.ndarray, rows: Optional[np.ndarray]):
+        """在int8码上粗排，返回需用原始向量精排的行号；未启用量化时原样返回rows"""
+        if not self._quantization_active():
+            return rows
+
+        if rows is None:
+            codes = self._codes[:self._size]
+            quality_scores = self.quality_scores
+        else:
+            codes = self._codes[rows]
+            quality_scores = self._quality[rows]
+
+        approx_scores = self.quantizer.score(codes, query_embedding) * 0.7 + quality_scores * 0.3
+        # 已删除的行不占用精排名额
+        approx_scores[~(self._alive[:self._size] if rows is None else self._alive[rows])] = -np.inf
+        limit = Config.RERANK_CANDIDATES
+        if len(approx_scores) > limit:
+            top = np.sort(np.argpartition(-approx_scores, limit - 1)[:limit])
+        else:
+            top = np.arange(len(approx_scores))
+        return top if rows is None else rows[top]
+
+    def get_index_stats(self) -> Dict:
+        """索引与内存占用统计"""
+        mapped = isinstance(self._embeddings, np.memmap)
+        return {
+            "paragraphs": self._size,
+            "snapshot": self.snapshot_name,
+            "search_backend": Config.SEARCH_BACKEND,
+            "candidate_stage": self._candidate_stage() or "exact",
+            "ann_index": self.ann_index is not None and self.ann_index.is_trained,
+            "encoder_backend": self.encoder_backend,
+            "embedding_storage": Config.EMBEDDING_STORAGE,
+            "embedding_dtype": str(self._embeddings.dtype),
+            "embedding_dim": int(self._embeddings.shape[1]),
+            "projection": None if self.projection is None else {
+                "mode": self.projection.mode,
+                "dim": self.projection.dim,
+                "explained_variance_ratio": round(self.projection.explained_variance_ratio, 4)
+            },
+            "embeddings_memory_mapped": mapped,
+            "lazy_documents": isinstance(self.documents, LazyDocumentMap),
+            "shared_index": self.read_only,
+            "resident_bytes": {
+                "embeddings": 0 if mapped else int(self._embeddings.nbytes),
+                "codes": int(self._codes.nbytes) if self._codes is not None else 0,
+                "quality_scores": int(self._quality.nbytes),
+                "paragraph_table": self.paragraph_table.nbytes
+            }
+        }
+
+    def _select_diverse(self, rows: np.ndarray, similarities: np.ndarray, combined_scores: np.ndarray,
+                        top_k: int, extra: Optional[Dict[str, np.ndarray]] = None) -> List[SearchResult]:
+        """按综合评分选出多样化结果（rows与各组分数一一对应，extra中的分数写入结果元数据）
+
+        只对前 pool 个候选做 argpartition + 排序，候选不足时再扩大范围。
+        """
+        if len(rows) == 0 or top_k <= 0:
+            return []
+
+        if Config.DIVERSITY_MODE == "mmr":
+            return self._select_mmr(rows, similarities, combined_scores, top_k, extra)
+
+        pool = min(len(rows), max(top_k * 4, 32))
+
+        while True:
+            if pool < len(rows):
+                top = np.argpartition(-combined_scores, pool - 1)[:pool]
+            else:
+                top = np.arange(len(rows))
+            # 稳定排序，分数相同时保持段落原有顺序
+            top = top[np.lexsort((rows[top], -combined_scores[top]))]
+
+            selected_results = self._diversify(top, rows, similarities, combined_scores, top_k, extra)
+            if len(selected_results) >= top_k or pool >= len(rows):
+                return selected_results
+            pool = min(len(rows), pool * 4)
+
+    def _select_mmr(self, rows: np.ndarray, similarities: np.ndarray, combined_scores: np.ndarray,
+                    top_k: int, extra: Optional[Dict[str, np.ndarray]] = None) -> List[SearchResult]:
+        """最大边际相关性（MMR）选择
+
+        只在综合评分前 M 个候选上计算一次两两相似度矩阵，之后每轮选择都是
+        O(M) 的向量运算：score = λ·综合评分 - (1-λ)·与已选结果的最大相似度。
+        同一文档的结果数量上限仍由 Config.MAX_RESULTS_PER_DOC 控制。
+        """
+        pool = min(len(rows), max(Config.MMR_CANDIDATES, top_k))
+
+        while True:
+            if pool < len(rows):
+                top = np.argpartition(-combined_scores, pool - 1)[:pool]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.lexsort((rows[top], -combined_scores[top]))]
+
+            candidate_embeddings = np.asarray(self._embeddings[rows[top]], dtype=np.float32)
+            pairwise = candidate_embeddings @ candidate_embeddings.T
+            relevance = combined_scores[top]
+            _, doc_codes = np.unique([self.paragraph_table.doc_id(row) for row in rows[top]],
+                                     return_inverse=True)
+            order = [top[pos] for pos in self.mmr_order(relevance, pairwise, doc_codes, top_k)]
+
+            if len(order) >= top_k or pool >= len(rows):
+                return [self._make_result(pos, rows, similarities, combined_scores, extra) for pos in order]
+            pool = min(len(rows), pool * 4)
+
+    @staticmethod
+    def mmr_order(relevance: np.ndarray, pairwise: np.ndarray, doc_codes: np.ndarray, top_k: int) -> List[int]:
+        """在候选上按MMR依次选择，返回选中候选的位置（分片合并时也使用同一规则）
+
+        relevance 为候选的综合评分，pairwise 为候选两两相似度，doc_codes 为候选所属文档的编号。
+        """
+        # 首轮尚无已选结果，不计冗余惩罚
+        max_similarity = np.zeros(len(relevance), dtype=np.float32)
+        available = np.ones(len(relevance), dtype=bool)
+        doc_counts: Dict[int, int] = {}
+        order = []
+        while len(order) < top_k and available.any():
+            mmr_scores = Config.MMR_LAMBDA * relevance - (1 - Config.MMR_LAMBDA) * max_similarity
+            pos = int(np.argmax(np.where(available, mmr_scores, -np.inf)))
+            max_similarity = pairwise[pos] if not order else np.maximum(max_similarity, pairwise[pos])
+            order.append(pos)
+            available[pos] = False
+
+            code = doc_codes[pos]
+            doc_counts[code] = doc_counts.get(code, 0) + 1
+            if doc_counts[code] >= Config.MAX_RESULTS_PER_DOC:
+                available &= doc_codes != code
+        return order
+
+    def result_vectors(self, results: List[SearchResult]) -> np.ndarray:
+        """搜索结果对应的段落向量（float32，存储中的维度），用于跨分片合并时计算结果间相似度"""
+        view = self._read_view()
+        rows = []
+        for result in results:
+            rows.append(next(row for row in view._doc_rows[result.doc_id]
+                             if view.paragraph_table.paragraph_index(row) == result.paragraph_index))
+        return np.asarray(view._embeddings[rows], dtype=np.float32).reshape(len(rows), -1)
+
+    def _diversify(self, order: np.ndarray, rows: np.ndarray, similarities: np.ndarray,
+                   combined_scores: np.ndarray, top_k: int,
+                   extra: Optional[Dict[str, np.ndarray]] = None) -> List[SearchResult]:
+        """多样化选择：按综合评分顺序选取，同一文档最多 Config.MAX_RESULTS_PER_DOC 个结果"""
         selected_results = []
-        selected_docs = []  # 改为列表以支持count方法
+        doc_counts: Dict[str, int] = {}
 
-        for idx, similarity, combined_score in scored_results:
+        for pos in order:
             if len(selected_results) >= top_k:
                 break
 
-            metadata = self.paragraph_metadata[idx]
-            doc_id = metadata["doc_id"]
+            doc_id = self.paragraph_table.doc_id(rows[pos])
 
             # 控制同一文档的结果数量
-            if selected_docs.count(doc_id) < 2:  # 每个文档最多2个结果
-                selected_docs.append(doc_id)
-                result = SearchResult(
-                    doc_id=doc_id,
-                    title=metadata["title"],
-                    paragraph=metadata["paragraph"],
-                    score=float(similarity),
-                    paragraph_index=metadata["paragraph_index"],
-                    metadata={
-                        "quality_score": metadata["quality_score"],
-                        "word_count": metadata["word_count"],
-                        "combined_score": combined_score
-                    }
-                )
-                selected_results.append(result)
+            if doc_counts.get(doc_id, 0) < Config.MAX_RESULTS_PER_DOC:
+                doc_counts[doc_id] = doc_counts.get(doc_id, 0) + 1
+                selected_results.append(self._make_result(pos, rows, similarities, combined_scores, extra))
 
         return selected_results
 
+    def _make_result(self, pos: int, rows: np.ndarray, similarities: np.ndarray, combined_scores: np.ndarray,
+                     extra: Optional[Dict[str, np.ndarray]] = None) -> SearchResult:
+        """由候选位置构造搜索结果（只为最终返回的结果调用）"""
+        row = rows[pos]
+        table = self.paragraph_table
+        result = SearchResult(
+            doc_id=table.doc_id(row),
+            title=table.title(row),
+            paragraph=table.text(row),
+            score=float(similarities[pos]),
+            paragraph_index=table.paragraph_index(row),
+            metadata={
+                "quality_score": round(float(self._quality[row]), 6),
+                "word_count": table.word_count(row),
+                "combined_score": float(combined_scores[pos])
+            }
+        )
+        for name, values in (extra or {}).items():
+            result.metadata[name] = float(values[pos])
+        return result
+
+    def _reset_index(self):
+        """清空全部段落数据与索引"""
+        self.documents = {}
+        self.paragraph_table = ParagraphTable()
+        self._embeddings = np.zeros((0, 0), dtype=self._embedding_dtype())
+        self._quality = np.zeros(0, dtype=np.float32)
+        self._size = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        self._live_lexical_length = 0
+        self._doc_rows = {}
+        self._source_type_masks = {}
+        self._path_index = []
+        self.ann_index = None
+        self.quantizer = None
+        self._codes = None
+        self.projection = None
+        self.lexical_index = self._new_lexical_index()
+        self.token_store = self._new_token_store()
+
+    @staticmethod
+    def _new_lexical_index() -> Optional[BM25Index]:
+        return BM25Index(k1=Config.BM25_K1, b=Config.BM25_B) if Config.LEXICAL_INDEX else None
+
+    @staticmethod
+    def _new_token_store() -> Optional[TokenStore]:
+        return TokenStore() if Config.PERSIST_TOKENS else None
+
+    def _rebuild_lexical_index(self):
+        """由分词结果构建BM25索引（旧快照未保存词法索引时使用，未保存分词结果的行重新分词）"""
+        self.lexical_index = self._new_lexical_index()
+        if self.lexical_index is None:
+            return
+        for row in range(len(self.paragraph_table)):
+            self.lexical_index.add(row, self._row_tokens(row))
+
+    def _recount_live_lexical_length(self):
+        """加载后按存活掩码重新统计存活行的总词数"""
+        if self.lexical_index is None:
+            self._live_lexical_length = 0
+            return
+        lengths = self.lexical_index.row_lengths(slice(0, self._size))
+        self._live_lexical_length = int(lengths[self._alive[:self._size]].sum(dtype=np.int64))
+
+    def _rebuild_token_store(self):
+        """对全部段落重新分词（旧快照未保存分词结果时使用）"""
+        self.token_store = self._new_token_store()
+        if self.token_store is None:
+            return
+        for row in range(len(self.paragraph_table)):
+            self.token_store.add(row, self.processor.segment_and_filter(self.paragraph_table.text(row)))
+
+    @staticmethod
+    def _mapped_file(array: Optional[np.ndarray], rows: int) -> Optional[str]:
+        """数组仍是快照中原样加载的内存映射文件时返回其路径（保存时可直接硬链接）"""
+        if isinstance(array, np.memmap) and array.shape[0] == rows:
+            return array.filename
+        return None
+
+    def published_snapshot_name(self) -> Optional[str]:
+        """存储目录中CURRENT指向的快照版本（可能已由其他进程发布，与 snapshot_name 不同）"""
+        return current_snapshot_name(self.storage_dir)
+
+    @property
+    def wal_dir(self) -> str:
+        return os.path.join(self.storage_dir, "wal")
+
+    def flush(self):
+        """持久化最近的修改：启用WAL时修改已写入日志，只在日志超过阈值时后台生成快照；否则立即保存快照"""
+        if self.wal is None:
+            self.save_to_file()
+        else:
+            self._maybe_schedule_snapshot()
+
+    def _maybe_schedule_snapshot(self):
+        """WAL超过阈值时在后台线程生成快照并清理已包含的日志段"""
+        if self.wal is None or self.wal.size() < Config.WAL_MAX_BYTES:
+            return
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+
+        self._snapshot_thread = threading.Thread(target=self.save_to_file, name="vector-store-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def wait_for_snapshot(self):
+        """等待进行中的后台快照完成"""
+        thread = self._snapshot_thread
+        if thread is not None:
+            thread.join()
+
+    def close(self):
+        """停止写入（存储被新版本替换后调用）：等待后台快照完成并关闭日志，已持有引用的查询仍可继续"""
+        self.wait_for_snapshot()
+        with self._lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+
     def save_to_file(self):
-        """保存向量存储到文件"""
-        data = {
-            "documents": self.documents,
-            "paragraph_embeddings": self.paragraph_embeddings,
-            "paragraph_metadata": self.paragraph_metadata,
-            "quality_scores": self.quality_scores
-        }
-        with open(self.storage_path, 'wb') as f:
-            pickle.dump(data, f)
-        logger.info(f"向量存储已保存到: {self.storage_path}")
+        """将向量存储保存为新快照目录（写完后原子切换CURRENT），并清理快照已包含的日志段
+
+        锁内只切换日志段并取得当前状态的视图（行数与各数组、索引对象的引用，以及文档集合的浅副本），
+        写入快照与清理日志在锁外进行，期间检索与写入照常进行，之后的修改记录在新日志段中。
+        """
+        with self._save_lock:
+            with self._lock:
+                # 先切换日志段：快照包含新段之前的全部修改，之后的修改写入新段
+                wal = self.wal or WriteAheadLog(self.wal_dir, fsync=Config.WAL_FSYNC)
+                wal_segment = wal.rotate()
+                if Config.WAL_ENABLED:
+                    self.wal = wal
+                view = self._read_view()
+                view.documents = (self.documents.copy() if isinstance(self.documents, LazyDocumentMap)
+                                  else dict(self.documents))
+                version = self._version
+
+            snapshot_dir, documents_info, columns = view._save_snapshot(wal_segment)
+            with self._lock:
+                self.snapshot_name = os.path.basename(snapshot_dir)
+                self._wal_segment = wal_segment
+            wal.remove_before(wal_segment)
+            if not Config.WAL_ENABLED:
+                wal.close()
+
+            if Config.LAZY_DOCUMENTS:
+                # 新增文档的正文与段落文本已写入快照，改为引用新快照的文本块，不再常驻内存；
+                # 新的段落表在锁外构建，保存期间有新修改（含压缩）时放弃替换，留待下次快照
+                strings = CachedStringTable(snapshot_dir, "texts", Config.LAZY_PARAGRAPH_CACHE_SIZE)
+                documents = LazyDocumentMap(strings, documents_info, Config.LAZY_DOCUMENT_CACHE_SIZE)
+                table = view._build_paragraph_table(strings, documents_info, *columns)
+                with self._write_lock, self._lock:
+                    if self._version == version:
+                        self.documents = documents
+                        self.paragraph_table = table
+        self.embedding_cache.save()
+
+    def _save_snapshot(self, wal_segment: int = 0) -> Tuple[str, List[Dict], Tuple[np.ndarray, ...]]:
+        """在检索视图上写入快照（不持有锁），返回 (快照目录, 文档信息, 段落列)"""
+        os.makedirs(self.storage_dir, exist_ok=True)
+        writer = SnapshotWriter(self.storage_dir)
+        try:
+            table = self.paragraph_table
+            documents_info = []
+            doc_positions = {}
+            doc_index = np.zeros(self._size, dtype=np.int32)
+            paragraph_index = np.zeros(self._size, dtype=np.int32)
+            word_count = np.zeros(self._size, dtype=np.int32)
+            text_index = np.zeros(self._size, dtype=np.int32)
+
+            def iter_strings():
+                """字符串表：每个文档依次写入全文和各段落，段落列式元数据引用其中的段落文本；
+                逐条产出，按需加载模式下不需要全部正文同时在内存中"""
+                count = 0
+                for position, document in enumerate(self.documents.values()):
+                    doc_positions[document.id] = (position, count)
+                    documents_info.append({
+                        "id": document.id,
+                        "title": document.title,
+                        "metadata": document.metadata,
+                        "created_at": document.created_at.isoformat() if document.created_at else None,
+                        "text_index": count,
+                        "paragraph_count": len(document.paragraphs)
+                    })
+                    yield document.content
+                    yield from document.paragraphs
+                    count += 1 + len(document.paragraphs)
+
+                for row in range(self._size):
+                    doc_id = table.doc_id(row)
+                    paragraph = table.text(row)
+                    position = doc_positions.get(doc_id)
+                    document = self.documents.get(doc_id)
+                    idx = table.paragraph_index(row)
+                    doc_index[row] = position[0] if position else -1
+                    paragraph_index[row] = idx
+                    word_count[row] = table.word_count(row)
+                    if position and idx < len(document.paragraphs) and document.paragraphs[idx] == paragraph:
+                        text_index[row] = position[1] + 1 + idx
+                    else:
+                        # 文档已被同ID文档覆盖等情况，单独保存段落文本
+                        text_index[row] = count
+                        count += 1
+                        yield paragraph
+
+            writer.write_strings("texts", iter_strings())
+            writer.write_json("documents.json", documents_info)
+            writer.write_array("doc_index.npy", doc_index)
+            writer.write_array("paragraph_index.npy", paragraph_index)
+            writer.write_array("word_count.npy", word_count)
+            writer.write_array("text_index.npy", text_index)
+            writer.write_array("alive.npy", self._alive[:self._size])
+            writer.write_array("quality.npy", self.quality_scores,
+                               link_from=self._mapped_file(self._quality, self._size))
+            writer.write_array("embeddings.npy", self.paragraph_embeddings,
+                               link_from=self._mapped_file(self._embeddings, self._size))
+
+            manifest = {
+                "model": Config.VECTOR_MODEL,
+                "documents": len(documents_info),
+                "paragraphs": self._size,
+                "dim": int(self._embeddings.shape[1]) if self._size else 0,
+                "quantizer": None,
+                "projection": None,
+                "ann_index": None,
+                "lexical_index": None,
+                "wal_segment": wal_segment
+            }
+
+            if self.quantizer is not None and self._codes is not None:
+                writer.write_array("codes.npy", self._codes[:self._size],
+                                   link_from=self._mapped_file(self._codes, self._size))
+                quantizer_data = self.quantizer.to_dict()
+                writer.write_array("quantizer_offset.npy", quantizer_data.pop("offset"))
+                writer.write_array("quantizer_scale.npy", quantizer_data.pop("scale"))
+                manifest["quantizer"] = quantizer_data
+
+            if self.projection is not None:
+                projection_data = self.projection.to_dict()
+                writer.write_array("projection_mean.npy", projection_data.pop("mean"))
+                writer.write_array("projection_components.npy", projection_data.pop("components"))
+                manifest["projection"] = projection_data
+
+            if self.ann_index is not None and self.ann_index.is_trained:
+                ann_data = self.ann_index.to_dict()
+                # 倒排列表可能已追加视图之后的行
+                lists = [ids[ids < self._size] for ids in ann_data.pop("lists")]
+                offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(ids) for ids in lists])
+                writer.write_array("ivf_centroids.npy", ann_data.pop("centroids"))
+                writer.write_array("ivf_lists.npy", np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64))
+                writer.write_array("ivf_list_offsets.npy", offsets)
+                manifest["ann_index"] = ann_data
+
+            if self.lexical_index is not None:
+                terms, lexical_arrays = self.lexical_index.to_arrays(self._size)
+                writer.write_strings("lexical_terms", terms)
+                for name, values in lexical_arrays.items():
+                    writer.write_array(f"lexical_{name}.npy", values)
+                manifest["lexical_index"] = {"k1": self.lexical_index.k1, "b": self.lexical_index.b}
+
+            if self.token_store is not None and self.token_store.num_rows >= self._size:
+                terms, token_arrays = self.token_store.to_arrays(self._size)
+                writer.write_strings("token_terms", terms)
+                for name, values in token_arrays.items():
+                    writer.write_array(f"token_{name}.npy", values)
+                manifest["tokens"] = True
+
+            snapshot_dir = writer.commit(manifest, keep=Config.STORAGE_KEEP_SNAPSHOTS)
+        except Exception:
+            writer.abort()
+            raise
+
+        logger.info(f"向量存储已保存到: {snapshot_dir}")
+        return snapshot_dir, documents_info, (doc_index, paragraph_index, word_count, text_index)
 
     def load_from_file(self):
-        """从文件加载向量存储"""
-        if os.path.exists(self.storage_path):
-            try:
-                with open(self.storage_path, 'rb') as f:
-                    data = pickle.load(f)
-
-                self.documents = data["documents"]
-                self.paragraph_embeddings = data["paragraph_embeddings"]
-                self.paragraph_metadata = data["paragraph_metadata"]
-                self.quality_scores = data.get("quality_scores", [])
-
-                logger.info(f"从文件加载向量存储: {self.storage_path}")
-            except Exception as e:
-                logger.error(f"加载向量存储失败: {str(e)}")
-        else:
-            logger.info("未找到存储文件，将创建新的向量存储")
\ No newline at end of file
+        """从当前快照目录加载向量存储（向量以内存映射方式打开），并重放快照之后的日志"""
+        with self._write_lock, self._lock:
+            self._version += 1
+            self._wal_segment = 0
+            self.snapshot_name = None
+            self.read_only = Config.SHARED_INDEX
+            self._load_snapshot()
+            # 共享只读索引只反映已发布的快照，日志由写入进程重放并生成新快照
+            if Config.WAL_ENABLED and not self.read_only:
+                self._replay_wal()
+
+    def _replay_wal(self):
+        """重放快照之后的日志记录，完成后打开日志用于追加（调用方持有锁）"""
+        if self.wal is not None:
+            self.wal.close()
+        self.wal = None
+        wal = WriteAheadLog(self.wal_dir, fsync=Config.WAL_FSYNC)
+
+        replayed = 0
+        for entry in wal.replay(self._wal_segment):
+            if entry["op"] == "upsert":
+                # 日志中带有段落向量，写入缓存后重放无需调用模型
+                if entry["model"] == self.model_key and entry["texts"]:
+                    self.embedding_cache.put_many(self.model_key, entry["texts"], entry["embeddings"])
+                self.add_documents([entry["document"]])
+            elif entry["op"] == "delete":
+                self.delete_document(entry["doc_id"])
+            replayed += 1
+
+        if replayed:
+            logger.info(f"重放WAL记录: {replayed} 条")
+        wal.open(self._wal_segment)
+        self.wal = wal
+
+    def _load_snapshot(self):
+        """加载快照（调用方持有锁）"""
+        snapshot_dir = current_snapshot_dir(self.storage_dir)
+        if snapshot_dir is None:
+            if os.path.exists(self.storage_path):
+                self._load_legacy_pickle()
+            else:
+                logger.info("未找到存储文件，将创建新的向量存储")
+            return
+
+        try:
+            self._reset_index()
+            manifest = load_json(snapshot_dir, "manifest.json")
+            self._wal_segment = manifest.get("wal_segment", 0)
+
+            # 文档：按需加载模式下只读入标题与元数据，正文和段落文本访问时从文本块读取
+            documents_info = load_json(snapshot_dir, "documents.json")
+            shared = self.read_only
+            if Config.LAZY_DOCUMENTS or shared:
+                strings = CachedStringTable(snapshot_dir, "texts", Config.LAZY_PARAGRAPH_CACHE_SIZE)
+                self.documents = LazyDocumentMap(strings, documents_info, Config.LAZY_DOCUMENT_CACHE_SIZE)
+            else:
+                strings = StringTable(snapshot_dir, "texts")
+                for info in documents_info:
+                    text_index = info["text_index"]
+                    paragraph_count = info["paragraph_count"]
+                    created_at = info.get("created_at")
+                    self.documents[info["id"]] = Document(
+                        id=info["id"],
+                        title=info["title"],
+                        content=strings[text_index],
+                        paragraphs=[strings[text_index + 1 + i] for i in range(paragraph_count)],
+                        metadata=info.get("metadata", {}),
+                        created_at=datetime.fromisoformat(created_at) if created_at else None
+                    )
+
+            # 段落列式元数据（共享只读索引直接引用内存映射的列）
+            doc_index = load_array(snapshot_dir, "doc_index.npy", mmap=shared)
+            paragraph_index = load_array(snapshot_dir, "paragraph_index.npy", mmap=shared)
+            word_count = load_array(snapshot_dir, "word_count.npy", mmap=shared)
+            text_index = load_array(snapshot_dir, "text_index.npy", mmap=shared)
+            self._embeddings = load_array(snapshot_dir, "embeddings.npy")
+            self._quality = load_array(snapshot_dir, "quality.npy")
+            self._size = manifest["paragraphs"]
+            alive = load_array(snapshot_dir, "alive.npy", mmap=shared)
+            if alive is None:
+                alive = np.ones(self._size, dtype=bool)
+            self._alive = alive if shared else alive.copy()
+            self._deleted_count = int(self._size - self._alive.sum())
+
+            if shared:
+                self.paragraph_table = ParagraphTable.from_columns(
+                    [info["id"] for info in documents_info], [info["title"] for info in documents_info],
+                    doc_index, paragraph_index, word_count, text_index, strings
+                )
+                if self._embeddings.dtype != self._embedding_dtype():
+                    logger.warning(f"快照向量精度为 {self._embeddings.dtype}，共享只读索引不做转换，"
+                                   f"需以 EMBEDDING_STORAGE={Config.EMBEDDING_STORAGE} 重建知识库才能生效")
+            else:
+                self.paragraph_table = self._build_paragraph_table(strings, documents_info, doc_index,
+                                                                   paragraph_index, word_count, text_index)
+                self.convert_embedding_storage()
+            self._rebuild_doc_rows()
+            self._rebuild_source_type_masks()
+            self._rebuild_path_index()
+
+            # 降维投影：快照中的向量已是投影后的低维向量，无论当前配置如何都必须沿用
+            if manifest.get("projection") is not None:
+                self.projection = EmbeddingProjection.from_dict(dict(
+                    manifest["projection"],
+                    mean=load_array(snapshot_dir, "projection_mean.npy", mmap=False),
+                    components=load_array(snapshot_dir, "projection_components.npy", mmap=False)
+                ))
+                if (Config.PROJECTION, Config.PROJECTION_DIM) != (self.projection.mode, self.projection.dim):
+                    logger.warning(f"快照使用 {self.projection.mode} 投影到 {self.projection.dim} 维，"
+                                   f"与当前配置不一致，需重建知识库才能生效")
+
+            # 量化码
+            if manifest.get("quantizer") is not None:
+                self.quantizer = ScalarQuantizer.from_dict(dict(
+                    manifest["quantizer"],
+                    offset=load_array(snapshot_dir, "quantizer_offset.npy", mmap=False),
+                    scale=load_array(snapshot_dir, "quantizer_scale.npy", mmap=False)
+                ))
+                self._codes = load_array(snapshot_dir, "codes.npy")
+            elif shared:
+                # 共享只读索引只使用构建进程发布的结构，不在本进程私自训练（否则每个进程各占一份内存）
+                if self._quantization_enabled():
+                    logger.warning("快照未包含int8量化码，共享只读索引跳过量化粗排，需在构建进程中重建知识库才能生效")
+            else:
+                self._update_quantized_codes(0)
+
+            # ANN索引：有则直接恢复，否则按当前配置重建
+            if manifest.get("ann_index") is not None and self._ann_enabled():
+                ivf_lists = load_array(snapshot_dir, "ivf_lists.npy")
+                offsets = load_array(snapshot_dir, "ivf_list_offsets.npy", mmap=False)
+                self.ann_index = IVFIndex.from_dict(dict(
+                    manifest["ann_index"],
+                    centroids=load_array(snapshot_dir, "ivf_centroids.npy", mmap=False),
+                    lists=[ivf_lists[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+                ))
+            elif shared:
+                if self._ann_enabled() and self._size >= Config.ANN_MIN_PARAGRAPHS:
+                    logger.warning("快照未包含ANN索引，共享只读索引改用精确检索，需在构建进程中重建知识库才能生效")
+            else:
+                self.build_ann_index()
+
+            # 分词结果（只用于重新评分与压缩，共享只读索引不加载）
+            if shared:
+                self.token_store = None
+            elif manifest.get("tokens") and Config.PERSIST_TOKENS:
+                terms = StringTable(snapshot_dir, "token_terms")
+                self.token_store = TokenStore.from_arrays(
+                    [terms[i] for i in range(len(terms))],
+                    {name: load_array(snapshot_dir, f"token_{name}.npy", mmap=False) for name in ("ids", "offsets")}
+                )
+            else:
+                self._rebuild_token_store()
+
+            # BM25词法索引
+            lexical_params = manifest.get("lexical_index")
+            if lexical_params is not None and Config.LEXICAL_INDEX:
+                terms = StringTable(snapshot_dir, "lexical_terms")
+                self.lexical_index = BM25Index.from_arrays(
+                    [terms[i] for i in range(len(terms))],
+                    {name: load_array(snapshot_dir, f"lexical_{name}.npy", mmap=shared)
+                     for name in ("rows", "tfs", "offsets", "lengths")},
+                    k1=lexical_params["k1"], b=lexical_params["b"], mapped=shared
+                )
+            elif shared:
+                if Config.LEXICAL_INDEX:
+                    logger.warning("快照未包含BM25词法索引，共享只读索引只做向量检索，需在构建进程中重建知识库才能生效")
+                self.lexical_index = None
+            else:
+                self._rebuild_lexical_index()
+            self._recount_live_lexical_length()
+
+            self.snapshot_name = os.path.basename(snapshot_dir)
+            logger.info(f"从快照加载向量存储: {snapshot_dir}, 段落数: {self._size}")
+        except Exception as e:
+            logger.error(f"加载向量存储失败: {str(e)}")
+            self._reset_index()
+
+    def _build_paragraph_table(self, strings: StringTable, documents_info: List[Dict], doc_index: np.ndarray,
+                               paragraph_index: np.ndarray, word_count: np.ndarray,
+                               text_index: np.ndarray) -> ParagraphTable:
+        """由快照的段落列构建段落表；按需加载模式下段落文本引用快照文本块，
+        否则引用已加载的文档对象中的段落（已被覆盖的文档的段落单独读入内存）"""
+        table = ParagraphTable(self._size)
+        lazy = isinstance(strings, CachedStringTable)
+        if lazy:
+            table.text_source = strings
+        doc_positions = {}
+        for row in range(self._size):
+            position = int(doc_index[row])
+            info = documents_info[position] if position >= 0 else None
+            if position not in doc_positions:
+                document = self.documents.get(info["id"]) if info and not lazy else None
+                doc_positions[position] = table.add_document(info["id"] if info else "",
+                                                             info["title"] if info else "", document)
+            idx = int(paragraph_index[row])
+            if lazy:
+                table.append_ref(doc_positions[position], idx, int(text_index[row]), int(word_count[row]))
+            elif info and text_index[row] == info["text_index"] + 1 + idx:
+                table.append_paragraph(doc_positions[position], idx, int(word_count[row]))
+            else:
+                table.append(doc_positions[position], idx, strings[text_index[row]], int(word_count[row]))
+        return table
+
+    def _load_legacy_pickle(self):
+        """从旧版单文件pickle加载，下次保存时自动迁移为快照目录格式"""
+        try:
+            with open(self.storage_path, 'rb') as f:
+                data = pickle.load(f)
+
+            self._reset_index()
+            self.documents = data["documents"]
+            paragraph_metadata = data["paragraph_metadata"]
+            for metadata in paragraph_metadata:
+                doc_position = self.paragraph_table.add_document(metadata["doc_id"], metadata["title"])
+                self.paragraph_table.append(doc_position, metadata["paragraph_index"], metadata["paragraph"],
+                                            metadata.get("word_count", 0))
+
+            # 兼容旧格式：向量以列表形式保存且未归一化
+            embeddings = data["paragraph_embeddings"]
+            quality_scores = data.get("quality_scores")
+            if quality_scores is None or len(quality_scores) != len(paragraph_metadata):
+                quality_scores = [m.get("quality_score", 0.0) for m in paragraph_metadata]
+
+            if embeddings is None:
+                # 量化格式：原始向量保存在旁路.npy文件中
+                self._embeddings = np.load(self.vectors_path, mmap_mode='r')
+                self._quality = np.asarray(quality_scores, dtype=np.float32)
+                self._size = self._embeddings.shape[0]
+                self._alive = np.ones(self._size, dtype=bool)
+                self.quantizer = ScalarQuantizer.from_dict(data["quantizer"])
+                self._codes = data["paragraph_codes"]
+            elif len(embeddings) > 0:
+                self._append_rows(np.vstack(embeddings), quality_scores)
+                self._update_quantized_codes(0)
+            self.convert_embedding_storage()
+            self._rebuild_doc_rows()
+            self._rebuild_source_type_masks()
+            self._rebuild_path_index()
+
+            # ANN索引：有则直接恢复，否则按当前配置重建
+            ann_data = data.get("ann_index")
+            if ann_data is not None and self._ann_enabled():
+                self.ann_index = IVFIndex.from_dict(ann_data)
+            else:
+                self.build_ann_index()
+            self._rebuild_token_store()
+            self._rebuild_lexical_index()
+            self._recount_live_lexical_length()
+
+            logger.info(f"从旧版文件加载向量存储: {self.storage_path}")
+        except Exception as e:
+            logger.error(f"加载向量存储失败: {str(e)}")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+预写日志（WAL）模块
+
+目录结构：
+    <root>/wal/wal-<序号>.log      追加写入的日志段
+
+每条记录为 [长度 uint32][CRC32 uint32][载荷]，载荷为
+[头部长度 uint32][JSON头部][float32段落向量]。快照的manifest记录其已包含
+哪些日志段（wal_segment 之前的段），加载快照后只需重放其后的日志段。
+"""
+
+import os
+import json
+import zlib
+import struct
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from data_models import Document
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+RECORD_HEADER = struct.Struct("<II")
+PAYLOAD_HEADER = struct.Struct("<I")
+
+class WriteAheadLog:
+    """按段追加的文档级修改日志（upsert / delete）"""
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        self._file = None
+        self._segment = 0
+        self._lock = threading.Lock()
+
+    @property
+    def segment(self) -> int:
+        """当前写入的日志段序号"""
+        return self._segment
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:08d}{SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[int]:
+        """按序号列出已有日志段"""
+        if not os.path.isdir(self.directory):
+            return []
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def size(self) -> int:
+        """全部日志段的总字节数"""
+        return sum(os.path.getsize(self._segment_path(segment)) for segment in self.segments())
+
+    def open(self, min_segment: int = 1):
+        """打开最新的日志段用于追加（不存在或早于 min_segment 时新建）"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = self.segments()
+            self._open_segment(max(segments[-1] if segments else 0, min_segment))
+
+    def _open_segment(self, segment: int):
+        if self._file is not None:
+            self._file.close()
+        self._segment = segment
+        self._file = open(self._segment_path(segment), 'ab')
+
+    def rotate(self) -> int:
+        """切换到新的日志段，返回新段序号（此前的段可在快照完成后删除）"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = self.segments()
+            self._open_segment(max(segments[-1] if segments else 0, self._segment) + 1)
+            return self._segment
+
+    def remove_before(self, segment: int):
+        """删除序号小于 segment 的日志段（已被快照包含）"""
+        for old_segment in self.segments():
+            if old_segment < segment:
+                try:
+                    os.remove(self._segment_path(old_segment))
+                except OSError as e:
+                    logger.warning(f"删除日志段失败 {old_segment}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def append_upsert(self, document: Document, model_name: str, texts: List[str], embeddings: np.ndarray):
+        """记录新增/替换文档，附带已编码的段落向量（重放时无需再次调用模型）"""
+        header = {
+            "op": "upsert",
+            "model": model_name,
+            "document": {
+                "id": document.id,
+                "title": document.title,
+                "content": document.content,
+                "paragraphs": document.paragraphs,
+                "metadata": document.metadata,
+                "created_at": document.created_at.isoformat() if document.created_at else None
+            },
+            "texts": texts,
+            "dim": int(embeddings.shape[1]) if len(texts) else 0
+        }
+        self._append(header, np.ascontiguousarray(embeddings, dtype=np.float32).tobytes() if len(texts) else b"")
+
+    def append_delete(self, doc_id: str):
+        """记录删除文档"""
+        self._append({"op": "delete", "doc_id": doc_id}, b"")
+
+    def _append(self, header: Dict, data: bytes):
+        header_bytes = json.dumps(header, ensure_ascii=False, default=str).encode('utf-8')
+        payload = PAYLOAD_HEADER.pack(len(header_bytes)) + header_bytes + data
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._file is None:
+                raise RuntimeError("WAL未打开")
+            self._file.write(record)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def replay(self, start_segment: int = 0) -> Iterator[Dict]:
+        """依次读出 start_segment 及之后日志段中的记录；遇到不完整或校验失败的记录时截断该段"""
+        for segment in self.segments():
+            if segment < start_segment:
+                continue
+            path = self._segment_path(segment)
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            position = 0
+            while position < len(data):
+                record = self._decode(data, position)
+                if record is None:
+                    logger.warning(f"日志段 {segment} 在偏移 {position} 处不完整，截断剩余 {len(data) - position} 字节")
+                    with open(path, 'r+b') as f:
+                        f.truncate(position)
+                    break
+                entry, position = record
+                yield entry
+
+    @staticmethod
+    def _decode(data: bytes, position: int):
+        """解码一条记录，返回 (记录, 下一条位置)；数据不完整或损坏时返回None"""
+        if position + RECORD_HEADER.size > len(data):
+            return None
+        length, crc = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return None
+
+        header_length, = PAYLOAD_HEADER.unpack_from(payload, 0)
+        header_end = PAYLOAD_HEADER.size + header_length
+        entry = json.loads(payload[PAYLOAD_HEADER.size:header_end].decode('utf-8'))
+        if entry["op"] == "upsert":
+            info = entry["document"]
+            created_at = info.get("created_at")
+            entry["document"] = Document(
+                id=info["id"],
+                title=info["title"],
+                content=info["content"],
+                paragraphs=info["paragraphs"],
+                metadata=info.get("metadata", {}),
+                created_at=datetime.fromisoformat(created_at) if created_at else None
+            )
+            dim = entry["dim"]
+            entry["embeddings"] = np.frombuffer(payload[header_end:], dtype=np.float32).reshape(-1, dim) \
+                if dim else np.zeros((0, 0), dtype=np.float32)
+        return entry, start + length
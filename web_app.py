@@ -17,11 +17,24 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
+# 构造本身很轻量，知识库与模型在后台预热线程中加载，启动后即可响应健康检查
 rag_system = AdvancedRAGSystem()
+rag_system.start_warmup()
 
 # 注册数据清洗模块蓝图
 app.register_blueprint(data_cleaner_bp)
 
+@app.route('/health')
+def health():
+    """存活检查：进程可以响应请求即返回"""
+    return jsonify({"status": "ok"})
+
+@app.route('/ready')
+def ready():
+    """就绪检查：知识库与向量模型加载完成后返回200，否则（含预热失败，见 error）返回503"""
+    readiness = dict(rag_system.readiness)
+    return jsonify(readiness), 200 if readiness["ready"] else 503
+
 @app.route('/')
 def index():
     """主页"""
@@ -39,9 +52,12 @@ def get_knowledge_base_data():
         # 获取基本统计信息
         stats = rag_system.get_system_stats()
 
+        # 知识库可能在请求期间被替换，只取一次存储引用
+        store = rag_system.vector_store
+
         # 获取文档详细信息
         documents_info = []
-        for doc_id, document in rag_system.vector_store.documents.items():
+        for doc_id, document in store.documents.items():
             doc_info = {
                 'id': document.id,
                 'title': document.title,
@@ -55,18 +71,16 @@ def get_knowledge_base_data():
 
         # 获取段落统计信息
         paragraphs_info = []
-        for i, metadata in enumerate(rag_system.vector_store.paragraph_metadata):
-            if i < len(rag_system.vector_store.quality_scores):
-                quality_score = rag_system.vector_store.quality_scores[i]
-            else:
-                quality_score = 0.0
+        for i, metadata in store.iter_paragraphs():
+            quality_score = metadata.get('quality_score', 0.0)
+            content = metadata.get('paragraph', '')
 
             para_info = {
                 'index': i,
                 'doc_id': metadata.get('doc_id', 'Unknown'),
                 'paragraph_index': metadata.get('paragraph_index', 0),
                 'quality_score': round(quality_score, 3),
-                'content': metadata.get('content', '')[:100] + '...' if len(metadata.get('content', '')) > 100 else metadata.get('content', '')
+                'content': content[:100] + '...' if len(content) > 100 else content
             }
             paragraphs_info.append(para_info)
 
@@ -84,23 +98,22 @@ def get_knowledge_base_data():
 def get_document_detail(doc_id):
     """获取文档详细内容API"""
     try:
-        if doc_id not in rag_system.vector_store.documents:
+        store = rag_system.vector_store
+        if doc_id not in store.documents:
             return jsonify({'success': False, 'error': '文档不存在'})
 
-        document = rag_system.vector_store.documents[doc_id]
+        document = store.documents[doc_id]
 
         # 获取该文档的所有段落信息
         doc_paragraphs = []
-        for i, metadata in enumerate(rag_system.vector_store.paragraph_metadata):
-            if metadata.get('doc_id') == doc_id:
-                quality_score = rag_system.vector_store.quality_scores[i] if i < len(rag_system.vector_store.quality_scores) else 0.0
-                para_info = {
-                    'index': i,
-                    'paragraph_index': metadata.get('paragraph_index', 0),
-                    'content': metadata.get('content', ''),
-                    'quality_score': round(quality_score, 3)
-                }
-                doc_paragraphs.append(para_info)
+        for i, metadata in store.iter_paragraphs(doc_id):
+            para_info = {
+                'index': i,
+                'paragraph_index': metadata.get('paragraph_index', 0),
+                'content': metadata.get('paragraph', ''),
+                'quality_score': round(metadata.get('quality_score', 0.0), 3)
+            }
+            doc_paragraphs.append(para_info)
 
         doc_detail = {
             'id': document.id,
@@ -139,6 +152,51 @@ def build_knowledge_base():
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
+@app.route('/reload', methods=['POST'])
+def reload_knowledge_base():
+    """重新加载已发布的最新快照API（加载完成后原子替换，期间查询不中断）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = rag_system.reload_knowledge_base(force=bool(data.get('force', False)))
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+@app.route('/documents', methods=['POST'])
+def upsert_document():
+    """新增或替换单个文档API（只重新编码该文档）"""
+    try:
+        data = request.json or {}
+        file_path = data.get('file_path')
+        doc_id = data.get('doc_id')
+        content = data.get('content')
+
+        if not file_path and not (doc_id and content):
+            return jsonify({"success": False, "message": "请提供file_path，或doc_id与content"})
+
+        result = rag_system.upsert_document(
+            file_path=file_path,
+            doc_id=doc_id,
+            title=data.get('title'),
+            content=content,
+            metadata=data.get('metadata')
+        )
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
+@app.route('/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    """删除文档API"""
+    try:
+        result = rag_system.delete_document(doc_id)
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)})
+
 @app.route('/upload_images', methods=['POST'])
 def upload_images():
     """上传图片并进行OCR处理API"""
@@ -217,6 +275,7 @@ def add_images_to_knowledge_base():
         processed_count = 0
         failed_count = 0
         ocr_results = []
+        documents = []
 
         for file in files:
             if file.filename == '':
@@ -239,7 +298,7 @@ def add_images_to_knowledge_base():
                 document = rag_system.image_processor.create_document_from_ocr(ocr_result)
 
                 if document:
-                    rag_system.vector_store.add_document(document)
+                    documents.append(document)
                     processed_count += 1
                     ocr_results.append({
                         "filename": file.filename,
@@ -263,9 +322,9 @@ def add_images_to_knowledge_base():
                     "error": str(e)
                 })
 
-        # 保存更新后的向量存储
-        if processed_count > 0:
-            rag_system.vector_store.save_to_file()
+        # 统一追加到当前知识库：修改逐条写入WAL，只在日志超过阈值时后台生成快照
+        if documents:
+            rag_system.add_documents(documents)
 
         return jsonify({
             "success": True,
@@ -288,11 +347,12 @@ def query():
         data = request.json
         query_text = data.get('query')
         session_id = data.get('session_id')
+        filters = data.get('filters')
 
         if not query_text:
             return jsonify({"success": False, "message": "请提供查询内容"})
 
-        result = rag_system.intelligent_query(query_text, session_id)
+        result = rag_system.intelligent_query(query_text, session_id, filters=filters)
         return jsonify(result)
 
     except Exception as e:
@@ -305,6 +365,7 @@ def query_stream():
         data = request.json
         query_text = data.get('query')
         session_id = data.get('session_id')
+        filters = data.get('filters')
 
         if not query_text:
             def error_stream():
@@ -314,7 +375,7 @@ def query_stream():
         def generate():
             try:
                 # 直接使用intelligent_query_stream方法处理流式响应
-                for chunk in rag_system.intelligent_query_stream(query_text, session_id):
+                for chunk in rag_system.intelligent_query_stream(query_text, session_id, filters=filters):
                     # 确保内容是正确的UTF-8字符串
                     try:
                         if "data" in chunk and "content" in chunk["data"]: